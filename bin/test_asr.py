@@ -11,6 +11,7 @@ from src.asr import ASR
 from src.decode import BeamDecoder #, CTCBeamDecoder
 from src.data import load_dataset
 from src.audio import Delta, Postprocess
+from src.util import autocast
 
 class Solver(BaseSolver):
     ''' Solver for training'''
@@ -52,6 +53,11 @@ class Solver(BaseSolver):
 
     def load_data(self):
         ''' Load data for training/validation, store tokenizer and input/output shape'''
+        # Features are extracted by data loader (beam decoding takes data directly)
+        if self.config['data']['audio'].get('batch_feature') == 'device':
+            self.config['data']['audio']['batch_feature'] = True
+        for key in ['speed_perturb', 'gain_db', 'noise_bank']:
+            self.config['data']['audio'].pop(key, None)
         self.dv_set, self.tt_set, self.feat_dim, self.vocab_size, self.tokenizer, msg = \
                          load_dataset(self.paras.njobs, self.paras.gpu, self.paras.pin_memory, False, **self.config['data'])
         self.verbose(msg)
@@ -101,7 +107,7 @@ class Solver(BaseSolver):
             feat, feat_len, txt, txt_len = self.fetch_data(data)
 
             # Forward model
-            with torch.no_grad():
+            with torch.no_grad(), self.autocast():
                 ctc_output, encode_len, att_output, att_align, dec_state = \
                     self.decoder( feat, feat_len, int(float(feat_len.max()) * self.config['decode']['max_len_ratio']), 
                                     emb_decoder=self.emb_decoder)
@@ -146,7 +152,8 @@ class Solver(BaseSolver):
                     f.write('idx\tbeam\thyp\ttruth\n')
                 self.verbose('Performing instance-wise beam decoding on {} set. (NOTE: use --njobs to speedup)'.format(s))
                 # Minimal function to pickle
-                beam_decode_func = partial(beam_decode, model=copy.deepcopy(self.decoder).to(self.device), device=self.device)
+                beam_decode_func = partial(beam_decode, model=copy.deepcopy(self.decoder).to(self.device), device=self.device,
+                                           amp=self.amp, amp_dtype=self.amp_dtype)
                 # Parallel beam decode
                 results = Parallel(n_jobs=self.paras.njobs)(delayed(beam_decode_func)(data) for data in tqdm(ds))
                 self.verbose('Results/Beams will be stored at {}/{}.'.format(self.cur_output_path,self.cur_beam_path))
@@ -176,7 +183,7 @@ class Solver(BaseSolver):
                     for b,hyp in enumerate(hyp_seqs):
                         f.write('\t'.join([name,str(b),hyp,truth])+'\n')
 
-def beam_decode(data, model, device):
+def beam_decode(data, model, device, amp=False, amp_dtype=None):
     # Fetch data : move data/model to device
     name, feat, feat_len, txt = data
     feat = feat.to(device)
@@ -184,7 +191,7 @@ def beam_decode(data, model, device):
     txt = txt.to(device)
     txt_len = torch.sum(txt!=0,dim=-1)
     # Decode
-    with torch.no_grad():
+    with torch.no_grad(), autocast(device, amp, amp_dtype):
         hyps = model(feat, feat_len)
 
     hyp_seqs = [hyp.outIndex for hyp in hyps]
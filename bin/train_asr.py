@@ -8,7 +8,7 @@ from src.asr import ASR
 from src.optim import Optimizer
 from src.data import load_dataset
 from src.util import human_format, cal_er, feat_to_fig
-from src.audio import Delta, Postprocess
+from src.audio import Delta, Postprocess, create_transform
 
 EMPTY_CACHE_STEP = 100
 
@@ -20,7 +20,14 @@ class Solver(BaseSolver):
         # Curriculum learning affects data loader
         self.curriculum = self.config['hparas']['curriculum']
         self.val_mode = self.config['hparas']['val_mode'].lower()
+        # Number of decode steps per chunk for attention loss (0: no chunking)
+        self.loss_chunk = self.config['hparas'].get('loss_chunk', 0)
         self.WER = 'per' if self.val_mode == 'per' else 'wer'
+        # Gradient accumulation to reach target frames per update (over all processes) w/ frame-budget batching
+        accum_frames = self.config['hparas'].get('accum_frames', 0)
+        batch_frames = self.config['data']['corpus'].get('batch_frames')
+        assert accum_frames == 0 or batch_frames is not None, 'accum_frames requires batch_frames of corpus'
+        self.accum_step = max(1, round(accum_frames / (batch_frames * self.world_size))) if accum_frames else 1
 
     def fetch_data(self, data, train=False):
         ''' Move data to device and compute text seq. length'''
@@ -30,16 +37,28 @@ class Solver(BaseSolver):
         feat_len = feat_len.to(self.device)
         txt = txt.to(self.device)
         txt_len = torch.sum(txt!=0,dim=-1)
+        if self.feat_transform is not None:
+            # Padded waveforms -> features, validation is not augmented
+            feat, feat_len = self.feat_transform.extract(feat, feat_len, augment=train)
         
         return feat, feat_len, txt, txt_len
 
     def load_data(self):
         ''' Load data for training/validation, store tokenizer and input/output shape'''
+        # Long utterances keep full batch size if activation checkpointing is enabled
+        self.half_batch = not (self.config['model']['encoder'].get('checkpoint', False) or
+                               self.config['model']['decoder'].get('checkpoint', 0))
         self.tr_set, self.dv_set, self.feat_dim, self.vocab_size, self.tokenizer, msg = \
                          load_dataset(self.paras.njobs, self.paras.gpu, self.paras.pin_memory, 
                                       self.curriculum>0,
+                                      half_batch=self.half_batch, rank=self.rank, world_size=self.world_size,
+                                      seed=self.paras.seed,
                                       **self.config['data'])
         self.verbose(msg)
+        # Features of whole batch are extracted on device, data loader only pads waveforms
+        self.feat_transform = None
+        if self.config['data']['audio'].get('batch_feature') == 'device':
+            self.feat_transform = create_transform(self.config['data']['audio'].copy())[0].to(self.device)
 
         # Dev set sames
         self.dv_names = []
@@ -91,7 +110,7 @@ class Solver(BaseSolver):
         self.verbose(self.optimizer.create_msg())
 
         # Enable AMP if needed
-        self.enable_apex()
+        self.enable_amp()
         
         # Transfer Learning
         if self.transfer_learning:
@@ -112,67 +131,92 @@ class Solver(BaseSolver):
                 self.model.decoder.fix_layers()
             if self.fix_dec and self.model.enable_ctc:
                 self.model.fix_ctc_layer()
+        # Forward pass of training goes through DDP (gradients averaged over processes) if distributed
+        self.ddp_model = self.wrap_ddp(self.model)
+        if self.emb_reg:
+            self.ddp_emb_decoder = self.wrap_ddp(self.emb_decoder, find_unused_parameters=True)
         
-        n_epochs = 0
+        if self.accum_step > 1:
+            self.verbose('Accumulate gradients of {} batches per update.'.format(self.accum_step))
+        n_epochs, n_accum = 0, 0
         self.timer.set()
 
         while self.step< self.max_step:
-            ctc_loss, att_loss, emb_loss = None, None, None
+            ctc_loss, att_loss, emb_loss, att_pred = None, None, None, None
             # Renew dataloader to enable random sampling 
             if self.curriculum>0 and n_epochs==self.curriculum:
                 self.verbose('Curriculum learning ends after {} epochs, starting random sampling.'.format(n_epochs))
                 self.tr_set, _, _, _, _, _ = \
                          load_dataset(self.paras.njobs, self.paras.gpu, self.paras.pin_memory, 
-                                      False, **self.config['data'])
+                                      False, half_batch=self.half_batch, rank=self.rank, world_size=self.world_size,
+                                      seed=self.paras.seed,
+                                      **self.config['data'])
+            # Reshuffle batches of samplers (or shards of streamed dataset) w/ fixed seed (shared by all processes)
+            for sampler in [self.tr_set.sampler, self.tr_set.batch_sampler, self.tr_set.dataset]:
+                if hasattr(sampler, 'set_epoch'):
+                    sampler.set_epoch(n_epochs)
             for data in self.tr_set:
-                # Pre-step : update tf_rate/lr_rate and do zero_grad
-                tf_rate = self.optimizer.pre_step(self.step)
+                # Pre-step : update tf_rate/lr_rate and do zero_grad (once per update)
+                if n_accum == 0:
+                    tf_rate = self.optimizer.pre_step(self.step)
+                n_accum += 1
+                update = n_accum == self.accum_step
                 total_loss = 0
                 
                 # Fetch data
                 feat, feat_len, txt, txt_len = self.fetch_data(data, train=True)
                 self.timer.cnt('rd')
 
-                # Forward model
+                # Forward model (w/ mixed precision if enabled)
                 # Note: txt should NOT start w/ <sos>
-                ctc_output, encode_len, att_output, att_align, dec_state = \
-                    self.model( feat, feat_len, max(txt_len), tf_rate=tf_rate,
-                                    teacher=txt, get_dec_state=self.emb_reg)
-                # Clear not used objects
-                del att_align
+                # Attention maps are not needed, logits are only computed along w/ loss (see ASR.att_loss)
+                # unless embedding regularization is enabled
+                # Gradients are only averaged over processes at the last batch of accumulation
+                with self.autocast(), self.no_sync(not update):
+                    ctc_output, encode_len, att_output, _, dec_state = \
+                        self.ddp_model( feat, feat_len, max(txt_len), tf_rate=tf_rate,
+                                        teacher=txt, get_dec_state=self.emb_reg,
+                                        get_att_seq=False, get_att_output=self.emb_reg)
 
-                # Plugins
-                if self.emb_reg:
-                    emb_loss, fuse_output = self.emb_decoder( dec_state, att_output, label=txt) 
-                    total_loss += self.emb_decoder.weight*emb_loss
-                else:
-                    del dec_state
+                    # Plugins
+                    if self.emb_reg:
+                        emb_loss, fuse_output = self.ddp_emb_decoder( dec_state, att_output, label=txt) 
+                        total_loss += self.emb_decoder.weight*emb_loss
+                        del dec_state
                 
-                # Compute all objectives
-                if ctc_output is not None:
-                    if self.paras.cudnn_ctc:
-                        ctc_loss = self.ctc_loss(ctc_output.transpose(0,1), 
-                                                 txt.to_sparse().values().to(device='cpu',dtype=torch.int32),
-                                                 [ctc_output.shape[1]]*len(ctc_output),
-                                                 #[int(encode_len.max()) for _ in encode_len],
-                                                 txt_len.cpu().tolist())
-                    else:
-                        ctc_loss = self.ctc_loss(ctc_output.transpose(0,1), txt, encode_len, txt_len)
-                    total_loss += ctc_loss*self.model.ctc_weight
-                    del encode_len
+                    # Compute all objectives
+                    if ctc_output is not None:
+                        if self.paras.cudnn_ctc:
+                            ctc_loss = self.ctc_loss(ctc_output.transpose(0,1), 
+                                                     txt.to_sparse().values().to(device='cpu',dtype=torch.int32),
+                                                     [ctc_output.shape[1]]*len(ctc_output),
+                                                     #[int(encode_len.max()) for _ in encode_len],
+                                                     txt_len.cpu().tolist())
+                        else:
+                            ctc_loss = self.ctc_loss(ctc_output.transpose(0,1), txt, encode_len, txt_len)
+                        total_loss += ctc_loss*self.model.ctc_weight
+                        del encode_len
 
-                if att_output is not None:
-                    b,t,_ = att_output.shape
-                    att_output = fuse_output if self.emb_fuse else att_output
-                    att_loss = self.seq_loss(att_output.view(b*t,-1),txt.view(-1))
-                    # Sum each uttr and devide by length then mean over batch
-                    # att_loss = torch.mean(torch.sum(att_loss.view(b,t),dim=-1)/torch.sum(txt!=0,dim=-1).float())
-                    total_loss += att_loss*(1-self.model.ctc_weight)
+                    if att_output is not None:
+                        b,t,_ = att_output.shape
+                        att_output = fuse_output if self.emb_fuse else att_output
+                        att_loss = self.seq_loss(att_output.view(b*t,-1),txt.view(-1))
+                        att_pred = att_output.argmax(dim=-1)
+                        # Sum each uttr and devide by length then mean over batch
+                        # att_loss = torch.mean(torch.sum(att_loss.view(b,t),dim=-1)/torch.sum(txt!=0,dim=-1).float())
+                        total_loss += att_loss*(1-self.model.ctc_weight)
+                    elif dec_state is not None:
+                        att_loss, att_pred = self.model.att_loss(dec_state, txt, self.loss_chunk)
+                        total_loss += att_loss*(1-self.model.ctc_weight)
+                        del dec_state
 
                 self.timer.cnt('fw')
 
                 # Backprop
-                grad_norm = self.backward(total_loss)
+                grad_norm = self.backward(total_loss / self.accum_step, optimize=update)
+                if not update:
+                    continue
+                n_accum = 0
                 self.step+=1
                 
                 # Logger
@@ -180,10 +224,10 @@ class Solver(BaseSolver):
                     self.progress('Tr stat | Loss - {:.2f} | Grad. Norm - {:.2f} | {}'\
                             .format(total_loss.cpu().item(),grad_norm,self.timer.show()))
                     self.write_log('emb_loss',{'tr':emb_loss})
-                    if att_output is not None:
+                    if att_loss is not None:
                         self.write_log('loss',{'tr_att':att_loss})
-                        self.write_log(self.WER,{'tr_att':cal_er(self.tokenizer,att_output,txt)})
-                        self.write_log(   'cer',{'tr_att':cal_er(self.tokenizer,att_output,txt,mode='cer')})
+                        self.write_log(self.WER,{'tr_att':cal_er(self.tokenizer,att_pred,txt)})
+                        self.write_log(   'cer',{'tr_att':cal_er(self.tokenizer,att_pred,txt,mode='cer')})
                     if ctc_output is not None:
                         self.write_log('loss',{'tr_ctc':ctc_loss})
                         self.write_log(self.WER,{'tr_ctc':cal_er(self.tokenizer,ctc_output,txt,ctc=True)})
@@ -214,7 +258,8 @@ class Solver(BaseSolver):
                 self.timer.set()
                 if self.step > self.max_step:break
             n_epochs +=1
-        self.log.close()
+        if self.log is not None:
+            self.log.close()
         print('[INFO] Finished training after', human_format(self.max_step), 'steps.')
         
     def validate(self, _dv_set, _name):
@@ -231,7 +276,7 @@ class Solver(BaseSolver):
             feat, feat_len, txt, txt_len = self.fetch_data(data)
 
             # Forward model
-            with torch.no_grad():
+            with torch.no_grad(), self.autocast():
                 ctc_output, encode_len, att_output, att_align, dec_state = \
                     self.model( feat, feat_len, int(max(txt_len)*self.DEV_STEP_RATIO), 
                                     emb_decoder=self.emb_decoder)
@@ -257,17 +302,17 @@ class Solver(BaseSolver):
                         self.write_log('ctc_text_{}_{}'.format(_name, i),self.tokenizer.decode(ctc_output[i].argmax(dim=-1).tolist(),
                                                                                                        ignore_repeat=True))
         
-        # Ckpt if performance improves
+        # Ckpt if performance improves (dev set is split over processes if distributed)
         tasks = []
-        if len(dev_er['att']) > 0:
+        if self.model.enable_att:
             tasks.append('att')
-        if len(dev_er['ctc']) > 0:
+        if self.model.enable_ctc:
             tasks.append('ctc')
 
         for task in tasks:
-            dev_er[task] = sum(dev_er[task])/len(dev_er[task])
-            dev_wer[task] = sum(dev_wer[task])/len(dev_wer[task])
-            dev_cer[task] = sum(dev_cer[task])/len(dev_cer[task])
+            dev_er[task] = self.average(dev_er[task])
+            dev_wer[task] = self.average(dev_wer[task])
+            dev_cer[task] = self.average(dev_cer[task])
             if dev_er[task] < self.best_wer[task][_name]:
                 self.best_wer[task][_name] = dev_er[task]
                 self.save_checkpoint('best_{}_{}.pth'.format(task, _name + (self.save_name if self.transfer_learning else '')), 
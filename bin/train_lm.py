@@ -11,6 +11,8 @@ class Solver(BaseSolver):
     ''' Solver for training language models'''
     def __init__(self,config,paras,mode):
         super().__init__(config,paras,mode)
+        if self.distributed:
+            raise NotImplementedError('Distributed training is only supported for ASR.')
         # Logger settings
         self.best_loss = 10
 
@@ -23,7 +25,8 @@ class Solver(BaseSolver):
     def load_data(self):
         ''' Load data for training/validation, store tokenizer and input/output shape'''
         self.tr_set, self.dv_set, self.vocab_size, self.tokenizer, msg = \
-                         load_textset(self.paras.njobs, self.paras.gpu, self.paras.pin_memory, **self.config['data'])
+                         load_textset(self.paras.njobs, self.paras.gpu, self.paras.pin_memory, seed=self.paras.seed,
+                                      **self.config['data'])
         self.verbose(msg)
 
     def set_model(self):
@@ -37,7 +40,7 @@ class Solver(BaseSolver):
         # Optimizer
         self.optimizer = Optimizer(self.model.parameters(),**self.config['hparas'])
         # Enable AMP if needed
-        self.enable_apex()
+        self.enable_amp()
         # load pre-trained model
         if self.paras.load:
             self.load_ckpt()
@@ -51,8 +54,12 @@ class Solver(BaseSolver):
         ''' Training End-to-end ASR system '''
         self.verbose('Total training steps {}.'.format(human_format(self.max_step)))
         self.timer.set()
+        n_epochs = 0
         
         while self.step< self.max_step:
+            # Reshuffle buckets every epoch
+            if hasattr(self.tr_set.batch_sampler, 'set_epoch'):
+                self.tr_set.batch_sampler.set_epoch(n_epochs)
             for data in self.tr_set:
                 # Pre-step : update tf_rate/lr_rate and do zero_grad
                 self.optimizer.pre_step(self.step)
@@ -61,11 +68,12 @@ class Solver(BaseSolver):
                 txt, txt_len = self.fetch_data(data)
                 self.timer.cnt('rd')
 
-                # Forward model
-                pred, _ = self.model(txt[:,:-1], txt_len)
+                # Forward model (w/ mixed precision if enabled)
+                with self.autocast():
+                    pred, _ = self.model(txt[:,:-1], txt_len)
 
-                # Compute all objectives
-                lm_loss = self.seq_loss(pred.view(-1,self.vocab_size),txt[:,1:].reshape(-1))
+                    # Compute all objectives
+                    lm_loss = self.seq_loss(pred.view(-1,self.vocab_size),txt[:,1:].reshape(-1))
                 self.timer.cnt('fw')
 
                 # Backprop
@@ -86,6 +94,7 @@ class Solver(BaseSolver):
                 # End of step
                 self.timer.set()
                 if self.step > self.max_step:break
+            n_epochs += 1
         self.log.close()
     
     def validate(self):
@@ -99,9 +108,9 @@ class Solver(BaseSolver):
             txt, txt_len = self.fetch_data(data)
 
             # Forward model
-            with torch.no_grad():
+            with torch.no_grad(), self.autocast():
                 pred, _ = self.model(txt[:,:-1], txt_len)
-            lm_loss = self.seq_loss(pred.view(-1,self.vocab_size),txt[:,1:].reshape(-1))
+                lm_loss = self.seq_loss(pred.view(-1,self.vocab_size),txt[:,1:].reshape(-1))
             dev_loss.append(lm_loss)
         
         # Ckpt if performance improves
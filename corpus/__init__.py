@@ -0,0 +1,24 @@
+from joblib import Parallel, delayed
+
+
+def read_trans_file(src_file):
+    '''Parse a transcription file into {utterance id: transcription}'''
+    trans = {}
+    with open(src_file, 'r', encoding='UTF-8') as fp:
+        for line in fp:
+            line = line.rstrip('\n')
+            if ' ' in line:
+                idx, txt = line.split(' ', 1)
+                trans[idx] = txt
+    return trans
+
+
+def read_transcription(file_list, trans_file, n_jobs):
+    '''Get transcription of target audio files, trans_file maps an audio file to its transcription file.
+       Each transcription file is parsed exactly once (in parallel w/ process pool, forked workers need not
+       re-import modules)'''
+    src_files = sorted(set(trans_file(f) for f in file_list))
+    trans = {}
+    for t in Parallel(n_jobs=max(1, n_jobs), backend='multiprocessing')(delayed(read_trans_file)(f) for f in src_files):
+        trans.update(t)
+    return [trans[f.split('/')[-1].split('.')[0]] for f in file_list]
@@ -1,32 +1,30 @@
 from tqdm import tqdm
 from pathlib import Path
 from os.path import join, getsize
-from joblib import Parallel, delayed
 from torch.utils.data import Dataset
 
+from corpus import read_transcription
+
 # Additional (official) text src provided
 OFFICIAL_TXT_SRC = ['librispeech-lm-norm.txt']
 # Remove longest N sentence in librispeech-lm-norm.txt
 REMOVE_TOP_N_TXT = 5000000
-# Default num. of threads used for loading LibriSpeech
+# Default num. of workers used for loading LibriSpeech
 READ_FILE_THREADS = 4
 
 
-def read_text(file):
-    '''Get transcription of target wave file, 
-       it's somewhat redundant for accessing each txt multiplt times,
-       but it works fine with multi-thread'''
-    src_file = '-'.join(file.split('-')[:-1])+'.trans.txt'
-    idx = file.split('/')[-1].split('.')[0]
+def trans_file(file):
+    '''Transcription file of target audio file'''
+    return '-'.join(file.split('-')[:-1])+'.trans.txt'
+
 
-    with open(src_file, 'r') as fp:
-        for line in fp:
-            if idx == line.split(' ')[0]:
-                return line[:-1].split(' ', 1)[1]
+def read_text(file_list, n_jobs=READ_FILE_THREADS):
+    '''Get transcription of target audio files'''
+    return read_transcription(file_list, trans_file, n_jobs)
 
 
 class LibriDataset(Dataset):
-    def __init__(self, path, split, tokenizer, bucket_size, ascending=False):
+    def __init__(self, path, split, tokenizer, bucket_size, ascending=False, n_jobs=READ_FILE_THREADS):
         # Setup
         self.path = path
         self.bucket_size = bucket_size
@@ -38,8 +36,7 @@ class LibriDataset(Dataset):
             assert len(split_list) > 0, "No data found @ {}".format(join(path,s))
             file_list += split_list
         # Read text
-        text = Parallel(n_jobs=READ_FILE_THREADS)(
-            delayed(read_text)(str(f)) for f in file_list)
+        text = read_text([str(f) for f in file_list], n_jobs)
         #text = Parallel(n_jobs=-1)(delayed(tokenizer.encode)(txt) for txt in text)
         text = [tokenizer.encode(txt) for txt in text]
 
@@ -62,7 +59,7 @@ class LibriDataset(Dataset):
 
 
 class LibriTextDataset(Dataset):
-    def __init__(self, path, split, tokenizer, bucket_size):
+    def __init__(self, path, split, tokenizer, bucket_size, n_jobs=READ_FILE_THREADS):
         # Setup
         self.path = path
         self.bucket_size = bucket_size
@@ -82,8 +79,7 @@ class LibriTextDataset(Dataset):
                                         > 0), "No data found @ {}".format(path)
 
         # Read text
-        text = Parallel(n_jobs=READ_FILE_THREADS)(
-            delayed(read_text)(str(f)) for f in file_list)
+        text = read_text([str(f) for f in file_list], n_jobs)
         all_sent.extend(text)
         del text
 
@@ -1,57 +1,61 @@
+import numpy as np
 from tqdm import tqdm
+from functools import partial
 from pathlib import Path
 from os.path import join,getsize
-from joblib import Parallel, delayed
 from torch.utils.data import Dataset
 
+from corpus import read_transcription
+from src.manifest import load_manifest
+from src.pcm_cache import load_audio
+from src.packed import PackedSequences, PackedStrings
+
 # from sphfile import SPHFile
 # import soundfile as sf
 import wave
 
 ADDITIONAL_TXT_SRC  = ['bopomo_corpus.txt']  # Additional text src provided
 REMOVE_TOP_N_TXT  = 5000000                      # Remove longest N sentence in librispeech-lm-norm.txt
-READ_FILE_THREADS = 16                           # Default num. of threads used for loading LibriSpeech
+READ_FILE_THREADS = 16                           # Default num. of workers used for loading corpus
+
+def trans_file(file):
+    '''Transcription file of target audio file'''
+    return file.rsplit('/', 1)[0]+'/bopomo.trans.txt'
 
-def read_text(file):
-    '''Get transcription of target wave file, 
-       it's somewhat redundant for accessing each txt multiplt times,
-       but it works fine with multi-thread'''
-    src_file = file.rsplit('/', 1)[0]+'/bopomo.trans.txt'
-    idx = file.split('/')[-1].split('.')[0]
+def read_text(file_list, n_jobs=READ_FILE_THREADS):
+    '''Get transcription of target audio files'''
+    return read_transcription(file_list, trans_file, n_jobs)
 
-    with open(src_file,'r',encoding='UTF-8') as fp:
-        for line in fp:
-            if idx == line.split(' ')[0]:
-                return line[:-1].split(' ',1)[1]
+def scan_split(split_dir, n_jobs=READ_FILE_THREADS):
+    ''' Audio files, transcriptions (lower case) and transcription files of a split (for building manifest)'''
+    file_list = [str(f) for f in Path(split_dir).rglob("*.wav")]
+    text = read_text(file_list, n_jobs)
+    text = [txt.lower() for txt in text]
+    return file_list, text, [trans_file(f) for f in file_list]
 
 class DLHLPDataset(Dataset):
-    def __init__(self, path, split, tokenizer, bucket_size=1, ascending=False, read_audio=False):
+    def __init__(self, path, split, tokenizer, bucket_size=1, ascending=False, read_audio=False, n_jobs=READ_FILE_THREADS):
         # Setup
         self.path = path
         self.bucket_size = bucket_size
 
-        # List all wave files
-        file_list = []
+        # Load manifest of all splits (path, num. of samples, text, token ids), built at first run
+        entries = []
         for s in split:
             if s[0] == 't' or s[0] == 'd':
-                file_list += list(Path(join(path,s)).rglob("*.wav"))
-        assert len(file_list)>0, "No data found @ {}".format(path)
+                entries += load_manifest(join(path,s), tokenizer, partial(scan_split, n_jobs=n_jobs), n_jobs)
+        assert len(entries)>0, "No data found @ {}".format(path)
+        file_list = [e['path'] for e in entries]
+        text = [e['tokens'] for e in entries]
+        duration = [e['samples']/e['sample_rate'] for e in entries]
         
-        # Read text
-        text = Parallel(n_jobs=READ_FILE_THREADS)(delayed(read_text)(str(f)) for f in file_list)
-        # text = Parallel(n_jobs=-1)(delayed(tokenizer.encode)(txt) for txt in text)
-        text = [tokenizer.encode(txt.lower()) for txt in text]
-        
-        # Sort dataset by text length
-        # file_len = Parallel(n_jobs=READ_FILE_THREADS)(delayed(getsize)(f) for f in file_list) 
-        file_len = Parallel(n_jobs=READ_FILE_THREADS)(delayed(getsize)(f) for f in file_list)
-        # if split[0] == 'test':
-        #     file_names = [int(str(f).split('/')[-1][:-4]) for f in file_list]
-        #     self.file_list, self.text = zip(*[(f_name,txt) \
-        #         for f_num,f_name,txt in sorted(zip(file_names,file_list,text), reverse=ascending, key=lambda x:x[0])])
-        # else:
-        self.file_list, self.text = zip(*[(f_name,txt) \
-            for time_len,f_name,txt in sorted(zip(file_len,file_list,text), reverse=not ascending, key=lambda x:x[0])])
+        # Sort dataset by duration (sec.)
+        file_list, text, duration = zip(*[(f_name,txt,dur) \
+            for f_name,txt,dur in sorted(zip(file_list,text,duration), reverse=not ascending, key=lambda x:x[2])])
+        # Packed arrays instead of per-utterance Python objects, shared by data loader workers w/o copy-on-write
+        self.file_list, self.text = PackedStrings(file_list), PackedSequences(text)
+        self.duration = np.array(duration)
+        self.audio = load_audio(self.file_list, n_jobs) if read_audio else None
         
         print('[INFO] DLHLP dataset', split[-1], 'set :',len(self.file_list),'audio files found')
 
@@ -59,17 +63,21 @@ class DLHLPDataset(Dataset):
         if self.bucket_size>1:
             # Return a bucket
             index = min(len(self.file_list)-self.bucket_size,index)
-            return [(f_path, txt) for f_path,txt in \
-                     zip(self.file_list[index:index+self.bucket_size], self.text[index:index+self.bucket_size])]
+            return [(self._audio(i), txt) for i,txt in \
+                     zip(range(index,index+self.bucket_size), self.text[index:index+self.bucket_size])]
         else:
-            return self.file_list[index], self.text[index]
+            return self._audio(index), self.text[index]
+
+    def _audio(self, index):
+        # Path or preloaded waveform
+        return self.file_list[index] if self.audio is None else self.audio[index]
 
     def __len__(self):
         return len(self.file_list)
 
 
 class DLHLPTextDataset(Dataset):
-    def __init__(self, path, split, tokenizer, bucket_size):
+    def __init__(self, path, split, tokenizer, bucket_size, n_jobs=READ_FILE_THREADS):
         # Setup
         self.path = path
         self.bucket_size = bucket_size
@@ -84,11 +92,11 @@ class DLHLPTextDataset(Dataset):
                 # self.encode_on_fly = True
                 with open(join(path,s),'r') as f:
                     all_sent += f.readlines()
-            file_list += list(Path(join(path,s)).rglob("*.wav"))
+            file_list += [str(f) for f in Path(join(path,s)).rglob("*.wav")]
         assert (len(file_list)>0) or (len(all_sent)>0), "No data found @ {}".format(path)
         
         # Read text
-        text = Parallel(n_jobs=READ_FILE_THREADS)(delayed(read_text)(str(f)) for f in file_list)
+        text = read_text(file_list, n_jobs)
         all_sent.extend(text)
         del text
 
@@ -104,20 +112,17 @@ class DLHLPTextDataset(Dataset):
         self.text = sorted(self.text, reverse=True, key=lambda x:len(x))
         if self.encode_on_fly:
             del self.text[:REMOVE_TOP_N_TXT]
+        # Packed (sentences of text source are encoded on access), no per-sentence Python objects
+        self.text = PackedStrings(self.text) if self.encode_on_fly else PackedSequences(self.text)
 
     def __getitem__(self,index):
         if self.bucket_size>1:
             index = min(len(self.text)-self.bucket_size,index)
-            if self.encode_on_fly:
-                for i in range(index,index+self.bucket_size):
-                    if type(self.text[i]) is str:
-                        self.text[i] = self.tokenizer.encode(self.text[i])
-            # Return a bucket
-            return self.text[index:index+self.bucket_size]
+            # Return a bucket (views of packed text)
+            bucket = self.text[index:index+self.bucket_size]
+            return [self.tokenizer.encode(txt) for txt in bucket] if self.encode_on_fly else list(bucket)
         else:
-            if self.encode_on_fly and type(self.text[index]) is str:
-                self.text[index] = self.tokenizer.encode(self.text[index])
-            return self.text[index]
+            return self.tokenizer.encode(self.text[index]) if self.encode_on_fly else self.text[index]
 
     def __len__(self):
         return len(self.text)
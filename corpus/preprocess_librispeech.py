@@ -1,57 +1,58 @@
+import numpy as np
 from tqdm import tqdm
+from functools import partial
 from pathlib import Path
 from os.path import join,getsize
-from joblib import Parallel, delayed
 from torch.utils.data import Dataset
 
+from corpus import read_transcription
+from src.manifest import load_manifest
+from src.pcm_cache import load_audio
+from src.packed import PackedSequences, PackedStrings
+
 OFFICIAL_TXT_SRC  = ['librispeech-lm-norm.txt']  # Additional (official) text src provided
 REMOVE_TOP_N_TXT  = 5000000                      # Remove longest N sentence in librispeech-lm-norm.txt
-READ_FILE_THREADS = 16                           # Default num. of threads used for loading LibriSpeech
+READ_FILE_THREADS = 16                           # Default num. of workers used for loading corpus
+
+def trans_file(file):
+    '''Transcription file of target audio file'''
+    return '-'.join(file.split('-')[:-1])+'.trans.txt'
 
-def read_text(file):
-    '''Get transcription of target wave file, 
-       it's somewhat redundant for accessing each txt multiplt times,
-       but it works fine with multi-thread'''
-    src_file = '-'.join(file.split('-')[:-1])+'.trans.txt'
-    idx = file.split('/')[-1].split('.')[0]
+def read_text(file_list, n_jobs=READ_FILE_THREADS):
+    '''Get transcription of target audio files'''
+    return read_transcription(file_list, trans_file, n_jobs)
 
-    with open(src_file,'r') as fp:
-        for line in fp:
-            if idx == line.split(' ')[0]:
-                return line[:-1].split(' ',1)[1]
+def scan_split(split_dir, n_jobs=READ_FILE_THREADS):
+    ''' Audio files, transcriptions and transcription files of a split (for building manifest)'''
+    file_list = [str(f) for f in Path(split_dir).rglob("*.flac")]
+    text = read_text(file_list, n_jobs)
+    return file_list, text, [trans_file(f) for f in file_list]
 
 class LibriDataset(Dataset):
     def __init__(self, path, split, tokenizer, bucket_size=1, 
-            ascending=False, read_audio=False, sort_by_text=False):
+            ascending=False, read_audio=False, sort_by_text=False, n_jobs=READ_FILE_THREADS):
         # Setup
         self.path = path
         self.bucket_size = bucket_size
 
-        # List all wave files
-        file_list = []
+        # Load manifest of all splits (path, num. of samples, text, token ids), built at first run
+        entries = []
         for s in split:
             if s[0] == 't' or s[0] == 'd':
-                file_list += list(Path(join(path,s)).rglob("*.flac"))
-        assert len(file_list)>0, "No data found @ {}".format(path)
-        
-        # Read text
-        text = Parallel(n_jobs=READ_FILE_THREADS)(delayed(read_text)(str(f)) for f in file_list)
-        # text = Parallel(n_jobs=-1)(delayed(tokenizer.encode)(txt) for txt in text)
-        text = [tokenizer.encode(txt) for txt in text]
+                entries += load_manifest(join(path,s), tokenizer, partial(scan_split, n_jobs=n_jobs), n_jobs)
+        assert len(entries)>0, "No data found @ {}".format(path)
+        file_list = [e['path'] for e in entries]
+        text = [e['tokens'] for e in entries]
+        duration = [e['samples']/e['sample_rate'] for e in entries]
         
-        # Sort dataset by text length
-        # file_len = Parallel(n_jobs=READ_FILE_THREADS)(delayed(getsize)(f) for f in file_list) 
-        if sort_by_text == False:
-            file_len = Parallel(n_jobs=READ_FILE_THREADS)(delayed(getsize)(f) for f in file_list)
-        else:
-            file_len = [len(txt) for txt in text]
-        
-        self.file_list, self.text = zip(*[(str(f_name),txt) \
-                for time_len,f_name,txt in sorted(zip(file_len,file_list,text), reverse=not ascending, key=lambda x:x[0])])
-        if read_audio:
-            from src.audio import ReadAudio
-            audio_reader = ReadAudio(8000)
-            self.file_list = [audio_reader(str(f)) for i, f in tqdm(enumerate(self.file_list))]
+        # Sort dataset by duration (sec.) or text length
+        file_len = [len(txt) for txt in text] if sort_by_text else duration
+        file_list, text, duration = zip(*[(f_name,txt,dur) \
+                for _,f_name,txt,dur in sorted(zip(file_len,file_list,text,duration), reverse=not ascending, key=lambda x:x[0])])
+        # Packed arrays instead of per-utterance Python objects, shared by data loader workers w/o copy-on-write
+        self.file_list, self.text = PackedStrings(file_list), PackedSequences(text)
+        self.duration = np.array(duration)
+        self.audio = load_audio(self.file_list, n_jobs) if read_audio else None
 
         print('[INFO] LibriSpeech', split[-1], 'set :',len(self.file_list),'audio files found')
 
@@ -59,16 +60,20 @@ class LibriDataset(Dataset):
         if self.bucket_size>1:
             # Return a bucket
             index = min(len(self.file_list)-self.bucket_size,index)
-            return [(f_path, txt) for f_path,txt in \
-                     zip(self.file_list[index:index+self.bucket_size], self.text[index:index+self.bucket_size])]
+            return [(self._audio(i), txt) for i,txt in \
+                     zip(range(index,index+self.bucket_size), self.text[index:index+self.bucket_size])]
         else:
-            return self.file_list[index], self.text[index]
+            return self._audio(index), self.text[index]
+
+    def _audio(self, index):
+        # Path or preloaded waveform
+        return self.file_list[index] if self.audio is None else self.audio[index]
 
     def __len__(self):
         return len(self.file_list)
 
 class LibriTextDataset(Dataset):
-    def __init__(self, path, split, tokenizer, bucket_size):
+    def __init__(self, path, split, tokenizer, bucket_size, n_jobs=READ_FILE_THREADS):
         # Setup
         self.path = path
         self.bucket_size = bucket_size
@@ -83,11 +88,11 @@ class LibriTextDataset(Dataset):
                 self.encode_on_fly = True
                 with open(join(path,s),'r') as f:
                     all_sent += f.readlines()
-            file_list += list(Path(join(path,s)).rglob("*.flac"))
+            file_list += [str(f) for f in Path(join(path,s)).rglob("*.flac")]
         assert (len(file_list)>0) or (len(all_sent)>0), "No data found @ {}".format(path)
         
         # Read text
-        text = Parallel(n_jobs=READ_FILE_THREADS)(delayed(read_text)(str(f)) for f in file_list)
+        text = read_text(file_list, n_jobs)
         all_sent.extend(text)
         del text
 
@@ -103,20 +108,17 @@ class LibriTextDataset(Dataset):
         self.text = sorted(self.text, reverse=True, key=lambda x:len(x))
         if self.encode_on_fly:
             del self.text[:REMOVE_TOP_N_TXT]
+        # Packed (sentences of text source are encoded on access), no per-sentence Python objects
+        self.text = PackedStrings(self.text) if self.encode_on_fly else PackedSequences(self.text)
 
     def __getitem__(self,index):
         if self.bucket_size>1:
             index = min(len(self.text)-self.bucket_size,index)
-            if self.encode_on_fly:
-                for i in range(index,index+self.bucket_size):
-                    if type(self.text[i]) is str:
-                        self.text[i] = self.tokenizer.encode(self.text[i])
-            # Return a bucket
-            return self.text[index:index+self.bucket_size]
+            # Return a bucket (views of packed text)
+            bucket = self.text[index:index+self.bucket_size]
+            return [self.tokenizer.encode(txt) for txt in bucket] if self.encode_on_fly else list(bucket)
         else:
-            if self.encode_on_fly and type(self.text[index]) is str:
-                self.text[index] = self.tokenizer.encode(self.text[index])
-            return self.text[index]
+            return self.tokenizer.encode(self.text[index]) if self.encode_on_fly else self.text[index]
 
     def __len__(self):
         return len(self.text)
@@ -0,0 +1,70 @@
+import json
+import numpy as np
+from os.path import join
+from torch.utils.data import Dataset
+
+from src.audio import segment_path
+from src.manifest import load_manifest
+from src.pcm_cache import load_audio
+from src.packed import PackedSequences, PackedStrings
+
+SEGMENT_FILE      = 'segments.jsonl'  # Segment list of each split
+READ_FILE_THREADS = 16                # Default num. of workers used for loading corpus
+
+def scan_split(split_dir):
+    ''' Segments, transcriptions and segment list of a split (for building manifest), <split_dir>/segments.jsonl
+        has one segment per line
+            {"path": <audio file, relative to split_dir>, "start": <int>, "end": <int>, "text": <str>}
+        where [start, end) is the sample range at the sample rate of the recording'''
+    seg_file = join(split_dir, SEGMENT_FILE)
+    file_list, text = [], []
+    with open(seg_file, 'r', encoding='UTF-8') as fp:
+        for line in fp:
+            if line.strip():
+                seg = json.loads(line)
+                file_list.append(segment_path(join(split_dir, seg['path']), seg['start'], seg['end']))
+                text.append(seg['text'])
+    return file_list, text, [seg_file] * len(file_list)
+
+class SegmentDataset(Dataset):
+    ''' Utterances given as segments of long recordings, only the segment is decoded (see ReadAudio)
+        so that long-form data need not be cut into files'''
+    def __init__(self, path, split, tokenizer, bucket_size=1, ascending=False, read_audio=False, n_jobs=READ_FILE_THREADS):
+        # Setup
+        self.path = path
+        self.bucket_size = bucket_size
+
+        # Load manifest of all splits (segment path, num. of samples, text, token ids), built at first run
+        entries = []
+        for s in split:
+            entries += load_manifest(join(path,s), tokenizer, scan_split, n_jobs)
+        assert len(entries)>0, "No data found @ {}".format(path)
+        file_list = [e['path'] for e in entries]
+        text = [e['tokens'] for e in entries]
+        duration = [e['samples']/e['sample_rate'] for e in entries]
+
+        # Sort dataset by duration (sec.)
+        file_list, text, duration = zip(*[(f_name,txt,dur) \
+            for f_name,txt,dur in sorted(zip(file_list,text,duration), reverse=not ascending, key=lambda x:x[2])])
+        # Packed arrays instead of per-utterance Python objects, shared by data loader workers w/o copy-on-write
+        self.file_list, self.text = PackedStrings(file_list), PackedSequences(text)
+        self.duration = np.array(duration)
+        self.audio = load_audio(self.file_list, n_jobs) if read_audio else None
+
+        print('[INFO] Segments', split[-1], 'set :',len(self.file_list),'segments found')
+
+    def __getitem__(self,index):
+        if self.bucket_size>1:
+            # Return a bucket
+            index = min(len(self.file_list)-self.bucket_size,index)
+            return [(self._audio(i), txt) for i,txt in \
+                     zip(range(index,index+self.bucket_size), self.text[index:index+self.bucket_size])]
+        else:
+            return self._audio(index), self.text[index]
+
+    def _audio(self, index):
+        # Segment path or preloaded waveform
+        return self.file_list[index] if self.audio is None else self.audio[index]
+
+    def __len__(self):
+        return len(self.file_list)
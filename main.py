@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 # coding: utf-8
+import os
 import yaml
 import torch
 import argparse
@@ -23,16 +24,18 @@ parser.add_argument('--outdir', default='result/', type=str, help='Decode output
 parser.add_argument('--load', default=None, type=str, help='Load pre-trained model (for training only)', required=False)
 parser.add_argument('--seed', default=0, type=int, help='Random seed for reproducable results.', required=False)
 parser.add_argument('--cudnn-ctc', action='store_true', help='Switches CTC backend from torch to cudnn')
-parser.add_argument('--njobs', default=4, type=int, help='Number of threads for dataloader/decoding.', required=False)
+parser.add_argument('--njobs', default=4, type=int, help='Number of workers for corpus indexing/dataloader/decoding.', required=False)
 parser.add_argument('--cpu', action='store_true', help='Disable GPU training.')
 parser.add_argument('--no-pin', action='store_true', help='Disable pin-memory for dataloader')
 parser.add_argument('--test', action='store_true', help='Test the model.')
 parser.add_argument('--no-msg', action='store_true', help='Hide all messages.')
 parser.add_argument('--lm', action='store_true', help='Option for training RNNLM.')
-parser.add_argument('--amp', action='store_true', help='Option to enable AMP.')
+parser.add_argument('--amp', action='store_true', help='Option to enable AMP (native mixed precision).')
+parser.add_argument('--amp_dtype', default=None, choices=['fp16','bf16'], help='Precision of AMP, fp16 on GPU and bf16 on CPU by default.')
 parser.add_argument('--reserve_gpu', default=0, type=float, help='Option to reserve GPU ram for training.')
 parser.add_argument('--jit', action='store_true', help='Option for enabling jit in pytorch. (feature in development)')
 parser.add_argument('--cuda', default=0, type=int, help='Choose which gpu to use.')
+parser.add_argument('--dist_backend', default='gloo', type=str, help='Backend of distributed training (launched by torchrun).')
 
 """
 setattr(object, name, value)
@@ -46,10 +49,12 @@ config = yaml.load(open(paras.config,'r'), Loader=yaml.FullLoader)
 
 print('[INFO] Using config {}'.format(paras.config))
 
-np.random.seed(paras.seed)
-torch.manual_seed(paras.seed)
+# Processes of distributed training have different random state (model is synced from rank 0)
+seed = paras.seed + int(os.environ.get('RANK', 0))
+np.random.seed(seed)
+torch.manual_seed(seed)
 if torch.cuda.is_available():
-    torch.cuda.manual_seed_all(paras.seed)
+    torch.cuda.manual_seed_all(seed)
     # print('There are ', torch.cuda.device_count(), ' device(s) available')
     # print('Using device cuda:', str(paras.cuda))
 
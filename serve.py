@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# coding: utf-8
+import yaml
+import torch
+import asyncio
+import argparse
+
+from src.server import ASRServer
+from src.recognizer import Recognizer
+
+# Arguments
+parser = argparse.ArgumentParser(description='Serve E2E asr over HTTP with dynamic batching.')
+parser.add_argument('--config', type=str, help='Path to decode config (same format as testing config).')
+parser.add_argument('--host', default='127.0.0.1', type=str, help='Host to bind.')
+parser.add_argument('--port', default=8000, type=int, help='Port to bind.')
+parser.add_argument('--decode', default=None, choices=['greedy', 'ctc', 'beam'],
+                    help='Decoding method, inferred from decode.beam_size if not given.')
+parser.add_argument('--max_frames', default=20000, type=int, help='Max. padded frames (max len. x batch size) per batch.')
+parser.add_argument('--max_batch', default=32, type=int, help='Max. number of requests per batch.')
+parser.add_argument('--max_wait', default=50, type=float, help='Max. time (ms) a request waits for batching.')
+parser.add_argument('--njobs', default=4, type=int, help='Number of threads for feature extraction.')
+parser.add_argument('--cpu', action='store_true', help='Disable GPU inference.')
+parser.add_argument('--cuda', default=0, type=int, help='Choose which gpu to use.')
+parser.add_argument('--amp', action='store_true', help='Mixed precision inference (bf16 on CPU, fp16 on GPU).')
+paras = parser.parse_args()
+config = yaml.load(open(paras.config, 'r'), Loader=yaml.FullLoader)
+
+device = 'cuda:' + str(paras.cuda) if (not paras.cpu) and torch.cuda.is_available() else 'cpu'
+recognizer = Recognizer(config, paras.decode, device, paras.amp)
+for msg in recognizer.create_msg():
+    print('[INFO]', msg)
+server = ASRServer(recognizer, paras.max_frames, paras.max_batch, paras.max_wait / 1000, paras.njobs)
+print('[INFO] Serving on http://{}:{} (POST /recognize, GET /metrics)'.format(paras.host, paras.port))
+asyncio.run(server.serve(paras.host, paras.port))
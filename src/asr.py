@@ -3,11 +3,14 @@ import torch
 import numpy as np
 import torch.nn as nn
 import torch.nn.functional as F
+from functools import partial
+from torch.utils.checkpoint import checkpoint
 from torch.distributions.categorical import Categorical
 
 from src.util import init_weights, init_gate
 from src.module import VGGExtractor, VGGExtractor2, FreqVGGExtractor, FreqVGGExtractor2, \
-                        RNNLayer, ScaleDotAttention, LocationAwareAttention
+                        RNNLayer, TransformerInput, TransformerLayer, TransformerDecoderLayer, \
+                        ScaleDotAttention, LocationAwareAttention, make_pad_mask, sinusoid_table
 
 class ASR(nn.Module):
     ''' ASR model, including Encoder/Decoder(s)'''
@@ -36,14 +39,23 @@ class ASR(nn.Module):
             self.dec_dim = decoder['dim']
             self.pre_embed = nn.Embedding(vocab_size, self.dec_dim)
             self.embed_drop = nn.Dropout(emb_drop)
-            self.decoder = Decoder(self.encoder.out_dim+self.dec_dim, vocab_size, **decoder)
-            query_dim = self.dec_dim*self.decoder.layer
-            self.attention = Attention(self.encoder.out_dim, query_dim, **attention)
+            self.transformer_dec = decoder['module'] == 'Transformer'
+            if self.transformer_dec:
+                # Cross-attention is part of the decoder, attention config is not used
+                self.decoder = TransformerDecoder(self.encoder.out_dim, vocab_size, **decoder)
+            else:
+                self.decoder = Decoder(self.encoder.out_dim+self.dec_dim, vocab_size, **decoder)
+                query_dim = self.dec_dim*self.decoder.layer
+                self.attention = Attention(self.encoder.out_dim, query_dim, **attention)
 
         # Init
         if init_adadelta:
             self.apply(init_weights)
-            if self.enable_att:
+            # init_weights zeros all 1-dim parameters, restore LayerNorm to identity
+            for m in self.modules():
+                if isinstance(m, nn.LayerNorm):
+                    m.reset_parameters()
+            if self.enable_att and not self.transformer_dec:
                 for l in range(self.decoder.layer):
                     bias = getattr(self.decoder.layers,'bias_ih_l{}'.format(l))
                     bias = init_gate(bias)
@@ -51,7 +63,8 @@ class ASR(nn.Module):
     def set_state(self, prev_state, prev_attn):
         ''' Setting up all memory states for beam decoding'''
         self.decoder.set_state(prev_state)
-        self.attention.set_mem(prev_attn)
+        if not self.transformer_dec:
+            self.attention.set_mem(prev_attn)
 
     def create_msg(self):
         # Messages for user
@@ -65,15 +78,19 @@ class ASR(nn.Module):
             msg.append('           | VGG Extractor w/ time downsampling rate = 2 in encoder enabled.'.format(self.encoder.vgg_freq))
         if self.encoder.vgg == 4:
             msg.append('           | Freq VGG Extractor w/ time DS rate = 2, freq split = {}, and low-freq filters = {} in encoder enabled.'.format(self.encoder.vgg_freq, self.encoder.vgg_low_filt))
+        if self.encoder.module in ['Transformer','Conformer']:
+            msg.append('           | {} encoder w/ {} positional encoding enabled.'.format(self.encoder.module, self.encoder.pos_enc))
         
         if self.enable_ctc:
             msg.append('           | CTC training on encoder enabled ( lambda = {}).'.format(self.ctc_weight))
-        if self.enable_att:
+        if self.enable_att and self.transformer_dec:
+            msg.append('           | Transformer decoder enabled ( lambda = {}).'.format(1-self.ctc_weight))
+        elif self.enable_att:
             msg.append('           | {} attention decoder enabled ( lambda = {}).'.format(self.attention.mode,1-self.ctc_weight))
         return msg
 
     def forward(self, audio_feature, feature_len, decode_step, tf_rate=0.0, teacher=None, 
-                      emb_decoder=None, get_dec_state=False, get_logit=False):
+                      emb_decoder=None, get_dec_state=False, get_logit=False, get_att_seq=True, get_att_output=True):
         '''
         Arguments
             audio_feature - [BxTxD] Acoustic feature with shape 
@@ -85,11 +102,12 @@ class ASR(nn.Module):
                                     At training stage, this ONLY affects self-sampling (output remains the same)
                                     At inference stage, this affects output to become log prob. with distribution fusion
             get_dec_state - [bool]  If true, return decoder state [BxLxD] for other purpose
+            get_att_seq   - [bool]  If false, attention maps are not kept (att_seq is None)
+            get_att_output- [bool]  If false, decoder logits are not computed (att_output is None, training only),
+                                    decoder state is returned instead, see att_loss()
         '''
         # Init
-        bs = audio_feature.shape[0]
-        ctc_output, att_output, att_seq = None, None, None
-        dec_state = [] if get_dec_state else None
+        ctc_output, att_output, att_seq, dec_state = None, None, None, None
 
         # Encode
         encode_feature,encode_len = self.encoder(audio_feature,feature_len)
@@ -99,62 +117,177 @@ class ASR(nn.Module):
             if get_logit:
                 ctc_output = self.ctc_layer(encode_feature)
             else:
-                ctc_output = F.log_softmax(self.ctc_layer(encode_feature),dim=-1)
+                ctc_output = F.log_softmax(self.ctc_layer(encode_feature).float(),dim=-1)
 
         # Attention based decoding
         if self.enable_att:
-            # Init (init char = <SOS>, reset all rnn state and cell)
-            self.decoder.init_state(bs)
-            self.attention.reset_mem()
-            last_char = self.pre_embed(torch.zeros((bs),dtype=torch.long, device=encode_feature.device))
-            att_seq, output_seq = [], []
+            att_output, att_seq, dec_state = self.decode(encode_feature, encode_len, decode_step, tf_rate=tf_rate,
+                                                         teacher=teacher, emb_decoder=emb_decoder,
+                                                         get_dec_state=get_dec_state, get_att_seq=get_att_seq,
+                                                         get_att_output=get_att_output)
 
-            # Preprocess data for teacher forcing
-            if teacher is not None:
-                teacher = self.embed_drop(self.pre_embed(teacher))
+        return ctc_output, encode_len, att_output, att_seq, dec_state
 
-            # Decode
-            for t in range(decode_step):
+    def decode(self, encode_feature, encode_len, decode_step, tf_rate=0.0, teacher=None,
+                     emb_decoder=None, get_dec_state=False, get_att_seq=True, get_att_output=True):
+        '''
+        Attention decoding given encoder output, see forward() for arguments
+        Returns att_output [BxLxV], att_seq [BxNxLxT] and dec_state [BxLxD] (None if not requested)
+        '''
+        bs = encode_feature.shape[0]
+        # Logits are always needed for inference, decoder state is needed for loss w/o logits
+        get_att_output = get_att_output or teacher is None
+        get_dec_state = get_dec_state or not get_att_output
+        dec_state = [] if get_dec_state else None
+        # Init (init char = <SOS>, reset all rnn state and cell)
+        self.decoder.init_state(bs)
+        if self.transformer_dec:
+            self.decoder.set_memory(encode_feature, encode_len)
+        else:
+            self.attention.reset_mem()
+        last_char = self.pre_embed(torch.zeros((bs),dtype=torch.long, device=encode_feature.device))
+        att_seq, output_seq = [], []
+
+        # Preprocess data for teacher forcing
+        if teacher is not None:
+            teacher = self.embed_drop(self.pre_embed(teacher))
+
+        if self.transformer_dec and teacher is not None and tf_rate == 1:
+            # Teacher forcing on all steps, decode in parallel
+            decoder_input = torch.cat([last_char.unsqueeze(1),teacher[:,:decode_step-1]],dim=1)
+            att_output, d_state, att_seq = self.decoder(decoder_input, need_weights=get_att_seq, get_char=get_att_output)
+            return att_output, att_seq, d_state if get_dec_state else None
+
+        # Decode, blocks of steps are checkpointed (recomputed in backward pass) if enabled
+        checkpoint_steps = self.decoder.checkpoint if self.training and torch.is_grad_enabled() \
+                                                       and not self.transformer_dec else 0
+        if checkpoint_steps > 0:
+            # First step initializes attention memory, not checkpointed
+            blocks = [(0,1)] + [(t,min(t+checkpoint_steps,decode_step)) for t in range(1,decode_step,checkpoint_steps)]
+        else:
+            blocks = [(0,decode_step)]
+        for t_start, t_end in blocks:
+            if t_start > 0:
+                block = partial(self.checkpoint_block, t_start, t_end, encode_feature, encode_len,
+                                teacher, tf_rate, emb_decoder, get_att_output)
+                output = checkpoint(block, last_char, *self.get_decode_state(), use_reentrant=False)
+                self.set_decode_state(output[4:])
+                last_char, cur_char, attn, d_state = output[:4]
+            else:
+                last_char, cur_char, attn, d_state = self.decode_block(t_start, t_end, last_char, encode_feature,
+                                                                       encode_len, teacher, tf_rate, emb_decoder,
+                                                                       get_att_output)
+            if get_att_output:
+                output_seq.append(cur_char)
+            if get_att_seq:
+                att_seq.append(attn)
+            if get_dec_state:
+                dec_state.append(d_state)
+
+        att_output = torch.cat(output_seq,dim=1) if get_att_output else None # BxTxV
+        att_seq = torch.cat(att_seq,dim=2) if get_att_seq else None          # BxNxDtxT
+        if get_dec_state:
+            dec_state = torch.cat(dec_state,dim=1)
+
+        return att_output, att_seq, dec_state
+
+    def decode_block(self, t_start, t_end, last_char, encode_feature, encode_len, teacher, tf_rate, emb_decoder,
+                     get_att_output=True):
+        ''' Decode steps [t_start, t_end) step by step, see forward() for arguments
+            Returns embedded last character, att_output [BxLxV] (None if not get_att_output),
+            att_seq [BxNxLxT] and dec_state [BxLxD]'''
+        att_seq, output_seq, dec_state = [], [], []
+        for t in range(t_start, t_end):
+            if self.transformer_dec:
+                # Decode w/ cached keys/values of previous steps
+                cur_char, d_state, attn = self.decoder.step(last_char, get_char=get_att_output)
+            else:
                 # Attend (inputs current state of first layer, encoded features)
                 attn,context = self.attention(self.decoder.get_query(),encode_feature,encode_len)
                 # Decode (inputs context + embedded last character)                
                 decoder_input = torch.cat([last_char,context],dim=-1)
-                cur_char, d_state = self.decoder(decoder_input)
-                # Prepare output as input of next step
-                if (teacher is not None):
-                    # Training stage
-                    if (tf_rate==1) or (torch.rand(1).item()<=tf_rate):
-                        # teacher forcing
-                        last_char = teacher[:,t,:]
-                    else:
-                        # self-sampling (replace by argmax may be another choice)
-                        with torch.no_grad():
-                            if (emb_decoder is not None) and emb_decoder.apply_fuse:
-                                _, cur_prob = emb_decoder(d_state,cur_char,return_loss=False)
-                            else:
-                                cur_prob = cur_char.softmax(dim=-1)
-                            sampled_char = Categorical(cur_prob).sample()
-                        last_char = self.embed_drop(self.pre_embed(sampled_char))
+                cur_char, d_state = self.decoder(decoder_input, get_char=get_att_output)
+            # Prepare output as input of next step
+            if (teacher is not None):
+                # Training stage
+                if (tf_rate==1) or (torch.rand(1).item()<=tf_rate):
+                    # teacher forcing
+                    last_char = teacher[:,t,:]
                 else:
-                    # Inference stage
-                    if (emb_decoder is not None) and emb_decoder.apply_fuse:
-                        _,cur_char = emb_decoder(d_state,cur_char,return_loss=False)
-                    # argmax for inference
-                    last_char = self.pre_embed(torch.argmax(cur_char,dim=-1))
-
-                # save output of each step
-                output_seq.append(cur_char)
-                att_seq.append(attn)
-                if get_dec_state:
-                    dec_state.append(d_state)
-
-            att_output = torch.stack(output_seq,dim=1) # BxTxV
-            att_seq = torch.stack(att_seq,dim=2)       # BxNxDtxT
-            if get_dec_state:
-                dec_state = torch.stack(dec_state,dim=1)
+                    # self-sampling (replace by argmax may be another choice)
+                    with torch.no_grad():
+                        cur_logit = cur_char if get_att_output else self.decoder.char_trans(self.decoder.final_dropout(d_state))
+                        if (emb_decoder is not None) and emb_decoder.apply_fuse:
+                            _, cur_prob = emb_decoder(d_state,cur_logit,return_loss=False)
+                        else:
+                            cur_prob = cur_logit.softmax(dim=-1)
+                        sampled_char = Categorical(cur_prob).sample()
+                    last_char = self.embed_drop(self.pre_embed(sampled_char))
+            else:
+                # Inference stage
+                if (emb_decoder is not None) and emb_decoder.apply_fuse:
+                    _,cur_char = emb_decoder(d_state,cur_char,return_loss=False)
+                # argmax for inference
+                last_char = self.pre_embed(torch.argmax(cur_char,dim=-1))
+
+            # save output of each step
+            output_seq.append(cur_char)
+            att_seq.append(attn)
+            dec_state.append(d_state)
+
+        att_output = torch.stack(output_seq,dim=1) if get_att_output else None
+        return last_char, att_output, torch.stack(att_seq,dim=2), torch.stack(dec_state,dim=1)
+
+    def checkpoint_block(self, t_start, t_end, encode_feature, encode_len, teacher, tf_rate, emb_decoder,
+                         get_att_output, last_char, *state):
+        ''' decode_block() w/ decoder states as inputs/outputs, for activation checkpointing'''
+        self.set_decode_state(state)
+        output = self.decode_block(t_start, t_end, last_char, encode_feature, encode_len, teacher, tf_rate, emb_decoder,
+                                   get_att_output)
+        return output + self.get_decode_state()
+
+    def att_loss(self, dec_state, target, chunk_size=0):
+        '''
+        Cross entropy of attention decoder computed from decoder state (see get_att_output of forward())
+            dec_state  - [BxLxD] Decoder state
+            target     - [BxL]   Ground truth, <pad> (0) is ignored
+            chunk_size - [int]   Number of steps per chunk, logits of each chunk are recomputed in backward pass
+                                 so that BxLxV logits never exist at once (0: no chunking)
+        Returns loss averaged over tokens and prediction [BxL]
+        '''
+        n_step = target.shape[1]
+        chunked = 0 < chunk_size < n_step
+        chunk_size = chunk_size if chunked else n_step
+        loss, pred = 0, []
+        for t in range(0, n_step, chunk_size):
+            if chunked and torch.is_grad_enabled():
+                c_loss, c_pred = checkpoint(self.chunk_loss, dec_state[:,t:t+chunk_size], target[:,t:t+chunk_size],
+                                            use_reentrant=False)
+            else:
+                c_loss, c_pred = self.chunk_loss(dec_state[:,t:t+chunk_size], target[:,t:t+chunk_size])
+            loss = loss + c_loss
+            pred.append(c_pred)
+        return loss / (target!=0).sum().clamp(min=1), torch.cat(pred,dim=1)
+
+    def chunk_loss(self, dec_state, target):
+        ''' Summed cross entropy and prediction of a chunk of steps'''
+        logit = self.decoder.char_trans(self.decoder.final_dropout(dec_state))
+        loss = F.cross_entropy(logit.reshape(-1,logit.shape[-1]), target.reshape(-1), ignore_index=0, reduction='sum')
+        return loss, logit.argmax(dim=-1)
+
+    def get_decode_state(self):
+        ''' Tuple of recurrent decoder states (and previous attention of location-aware attention)'''
+        state = self.decoder.hidden_state if self.decoder.enable_cell else (self.decoder.hidden_state,)
+        if self.attention.mode == 'loc':
+            state = state + (self.attention.att_layer.prev_att,)
+        return tuple(state)
+
+    def set_decode_state(self, state):
+        if self.attention.mode == 'loc':
+            self.attention.att_layer.prev_att = state[-1]
+            state = state[:-1]
+        self.decoder.hidden_state = tuple(state) if self.decoder.enable_cell else state[0]
 
-        return ctc_output, encode_len, att_output, att_seq, dec_state
-    
     def fix_ctc_layer(self):
         for param in self.ctc_layer.parameters():
             param.requires_grad = False
@@ -162,12 +295,13 @@ class ASR(nn.Module):
 class Decoder(nn.Module):
     ''' Decoder (a.k.a. Speller in LAS) '''
     # ToDo:　More elegant way to implement decoder 
-    def __init__(self, input_dim, vocab_size, module, dim, layer, dropout):
+    def __init__(self, input_dim, vocab_size, module, dim, layer, dropout, checkpoint=0):
         super(Decoder, self).__init__()
         self.in_dim = input_dim
         self.layer = layer
         self.dim = dim
         self.dropout = dropout
+        self.checkpoint = checkpoint
 
         # Init 
         assert module in ['LSTM','GRU'], NotImplementedError
@@ -214,13 +348,13 @@ class Decoder(nn.Module):
         else:
             return self.hidden_state.transpose(0,1).reshape(-1,self.dim*self.layer)
 
-    def forward(self, x):
-        ''' Decode and transform into vocab '''
+    def forward(self, x, get_char=True):
+        ''' Decode and transform into vocab (char is None if get_char is False)'''
         if not self.training:
             self.layers.flatten_parameters()
         x, self.hidden_state = self.layers(x.unsqueeze(1),self.hidden_state)
         x = x.squeeze(1)
-        char = self.char_trans(self.final_dropout(x))
+        char = self.char_trans(self.final_dropout(x)) if get_char else None
         return char, x
     
     def fix_layers(self):
@@ -228,6 +362,92 @@ class Decoder(nn.Module):
             param.requires_grad = False
 
 
+class TransformerDecoder(nn.Module):
+    ''' Transformer decoder, masked self-attention + cross-attention to encoder feature
+        All target positions are computed in one pass w/ teacher forcing (forward),
+        inference decodes incrementally w/ cached keys/values of previous steps (step)'''
+    def __init__(self, enc_dim, vocab_size, module, dim, layer, dropout, num_head=4, ffn_dim=None, checkpoint=0):
+        super(TransformerDecoder, self).__init__()
+        self.layer = layer
+        self.dim = dim
+        self.dropout = dropout
+        self.checkpoint = checkpoint
+
+        # Modules
+        self.input_drop = nn.Dropout(dropout)
+        self.layers = nn.ModuleList([TransformerDecoderLayer(dim, enc_dim, num_head, ffn_dim or 4*dim, dropout)
+                                     for _ in range(layer)])
+        self.norm = nn.LayerNorm(dim)
+        self.char_trans = nn.Linear(dim,vocab_size)
+        self.final_dropout = nn.Dropout(dropout)
+
+        # Stored feature
+        self.memory = None
+        self.memory_mask = None
+        self.cache = None
+
+    def set_memory(self, enc_feat, enc_len):
+        ''' Project encoder feature into cross-attention key/value of each layer once'''
+        pad_mask = make_pad_mask(enc_len.to(enc_feat.device), enc_feat.shape[1])
+        self.memory_mask = torch.zeros(pad_mask.shape, device=enc_feat.device, dtype=enc_feat.dtype)\
+                                .masked_fill(pad_mask, float('-inf')).view(enc_feat.shape[0],1,1,-1)
+        self.memory = [l.cross_att.project_kv(enc_feat) for l in self.layers]
+
+    def init_state(self, bs):
+        ''' Clear cached keys/values of previous steps '''
+        self.cache = [None]*self.layer
+        return self.get_state()
+
+    def set_state(self, cache):
+        ''' Set cached keys/values, for decoding purpose'''
+        self.cache = cache
+
+    def get_state(self):
+        ''' Return cached keys/values, for decoding purpose (list is replaced at every step, safe to share)'''
+        return self.cache
+
+    def embed(self, x, offset=0):
+        position = torch.arange(offset, offset+x.shape[1], device=x.device)
+        return self.input_drop(x + sinusoid_table(position, self.dim).to(x.dtype))
+
+    def output(self, x, get_char=True):
+        x = self.norm(x)
+        return self.char_trans(self.final_dropout(x)) if get_char else None, x
+
+    def forward(self, x, need_weights=True, get_char=True):
+        ''' Decode all steps in parallel (teacher forcing), x: BxLxD embedded decoder input
+            Returns char BxLxV, decoder state BxLxD and cross-attention of last layer BxNxLxT
+            (None if get_char/need_weights is False)'''
+        x = self.embed(x)
+        for i, layer in enumerate(self.layers):
+            if self.checkpoint > 0 and self.training and torch.is_grad_enabled():
+                x, _, attn = checkpoint(layer, x, self.memory[i], self.memory_mask,
+                                        need_weights=need_weights and i==self.layer-1, use_reentrant=False)
+            else:
+                x, _, attn = layer(x, self.memory[i], self.memory_mask,
+                                   need_weights=need_weights and i==self.layer-1)
+        char, x = self.output(x, get_char)
+        return char, x, attn
+
+    def step(self, x, get_char=True):
+        ''' Decode one step w/ cached keys/values, x: BxD embedded last character
+            Returns char BxV, decoder state BxD and cross-attention of last layer BxNxT'''
+        offset = 0 if self.cache[0] is None else self.cache[0][0].shape[2]
+        x = self.embed(x.unsqueeze(1), offset)
+        cache = []
+        for i, layer in enumerate(self.layers):
+            x, kv, attn = layer(x, self.memory[i], self.memory_mask, cache=self.cache[i],
+                                need_weights=i==self.layer-1)
+            cache.append(kv)
+        self.cache = cache
+        char, x = self.output(x.squeeze(1), get_char)
+        return char, x, attn.squeeze(2)
+
+    def fix_layers(self):
+        for param in self.parameters():
+            param.requires_grad = False
+
+
 class Attention(nn.Module):  
     ''' Attention mechanism
         please refer to http://www.aclweb.org/anthology/D15-1166 section 3.1 for more details about Attention implementation
@@ -318,11 +538,14 @@ class Encoder(nn.Module):
     """
     Encoder composed of one vgg extractor followed by num_layers RNNLayers(GRU/LSTM) from src/module.py
     """
-    def __init__(self, input_size, vgg, vgg_freq, vgg_low_filt, module, bidirection, dim, dropout, layer_norm, proj, sample_rate, sample_style):
+    def __init__(self, input_size, vgg, vgg_freq, vgg_low_filt, module, bidirection, dim, dropout, layer_norm, proj, sample_rate, sample_style,
+                 pack=False, num_head=4, ffn_dim=None, pos_enc='relative', conv_kernel=None, checkpoint=False):
         super(Encoder, self).__init__()
 
         # Hyper-parameters checking
         self.vgg = vgg
+        self.module = module
+        self.pos_enc = pos_enc
         self.vgg_freq = vgg_freq
         self.vgg_low_filt = vgg_low_filt
         self.sample_rate = 1
@@ -356,7 +579,18 @@ class Encoder(nn.Module):
         if module in ['LSTM','GRU']:
             for l in range(num_layers):
                 module_list.append(RNNLayer(input_dim, module, dim[l], bidirection, dropout[l], layer_norm[l],
-                                            sample_rate[l], sample_style, proj[l]))
+                                            sample_rate[l], sample_style, proj[l], pack))
+                input_dim = module_list[-1].out_dim
+                self.sample_rate = self.sample_rate*sample_rate[l]
+        elif module in ['Transformer','Conformer']:
+            # Conv. module is enabled by default only for Conformer
+            if conv_kernel is None:
+                conv_kernel = 15 if module=='Conformer' else 0
+            module_list.append(TransformerInput(input_dim, dim[0], dropout[0], pos_enc))
+            input_dim = module_list[-1].out_dim
+            for l in range(num_layers):
+                module_list.append(TransformerLayer(input_dim, module, dim[l], num_head, ffn_dim or 4*dim[l], dropout[l],
+                                                    conv_kernel, pos_enc, sample_rate[l], sample_style, proj[l]))
                 input_dim = module_list[-1].out_dim
                 self.sample_rate = self.sample_rate*sample_rate[l]
         else:
@@ -365,10 +599,17 @@ class Encoder(nn.Module):
         self.in_dim = input_size
         self.out_dim = input_dim
         self.layers = nn.ModuleList(module_list)
+        # Index of layers to be checkpointed (activations recomputed in backward pass)
+        if type(checkpoint) is bool:
+            checkpoint = list(range(len(self.layers))) if checkpoint else []
+        self.checkpoint = set(checkpoint)
 
     def forward(self, input_x, enc_len):
-        for _, layer in enumerate(self.layers):
-            input_x, enc_len = layer(input_x, enc_len)
+        for i, layer in enumerate(self.layers):
+            if i in self.checkpoint and self.training and torch.is_grad_enabled():
+                input_x, enc_len = checkpoint(layer, input_x, enc_len, use_reentrant=False)
+            else:
+                input_x, enc_len = layer(input_x, enc_len)
         return input_x, enc_len
 
     def get_layer_output(self, input_x, enc_len, layer_num=1):
@@ -1,3 +1,4 @@
+import io
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -8,9 +9,19 @@ from librosa import feature, effects
 
 import numpy as np
 import random
+import wave
+from fractions import Fraction
+from functools import lru_cache
 
 GRIFFIN_LIM_ITER = 50
 SAMPLE_RATE = 16000
+# Segment of long recording is given as '<audio file>#<start sample>-<end sample>' (see corpus/preprocess_segments.py)
+SEGMENT_SEP = '#'
+# Min. number of frames per mel projection in streaming mode, a single frame falls back to
+# matrix-vector product which rounds differently from offline extraction
+STREAM_MIN_FRAMES = 8
+# Speed perturbation factors (see SpeedAugment)
+SPEED_FACTORS = [0.9, 1.0, 1.1]
 
 class CMVN(torch.jit.ScriptModule):
 
@@ -110,7 +121,7 @@ class Postprocess(torch.jit.ScriptModule):
     def forward(self, x):
         if self.batch:
             # [batch, channel, feature_dim, time] -> [batch, time, channel, feature_dim]
-            x = x.permute(0, 2, 3, 1)
+            x = x.permute(0, 3, 1, 2)
         else:
             # [channel, feature_dim, time] -> [time, channel, feature_dim]
             x = x.permute(2, 0, 1)
@@ -118,30 +129,74 @@ class Postprocess(torch.jit.ScriptModule):
             # [time, channel, feature_dim] -> [time, feature_dim * channel]
             return x.reshape(x.size(0), -1).detach()
         else:
-            # [batch, time, channel, feature_dim] -> [time, feature_dim * channel]
+            # [batch, time, channel, feature_dim] -> [batch, time, feature_dim * channel]
             return x.reshape(x.shape[0], x.shape[1], -1)
 
 
-class NoiseAugment(nn.Module):
-    def __init__(self):
-        super(NoiseAugment, self).__init__()
-        self.noise_factor = 0.02
-
-    def forward(self, data):
-        noise = torch.randn(len(data))
-        noised_data = data + self.noise_factor * noise
-        return noised_data
-
+class WaveAugment(nn.Module):
+    ''' Waveform augmentation of zero-padded batch (B x L, CH as batch for a single utterance), parameters
+        are drawn per utterance as tensors and applied to all utterances at once, padding stays zero.
+        shift      - max. delay (samples), leading samples are zero and the tail is dropped
+        gain_db    - max. gain (dB), drawn from [-gain_db, gain_db]
+        noise      - add white noise (scaled by noise_factor) if noise_bank is not given
+        noise_bank - .npy file of 1-D noise samples (SAMPLE_RATE), memory-mapped and randomly cropped
+                     per utterance, added w/ SNR (dB) drawn from snr'''
+    def __init__(self, shift=0, gain_db=0., noise=False, noise_bank=None, snr=(5., 20.), noise_factor=0.02):
+        super(WaveAugment, self).__init__()
+        self.shift = shift
+        self.gain_db = gain_db
+        self.noise = noise or noise_bank is not None
+        self.noise_bank = noise_bank
+        self.snr = snr
+        self.noise_factor = noise_factor
+        self.bank = None
+
+    def forward(self, waveforms, wave_len=None, generator=None):
+        # Modified in place (except shift), as the padded batch is created for feature extraction
+        B, L = waveforms.size()
+        if wave_len is None:
+            wave_len = torch.full((B,), L, dtype=torch.long)
+        device = waveforms.device
+        padding = torch.arange(L, device=device).unsqueeze(0) >= wave_len.to(device).unsqueeze(1) # B x L
+        if self.shift > 0:
+            shift = (torch.rand(B, 1, generator=generator) * (self.shift + 1)).long().to(device)
+            index = torch.arange(L, device=device).unsqueeze(0) - shift
+            delayed = index < 0
+            waveforms = waveforms.gather(1, index.clamp_(min=0)).masked_fill_(delayed | padding, 0.)
+        if self.gain_db > 0:
+            gain = (torch.rand(B, 1, generator=generator) * 2 - 1) * self.gain_db
+            waveforms.mul_(torch.pow(10., gain / 20).to(device, waveforms.dtype))
+        if self.noise:
+            waveforms.add_(self._noise(waveforms, wave_len, padding, generator))
+        return waveforms
+
+    def _noise(self, waveforms, wave_len, padding, generator):
+        B, L = waveforms.size()
+        if self.noise_bank is None:
+            noise = torch.randn(B, L, generator=generator).to(waveforms.device, waveforms.dtype)
+            return noise.mul_(self.noise_factor).masked_fill_(padding, 0.)
+        if self.bank is None:
+            # Opened on first use (per data loader worker)
+            self.bank = np.load(self.noise_bank, mmap_mode='r')
+        assert len(self.bank) > L, "Noise bank {} is shorter than utterance".format(self.noise_bank)
+        # Random crops, read as slices of memory map
+        start = (torch.rand(B, generator=generator) * (len(self.bank) - L)).long().tolist()
+        noise = torch.from_numpy(np.stack([self.bank[s:s+L] for s in start]).astype(np.float32, copy=False))
+        noise = noise.to(waveforms.device, waveforms.dtype).masked_fill_(padding, 0.)
+        # Scale noise to SNR w/ power of valid samples
+        snr = self.snr[0] + torch.rand(B, 1, generator=generator) * (self.snr[1] - self.snr[0])
+        ratio = waveforms.norm(dim=1, keepdim=True) / (noise.norm(dim=1, keepdim=True) + 1e-10)
+        return noise.mul_(ratio * torch.pow(10., -snr / 20).to(ratio))
+
+    def __getstate__(self):
+        # Memory map is not pickled to data loader workers
+        state = self.__dict__.copy()
+        state['bank'] = None
+        return state
 
-class ShiftAugment(nn.Module):
-    def __init__(self):
-        super(ShiftAugment, self).__init__()
-
-    def forward(self, data):
-        shift = random.randint(0, 1000)
-        shifted_data = torch.roll(data, shift)
-        shifted_data[:, :shift] = 0
-        return shifted_data
+    def extra_repr(self):
+        return "shift={}, gain_db={}, noise={}, noise_bank={}, snr={}".format(
+            self.shift, self.gain_db, self.noise, self.noise_bank, self.snr)
 
 
 class PitchAugment(nn.Module):
@@ -155,48 +210,156 @@ class PitchAugment(nn.Module):
 
 
 class SpeedAugment(nn.Module):
-    def __init__(self):
+    ''' Speed perturbation (tempo & pitch) by resampling, one of `factors` is drawn per utterance.
+        Resampling ratio is reduced to small integers (e.g. 0.9x resamples 9 -> 10), polyphase kernels
+        of all factors are computed once instead of phase vocoder (librosa time_stretch) per utterance'''
+    def __init__(self, factors=SPEED_FACTORS):
         super(SpeedAugment, self).__init__()
+        self.factors = list(factors)
+        self.resample = nn.ModuleList([self._resampler(f) for f in self.factors])
 
-    def forward(self, data):
-        speed_factor = random.uniform(0.9, 1.1)
-        data = data.numpy()
-        return torch.tensor(effects.time_stretch(data, speed_factor))
+    def _resampler(self, factor):
+        if factor == 1.0:
+            return nn.Identity()
+        ratio = Fraction(factor).limit_denominator(100)
+        return torchaudio.transforms.Resample(orig_freq=ratio.numerator, new_freq=ratio.denominator)
+
+    def forward(self, data, factor=None):
+        index = random.randrange(len(self.factors)) if factor is None else self.factors.index(factor)
+        return self.resample[index](data)
+
+    def extra_repr(self):
+        return "factors={}".format(self.factors)
 
 
 class SpecAugment(nn.Module):
-    def __init__(self, mf, mt):
+    ''' Batched SpecAugment (https://arxiv.org/abs/1904.08779) on B x MEL x T features (CH as batch for
+        a single utterance), bounds of all masks are drawn as tensors and applied w/ one broadcasted multiply.
+        mf/mt  - num. of frequency/time masks per utterance
+        f      - max. width of frequency mask (bins)
+        p      - max. width of time mask as ratio of valid length
+        w      - max. distance of time warping (frames), 0 to disable
+        Random numbers come from torch RNG (or given generator), which DataLoader seeds per worker
+        (base seed from --seed), so augmentation is reproducible. Features are masked in place.'''
+    def __init__(self, mf, mt, f=25, p=0.1, w=0):
         super(SpecAugment, self).__init__()
         self.mf = mf
         self.mt = mt
-
-    def forward(self, msp):
-        # msp: 1 x T x MEL
-        _, T, MEL = msp.size()
+        self.f = f
+        self.p = p
+        self.w = w
+
+    def forward(self, msp, msp_len=None, generator=None):
+        # msp: B x MEL x T, msp_len: num. of valid frames (B), padded frames are never selected
+        B, MEL, T = msp.size()
+        if msp_len is None:
+            msp_len = torch.full((B,), T, dtype=torch.long)
+        msp_len = msp_len.cpu()
+        if self.w > 0:
+            msp = self._time_warp(msp, msp_len, generator)
 
         # Frequency mask
-        for _ in range(self.mf):
-            r = random.randint(0, 25)
-            st = random.randint(0, MEL - r)
-            msp[:, :, st:st+r] = 0.0
-
+        width = self._randint(self.mf, min(self.f, MEL), B, generator)
+        start = self._randint(self.mf, MEL - width, B, generator)
+        keep_freq = self._keep(start, width, MEL, msp) # B x MEL
         # Time mask
-        for _ in range(self.mt):
-            r = random.randint(0, T / 10)
-            st = random.randint(0, T - r)
-            msp[:, st:st+r, :] = 0.0
-        
-        return msp
+        width = self._randint(self.mt, (msp_len.float() * self.p).long().unsqueeze(1), B, generator)
+        start = self._randint(self.mt, msp_len.unsqueeze(1) - width, B, generator)
+        keep_time = self._keep(start, width, T, msp) # B x T
+
+        # In-place (as masks are written into extracted features), avoids allocating another B x MEL x T
+        return msp.mul_(keep_freq.unsqueeze(2)).mul_(keep_time.unsqueeze(1))
+
+    def _randint(self, n, high, B, generator):
+        # B x n integers uniformly drawn from [0, high], high is int or broadcastable tensor
+        return (torch.rand(B, n, generator=generator) * (high + 1)).long()
+
+    def _keep(self, start, width, size, msp):
+        # B x size, 0 within any [start, start + width) of each row, 1 otherwise
+        index = torch.arange(size, device=msp.device)
+        start, end = start.to(msp.device).unsqueeze(2), (start + width).to(msp.device).unsqueeze(2)
+        return (~((index >= start) & (index < end)).any(1)).to(msp.dtype)
+
+    def _time_warp(self, msp, msp_len, generator):
+        ''' Move a random center frame (w/ in [w, len - w)) by up to w frames, frames on both sides are
+            linearly stretched/squeezed (valid frames only). Utterances shorter than 2w + 2 are kept.'''
+        B, MEL, T = msp.size()
+        length = msp_len.float()
+        warp = msp_len >= 2 * self.w + 2
+        center = self.w + torch.floor(torch.rand(B, generator=generator) * (length - 2 * self.w))
+        dest = center + (torch.rand(B, generator=generator) * 2 - 1) * self.w
+        center = torch.where(warp, center, length)
+        dest = torch.where(warp, dest, length)
+        last = (length - 1).clamp(min=0)
+        # Source position of each frame, piecewise linear mapping of [0, dest] -> [0, center] and
+        # [dest, len - 1] -> [center, len - 1], identity for padded frames (and kept utterances)
+        center, dest, length, last = [v.to(msp.device).unsqueeze(1) for v in [center, dest, length, last]]
+        t = torch.arange(T, device=msp.device, dtype=torch.float).unsqueeze(0)
+        src = torch.where(t < dest, t * center / dest.clamp(min=1e-3),
+                          last - (last - t) * (last - center) / (last - dest).clamp(min=1e-3))
+        src = torch.where(t < length, src, t)
+        lo = src.floor()
+        frac = (src - lo).to(msp.dtype).unsqueeze(1)
+        lo = lo.long()
+        hi = torch.min(lo + 1, torch.max(last.long(), lo))
+        lo, hi = lo.unsqueeze(1).expand(B, MEL, T), hi.unsqueeze(1).expand(B, MEL, T)
+        return torch.lerp(msp.gather(2, lo), msp.gather(2, hi), frac)
+
+
+class MelFeature(torch.jit.ScriptModule):
+    ''' Scripted mel-only feature extraction (linear spectrogram is never converted to dB):
+        pre-emphasis, STFT magnitude, mel projection w/ filterbank cropped to its nonzero frequency band
+        and dB + normalization fused into a single expression
+            clamp((20*log10(clamp(mel, 1e-5)) - ref_level_db - min_level_db) / -min_level_db, 0, 1)'''
+
+    __constants__ = ["n_fft", "hop_length", "win_length", "preemphasis_coeff", "lo", "hi", "scale", "bias"]
+
+    def __init__(self, n_fft, hop_length, win_length, window, mel_basis, ref_level_db, min_level_db,
+                 preemphasis_coeff):
+        super(MelFeature, self).__init__()
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.win_length = win_length
+        self.preemphasis_coeff = preemphasis_coeff
+        # mel_basis: FREQ x MEL, keep frequency bins w/ nonzero weight only
+        band = mel_basis.abs().sum(1).nonzero()
+        self.lo, self.hi = int(band.min()), int(band.max()) + 1
+        self.register_buffer("window", window)
+        self.register_buffer("fb", mel_basis[self.lo:self.hi].contiguous())
+        self.scale = 20. / float(np.log(10)) / -min_level_db
+        self.bias = (-ref_level_db - min_level_db) / -min_level_db
+
+    @torch.jit.script_method
+    def forward(self, waveform):
+        # CH x L -> CH x MEL x T
+        waveform = torch.cat([waveform[:, :1],
+                              waveform[:, 1:] - self.preemphasis_coeff * waveform[:, :-1]], dim=-1)
+        return self.mel(self.spectrogram(waveform, True))
+
+    @torch.jit.script_method
+    def spectrogram(self, waveform, center: bool):
+        # CH x L -> CH x FREQ x T (magnitude)
+        return torch.stft(waveform, self.n_fft, hop_length=self.hop_length, win_length=self.win_length,
+                          window=self.window, center=center, pad_mode="reflect", normalized=False,
+                          onesided=True, return_complex=True).abs()
+
+    @torch.jit.script_method
+    def mel(self, specgram):
+        # CH x FREQ x T -> CH x MEL x T, normalized log mel
+        melspecgram = torch.matmul(specgram[:, self.lo:self.hi].transpose(1, 2), self.fb).transpose(1, 2)
+        return torch.clamp(torch.log(torch.clamp(melspecgram, min=1e-5)) * self.scale + self.bias, 0., 1.)
+
+    def extra_repr(self):
+        return "n_fft={}, band=[{}, {})".format(self.n_fft, self.lo, self.hi)
 
 
-# TODO(Windqaq): make this scriptable
 class ExtractAudioFeature(nn.Module):
     def __init__(self, mode, num_mel_bins, frame_length, frame_shift, ref_level_db, 
-                 min_level_db, preemphasis_coeff, sample_rate=16000):
+                 min_level_db, preemphasis_coeff, sample_rate=16000, n_fft=1025):
         super(ExtractAudioFeature, self).__init__()
         self.mode = mode
         self.sr = sample_rate
-        self.n_fft = 1025
+        self.n_fft = n_fft
         self.window = None
         # Wave 2 spec
         self.hop_length = int(frame_shift  / 1000 * sample_rate)
@@ -223,21 +386,16 @@ class ExtractAudioFeature(nn.Module):
         _mel_basis = torch.from_numpy(_mel_basis)
         self.to_melspecgram.fb.resize_(_mel_basis.size())
         self.to_melspecgram.fb.copy_(_mel_basis)
+        assert self.win_length <= self.n_fft, "n_fft should be >= frame length ({} samples)".format(self.win_length)
+        # Fused mel-only extraction
+        self.feature = MelFeature(self.n_fft, self.hop_length, self.win_length, self.to_specgram.window,
+                                  _mel_basis, ref_level_db, min_level_db, preemphasis_coeff)
 
     def forward(self, waveform, channel=0):
         # waveform: B x T = 1 x T
         with torch.no_grad():
-            # Use pre-emphasis
-            waveform = self._preemphasis(waveform)
-            # sqrt(): HACK for the bug of torchaudio's spectrogram (power=1)
-            specgram = self.to_specgram(waveform).sqrt() # CH x FREQ x T
-            melspecgram = self.to_melspecgram(specgram) # CH x MEL x T
-            specgram = self._amp_to_db(specgram) - self.ref_level_db 
-            specgram = self._normalize(specgram)
-            melspecgram = self._amp_to_db(melspecgram) - self.ref_level_db
-            melspecgram = self._normalize(melspecgram)
-            msp = melspecgram[channel] # T x MEL
-        return msp.unsqueeze(0) # 1 x T x MEL
+            msp = self.feature(waveform)[channel] # MEL x T
+        return msp.unsqueeze(0) # 1 x MEL x T
 
     def extra_repr(self):
         return "mode={}, num_mel_bins={}".format(self.mode, self.num_mel_bins)
@@ -352,22 +510,296 @@ class ExtractAudioFeature(nn.Module):
 
 class ReadAudio(nn.Module):
     # Read audio files and downsample to specified sample rate
-    def __init__(self, desired_sr):
+    def __init__(self, desired_sr, pcm_dir=None):
         super(ReadAudio, self).__init__()
         self.desired_sr = desired_sr
+        # Decoded audio (see util/cache_pcm.py), served from memory map w/o decoding
+        self.pcm_cache = None
+        if pcm_dir is not None:
+            from src.pcm_cache import PCMCache
+            self.pcm_cache = PCMCache(pcm_dir, desired_sr)
     
     def forward(self, filepath):
         if type(filepath) is not str:
-            return filepath
-        waveform, sample_rate = torchaudio.load(filepath)
+            # Preloaded waveform (see SharedPCM)
+            return filepath.float().div_(32768.) if filepath.dtype == torch.int16 else filepath
+        if self.pcm_cache is not None:
+            return self.pcm_cache.load(filepath)
+        if SEGMENT_SEP in filepath:
+            waveform, sample_rate = read_segment(filepath)
+        else:
+            waveform, sample_rate = torchaudio.load(filepath)
         if sample_rate != self.desired_sr:
             # Sample all data to specified sample rate
-            waveform = torchaudio.compliance.kaldi.resample_waveform(waveform, 
-                                                                    sample_rate, 
-                                                                    self.desired_sr)
-        # print('new shape  : {}'.format(waveform.shape))
+            waveform = resampler(sample_rate, self.desired_sr)(waveform)
         return waveform
 
+    def extra_repr(self):
+        return "desired_sr={}, pcm_dir={}".format(
+            self.desired_sr, None if self.pcm_cache is None else self.pcm_cache.pcm_dir)
+
+
+@lru_cache(maxsize=None)
+def resampler(orig_sr, new_sr):
+    ''' Resampling w/ kernel computed once per rate pair (filter of kaldi resample_waveform)'''
+    return torchaudio.transforms.Resample(orig_sr, new_sr, lowpass_filter_width=6, rolloff=0.99)
+
+
+def read_audio_bytes(data, desired_sr=SAMPLE_RATE):
+    ''' Decode audio file content (PCM wav w/o external decoder, others through torchaudio) into 1 x T waveform '''
+    try:
+        with wave.open(io.BytesIO(data), 'rb') as fp:
+            sample_rate, n_channel, width = fp.getframerate(), fp.getnchannels(), fp.getsampwidth()
+            frames = fp.readframes(fp.getnframes())
+        if width != 2:
+            raise wave.Error('Only 16-bit PCM is supported by wave reader')
+        waveform = np.frombuffer(frames, dtype=np.int16).reshape(-1, n_channel).T
+        waveform = torch.from_numpy(waveform.astype(np.float32) / 32768)
+    except (wave.Error, EOFError):
+        waveform, sample_rate = torchaudio.load(io.BytesIO(data))
+    if sample_rate != desired_sr:
+        waveform = resampler(sample_rate, desired_sr)(waveform)
+    return waveform[:1]
+
+
+def segment_path(filepath, start, end):
+    ''' Path of segment [start, end) (in samples at rate of recording) of audio file'''
+    return '{}{}{}-{}'.format(filepath, SEGMENT_SEP, start, end)
+
+
+def parse_segment(filepath):
+    ''' Audio file and sample range of segment path, range is None for the whole file'''
+    if SEGMENT_SEP not in filepath:
+        return filepath, None, None
+    filepath, span = filepath.rsplit(SEGMENT_SEP, 1)
+    start, end = span.split('-')
+    return filepath, int(start), int(end)
+
+
+def read_segment(filepath):
+    ''' Decode sample range of segment path only (seek to start w/ soundfile), 1 x N waveform and sample rate'''
+    import soundfile
+    filepath, start, end = parse_segment(filepath)
+    data, sample_rate = soundfile.read(filepath, start=start, stop=end, dtype='float32', always_2d=True)
+    return torch.from_numpy(data.T.copy()), sample_rate
+
+
+def audio_info(filepath):
+    ''' Number of samples and sample rate of audio file (or segment) from its header w/o decoding '''
+    filepath, start, end = parse_segment(str(filepath))
+    if start is not None:
+        return end - start, audio_info(filepath)[1]
+    if filepath.endswith('.wav'):
+        with wave.open(filepath, 'rb') as fp:
+            return fp.getnframes(), fp.getframerate()
+    import soundfile
+    info = soundfile.info(filepath)
+    return info.frames, info.samplerate
+
+
+def audio_duration(filepath):
+    ''' Duration (sec.) of audio file from its header w/o decoding '''
+    samples, sample_rate = audio_info(filepath)
+    return samples / sample_rate
+
+
+class StreamingAudioFeature(nn.Module):
+    ''' Stateful wrapper of ExtractAudioFeature (and Delta) for chunked audio.
+        Keeps the last pre-emphasis sample, the STFT overlap buffer and the delta context
+        between calls so that each chunk only emits new frames. Concatenating all outputs
+        (including flush()) gives the same frames as the offline transform. '''
+    def __init__(self, extractor, delta=None, channel=0):
+        super(StreamingAudioFeature, self).__init__()
+        self.extractor = extractor
+        self.delta = delta
+        self.channel = channel
+        self.n_fft = extractor.n_fft
+        self.hop_length = extractor.hop_length
+        self.win_length = extractor.win_length
+        self.pad = self.n_fft // 2
+        # Frames a delta output depends on, on each side of the current frame
+        self.context = (delta.filters.shape[-1] - 1) // 2 if delta is not None else 0
+        self.reset()
+
+    def reset(self):
+        ''' Forget all states, call before feeding a new utterance '''
+        self.last_sample = None     # Last raw sample of previous chunk (pre-emphasis)
+        self.wave_buf = None        # Pre-emphasized samples not yet consumed by STFT
+        self.started = False        # Left reflect padding has been applied
+        self.frame_buf = None       # CH x MEL x T, feature frames kept as delta context
+        self.n_emitted = 0          # Number of frames in frame_buf already returned
+
+    def forward(self, chunk):
+        ''' chunk: [samples] or [channel, samples], returns T' x D frames completed by this chunk'''
+        with torch.no_grad():
+            return self._emit(self._accept(chunk), final=False)
+
+    def flush(self):
+        ''' Apply right padding of STFT/delta and return all remaining frames '''
+        with torch.no_grad():
+            frames = None
+            if self.wave_buf is not None:
+                if not self.started:
+                    self._start()
+                wave = self.wave_buf
+                # Reflect padding at the end of signal (same as center=True in STFT)
+                wave = torch.cat([wave, wave[:, -self.pad-1:-1].flip(-1)], dim=-1)
+                frames = self._stft(wave)
+            feat = self._emit(frames, final=True)
+        self.reset()
+        return feat
+
+    def _accept(self, chunk):
+        if chunk.dim() == 1:
+            chunk = chunk.unsqueeze(0)
+        chunk = chunk[self.channel:self.channel+1]
+        # Pre-emphasis w/ the last sample of previous chunk
+        coeff = self.extractor.preemphasis_coeff
+        if self.last_sample is None:
+            emphasized = self.extractor._preemphasis(chunk)
+        else:
+            emphasized = chunk - coeff * torch.cat([self.last_sample, chunk[:, :-1]], dim=-1)
+        self.last_sample = chunk[:, -1:]
+        self.wave_buf = emphasized if self.wave_buf is None else torch.cat([self.wave_buf, emphasized], dim=-1)
+
+        # Reflect padding at the begining requires pad+1 samples
+        if not self.started:
+            if self.wave_buf.shape[-1] <= self.pad:
+                return None
+            self._start()
+        return self._stft(self.wave_buf)
+
+    def _start(self):
+        wave = self.wave_buf
+        assert wave.shape[-1] > self.pad, 'Input should be longer than {} samples'.format(self.pad)
+        self.wave_buf = torch.cat([wave[:, 1:self.pad+1].flip(-1), wave], dim=-1)
+        self.started = True
+
+    def _stft(self, wave):
+        # Compute all complete frames and keep the overlap for next call
+        n_frame = (wave.shape[-1] - self.n_fft) // self.hop_length + 1
+        if n_frame <= 0:
+            return None
+        used = n_frame * self.hop_length
+        frames = wave[:, :used - self.hop_length + self.n_fft]
+        self.wave_buf = wave[:, used:]
+        specgram = self.extractor.feature.spectrogram(frames, False)
+        if n_frame < STREAM_MIN_FRAMES:
+            specgram = F.pad(specgram, (0, STREAM_MIN_FRAMES - n_frame))
+        return self.extractor.feature.mel(specgram)[:, :, :n_frame] # CH x MEL x T
+
+    def _emit(self, frames, final):
+        if frames is not None:
+            self.frame_buf = frames if self.frame_buf is None else torch.cat([self.frame_buf, frames], dim=-1)
+        if self.frame_buf is None:
+            return torch.zeros((0, self.extractor.num_mel_bins*self._n_channel()))
+        if self.delta is None:
+            feat = self.frame_buf[:, :, self.n_emitted:]
+            self.frame_buf = self.frame_buf[:, :, :0]
+            self.n_emitted = 0
+            return self._to_output(feat)
+
+        # Delta of frame t requires frames [t-context, t+context]
+        total = self.frame_buf.shape[-1]
+        ready = total if final else max(total - self.context, self.n_emitted)
+        if ready == self.n_emitted:
+            return torch.zeros((0, self.extractor.num_mel_bins*self._n_channel()))
+        left = max(self.n_emitted - self.context, 0)
+        right = total if final else min(ready + self.context, total)
+        window = self.frame_buf[:, :, left:right]
+        feat = self.delta(window)[:, :, self.n_emitted-left:ready-left]
+        # Keep only frames needed as left context
+        keep = max(ready - self.context, 0)
+        self.frame_buf = self.frame_buf[:, :, keep:]
+        self.n_emitted = ready - keep
+        return self._to_output(feat)
+
+    def _to_output(self, feat):
+        # CH x MEL x T -> T x CH*MEL
+        return feat.permute(2, 0, 1).reshape(feat.shape[2], feat.shape[0]*feat.shape[1])
+
+    def _n_channel(self):
+        return 1 if self.delta is None else self.delta.filters.shape[0]
+
+
+class BatchAudioFeature(nn.Module):
+    ''' Batch counterpart of create_transform, features of padded waveforms are extracted at once
+        (waveform augmentation, pre-emphasis, STFT, mel, dB & normalization, delta, CMVN) instead of one call
+        per utterance. Each waveform is reflect-padded at its own length (same as center=True of STFT) and
+        frames beyond each utterance are masked before delta/CMVN, so valid frames are the same as
+        per-utterance extraction. Returns B x T x D features and number of valid frames.
+        augments     - per-file augmentation changing length (pitch/speed), applied when reading
+        wave_augment - WaveAugment applied to padded batch
+        on_device    - collect_audio_batch only pads waveforms, extract() is called on training device'''
+    def __init__(self, extractor, augments=[], wave_augment=None, spec_augment=None, delta=None, apply_cmvn=False,
+                 on_device=False, eps=1e-10, read_audio=None):
+        super(BatchAudioFeature, self).__init__()
+        self.read_audio = read_audio if read_audio is not None else ReadAudio(SAMPLE_RATE)
+        self.augments = nn.Sequential(*augments)
+        self.wave_augment = wave_augment
+        self.extractor = extractor
+        self.spec_augment = spec_augment
+        self.delta = delta
+        self.apply_cmvn = apply_cmvn
+        self.on_device = on_device
+        self.eps = eps
+        self.postprocess = Postprocess(detach=False, batch=True)
+
+    def read(self, filepaths):
+        ''' Waveforms (1 x L) of audio files w/ per-file augmentation'''
+        return [self.augments(self.read_audio(f)) for f in filepaths]
+
+    def n_frames(self, n_samples):
+        ext = self.extractor
+        return 1 + (n_samples + 2 * (ext.n_fft // 2) - ext.n_fft) // ext.hop_length
+
+    def pad(self, waveforms):
+        ''' Zero padding to the longest (first channel)'''
+        wave_len = torch.LongTensor([w.shape[-1] for w in waveforms])
+        return nn.utils.rnn.pad_sequence([w[0] for w in waveforms], batch_first=True), wave_len # B x L
+
+    def reflect(self, waveforms, wave_len):
+        ''' Pre-emphasis & reflect padding (n_fft // 2 on both sides) at length of each utterance'''
+        ext = self.extractor
+        pad = ext.n_fft // 2
+        waveforms = ext._preemphasis(waveforms)
+        B, L = waveforms.size()
+        n = wave_len.to(waveforms.device).unsqueeze(1)
+        index = torch.arange(L + 2 * pad, device=waveforms.device).unsqueeze(0) - pad
+        index = index.abs()
+        index = torch.where(index < n, index, 2 * (n - 1) - index)
+        valid = (index >= 0) & (torch.arange(L + 2 * pad, device=waveforms.device).unsqueeze(0) < n + 2 * pad)
+        return waveforms.gather(1, index.clamp(0, L - 1)) * valid # B x (L + 2 * pad)
+
+    def extract(self, waveforms, wave_len, augment=True):
+        ''' Features of padded waveforms (from pad()), augment=False for validation (no wave/spec augmentation)'''
+        ext = self.extractor
+        with torch.no_grad():
+            if self.wave_augment is not None and augment:
+                waveforms = self.wave_augment(waveforms, wave_len)
+            waveforms = self.reflect(waveforms, wave_len)
+            feat_len = self.n_frames(wave_len)
+            msp = ext.feature.mel(ext.feature.spectrogram(waveforms, False)) # B x MEL x T
+            msp = msp[:, :, :int(feat_len.max())]
+            mask = (torch.arange(msp.shape[-1], device=msp.device).unsqueeze(0) < feat_len.unsqueeze(1)).to(msp.dtype)
+            msp = msp * mask.unsqueeze(1)
+            if self.spec_augment is not None and augment:
+                msp = self.spec_augment(msp, feat_len)
+            # B x CH x MEL x T
+            feat = self.delta(msp) if self.delta is not None else msp.unsqueeze(1)
+            mask = mask[:, None, None, :]
+            if self.apply_cmvn:
+                # Unbiased std. over valid frames as CMVN
+                n = feat_len.to(feat.dtype)[:, None, None, None]
+                mean = (feat * mask).sum(-1, keepdim=True) / n
+                std = ((feat - mean).pow(2) * mask).sum(-1, keepdim=True).div(n - 1).sqrt()
+                feat = (feat - mean) / (self.eps + std)
+            feat = self.postprocess(feat * mask) # B x T x D
+        return feat, feat_len
+
+    def forward(self, waveforms):
+        return self.extract(*self.pad(waveforms))
+
 
 def pop_audio_config(audio_config):
     # Delta
@@ -391,28 +823,58 @@ def create_transform(audio_config, post_process=True):
     apply_spec_augment = audio_config.pop("apply_spec_augment", False)
     mf = audio_config.pop("mf", 0)
     mt = audio_config.pop("mt", 0)
-
-    transforms = [ReadAudio(SAMPLE_RATE)]
-    
-    # Audio Augment
-    augment_list = []
-    augment_list.append(NoiseAugment())
-    augment_list.append(ShiftAugment())
-    augment_list.append(PitchAugment())
-    augment_list.append(SpeedAugment())
-    for augment, state in zip(augment_list, apply_audio_augment):
-        if state:
-            transforms.append(augment)
+    time_warp = audio_config.pop("time_warp", 0)
+    feat_dir = audio_config.pop("feat_dir", None)
+    speed_perturb = audio_config.pop("speed_perturb", None)
+    gain_db = audio_config.pop("gain_db", 0.)
+    noise_bank = audio_config.pop("noise_bank", None)
+    noise_snr = audio_config.pop("noise_snr", [5., 20.])
+    pcm_dir = audio_config.pop("pcm_dir", None)
+    # True: extract features of whole batch at once in collect_audio_batch, 'device': on training device
+    batch_feature = audio_config.pop("batch_feature", False) if post_process and feat_dir is None else False
+
+    wave_augment = None
+    if feat_dir is not None:
+        # Precomputed features (see util/extract_feature.py), only SpecAugment/Delta/CMVN are applied on the fly
+        from src.feature_store import LoadFeature
+        assert not any(apply_audio_augment) and gain_db == 0 and noise_bank is None, \
+            "Audio augmentation is not available w/ precomputed features."
+        # Speed perturbed variants are extracted in advance (see util/extract_feature.py --speed)
+        transforms = [LoadFeature(feat_dir, audio_config, speed_perturb)]
+        feat_dim = audio_config["feat_dim"]
+    else:
+        transforms = [ReadAudio(SAMPLE_RATE, pcm_dir)]
         
-    # Extract Feature
-    feat_type = audio_config.pop("feat_type")
-    feat_dim = audio_config.pop("feat_dim")
-
-    transforms.append(ExtractAudioFeature(mode=feat_type, num_mel_bins=feat_dim, sample_rate=SAMPLE_RATE, **audio_config))
+        # Audio Augment (Noise, Shift, Pitch, Speed), pitch/speed per file and then the rest at once
+        noise, shift, pitch, speed = apply_audio_augment
+        if pitch:
+            transforms.append(PitchAugment())
+        if speed:
+            transforms.append(SpeedAugment())
+        if speed_perturb:
+            transforms.append(SpeedAugment(speed_perturb))
+        if noise or shift or gain_db > 0 or noise_bank is not None:
+            wave_augment = WaveAugment(1000 if shift else 0, gain_db, noise, noise_bank, noise_snr)
+            if not batch_feature:
+                transforms.append(wave_augment)
+            
+        # Extract Feature
+        feat_type = audio_config.pop("feat_type")
+        feat_dim = audio_config.pop("feat_dim")
+
+        transforms.append(ExtractAudioFeature(mode=feat_type, num_mel_bins=feat_dim, sample_rate=SAMPLE_RATE, **audio_config))
+
+    if batch_feature:
+        # Extract features of whole batch at once (see collect_audio_batch)
+        return BatchAudioFeature(transforms[-1], transforms[1:-1], wave_augment,
+                                 SpecAugment(mf, mt, w=time_warp) if apply_spec_augment else None,
+                                 Delta(delta_order, delta_window_size, batch=True) if delta_order >= 1 else None,
+                                 apply_cmvn, batch_feature == 'device', read_audio=transforms[0]), \
+               feat_dim * (delta_order + 1)
     
     # Spec Augment
     if apply_spec_augment:
-        transforms.append(SpecAugment(mf, mt))
+        transforms.append(SpecAugment(mf, mt, w=time_warp))
 
     if delta_order >= 1:
         transforms.append(Delta(delta_order, delta_window_size))
@@ -426,6 +888,26 @@ def create_transform(audio_config, post_process=True):
     return nn.Sequential(*transforms), feat_dim * (delta_order + 1)
 
 
+def create_streaming_transform(audio_config):
+    ''' Streaming counterpart of create_transform (for inference on chunked audio)'''
+    delta_order = audio_config.pop("delta_order", 0)
+    delta_window_size = audio_config.pop("delta_window_size", 2)
+    if audio_config.pop("apply_cmvn", False):
+        raise NotImplementedError(
+            "Global CMVN requires the complete utterance, which is not available in streaming mode.")
+    # Augmentations are for training only, precomputed features are not available for unseen audio
+    for key in ["apply_audio_augment", "apply_spec_augment", "mf", "mt", "time_warp", "feat_dir", "batch_feature",
+                "speed_perturb", "gain_db", "noise_bank", "noise_snr", "pcm_dir"]:
+        audio_config.pop(key, None)
+    feat_type = audio_config.pop("feat_type")
+    feat_dim = audio_config.pop("feat_dim")
+
+    extractor = ExtractAudioFeature(mode=feat_type, num_mel_bins=feat_dim, sample_rate=SAMPLE_RATE, **audio_config)
+    delta = Delta(delta_order, delta_window_size) if delta_order >= 1 else None
+
+    return StreamingAudioFeature(extractor, delta), feat_dim * (delta_order + 1)
+
+
 # Filters from librosa, you may ignore this
 
 def create_mel_filterbank(sr, n_fft, n_mels=128, fmin=0.0, fmax=None, htk=False,
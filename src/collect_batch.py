@@ -3,24 +3,36 @@ import numpy as np
 from torch.nn.utils.rnn import pad_sequence
 import torch.nn.functional as F
 
+from src.audio import BatchAudioFeature
+from src.feature_store import utt_id
+
 HALF_BATCHSIZE_AUDIO_LEN = 800 # Batch size will be halfed if the longest wavefile surpasses threshold
-# Note: Bucketing may cause random sampling to be biased (less sampled for those length > HALF_BATCHSIZE_AUDIO_LEN )
+# Note: Bucketing may cause random sampling to be biased (dropped half of buckets w/ length > HALF_BATCHSIZE_AUDIO_LEN is not seen in that epoch)
 HALF_BATCHSIZE_TEXT_LEN = 150
 
-def collect_audio_batch(batch, audio_transform, mode):
+def _audio(x):
+    ''' Audio file path, or waveform preloaded by dataset (read_audio)'''
+    return x if torch.is_tensor(x) else str(x)
+
+def collect_audio_batch(batch, audio_transform, mode, half_batch=True):
     '''Collects a batch, should be list of tuples (audio_path <str>, list of int token <list>) 
-       e.g. [(file1,txt1),(file2,txt2),...] '''
+       e.g. [(file1,txt1),(file2,txt2),...] 
+       half_batch - halve batch of long utterances, not needed w/ activation checkpointing or frame-budget batching '''
 
     # Bucketed batch should be [[(file1,txt1),(file2,txt2),...]]
     if type(batch[0]) is not tuple:
         batch = batch[0]
+    if isinstance(audio_transform, BatchAudioFeature):
+        return _collect_audio_batch(batch, audio_transform, mode, half_batch)
     # Make sure that batch size is reasonable
     # For each bucket, the first audio must be the longest one
     # But for multi-dataset, this is not the case !!!!
-    
-    if HALF_BATCHSIZE_AUDIO_LEN < 3500 and mode == 'train':
-        first_len = audio_transform(str(batch[0][0])).shape[0]
-        if first_len > HALF_BATCHSIZE_AUDIO_LEN:
+    first_feat = None
+    if HALF_BATCHSIZE_AUDIO_LEN < 3500 and mode == 'train' and half_batch:
+        # Feature of the first audio is kept for reading batch (first item is never dropped)
+        with torch.no_grad():
+            first_feat = audio_transform(_audio(batch[0][0]))
+        if first_feat.shape[0] > HALF_BATCHSIZE_AUDIO_LEN:
             batch = batch[::2]
     
     # Read batch
@@ -28,11 +40,13 @@ def collect_audio_batch(batch, audio_transform, mode):
     with torch.no_grad():
         for index, b in enumerate(batch):
             if type(b[0]) is str:
-                file.append(str(b[0]).split('/')[-1].split('.')[0])
-                feat = audio_transform(str(b[0]))
+                file.append(utt_id(b[0]))
             else:
                 file.append('dummy')
-                feat = audio_transform(str(b[0]))
+            if index == 0 and first_feat is not None:
+                feat = first_feat
+            else:
+                feat = audio_transform(_audio(b[0]))
             audio_feat.append(feat)
             audio_len.append(len(feat))
             text.append(torch.LongTensor(b[1]))
@@ -47,12 +61,27 @@ def collect_audio_batch(batch, audio_transform, mode):
     
     return file, audio_feat, audio_len, text
 
+def _collect_audio_batch(batch, audio_transform, mode, half_batch):
+    ''' collect_audio_batch w/ features of whole batch extracted at once (see BatchAudioFeature)'''
+    waveforms = audio_transform.read([_audio(b[0]) for b in batch])
+    if HALF_BATCHSIZE_AUDIO_LEN < 3500 and mode == 'train' and half_batch:
+        if audio_transform.n_frames(waveforms[0].shape[-1]) > HALF_BATCHSIZE_AUDIO_LEN:
+            batch, waveforms = batch[::2], waveforms[::2]
+    if audio_transform.on_device:
+        # Padded waveforms & num. of samples, features are extracted on training device
+        audio_feat, audio_len = audio_transform.pad(waveforms)
+    else:
+        audio_feat, audio_len = audio_transform(waveforms)
+    file = tuple(utt_id(b[0]) if type(b[0]) is str else 'dummy' for b in batch)
+    text = pad_sequence([torch.LongTensor(b[1]) for b in batch], batch_first=True)
+    return file, audio_feat, audio_len, text
+
 def collect_text_batch(batch, mode):
     '''Collects a batch of text, should be list of list of int token 
        e.g. [txt1 <list>,txt2 <list>,...] '''
 
     # Bucketed batch should be [[txt1, txt2,...]]
-    if type(batch[0][0]) is list:
+    if np.ndim(batch[0][0]) > 0:
         batch = batch[0]
     # Half batch size if input to long
     if len(batch[0])>HALF_BATCHSIZE_TEXT_LEN and mode=='train':
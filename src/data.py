@@ -3,22 +3,31 @@ import numpy as np
 from functools import partial
 from src.text import load_text_encoder
 from src.audio import create_transform
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, DistributedSampler, IterableDataset
 from torch.nn.utils.rnn import pad_sequence
 import torch.nn.functional as F
 from os.path import join
 
 from src.collect_batch import collect_audio_batch, collect_text_batch
+from src.sampler import BucketBatchSampler, DistributedEvalSampler, FrameBudgetBatchSampler
 
 def create_dataset(tokenizer, ascending, name, path, bucketing, batch_size, 
-                   train_split=None, dev_split=None, test_split=None, read_audio=False):
-    ''' Interface for creating all kinds of dataset'''
+                   train_split=None, dev_split=None, test_split=None, read_audio=False, batch_frames=None,
+                   bucket_band=1, shard_dir=None, n_jobs=16, seed=0):
+    ''' Interface for creating all kinds of dataset, n_jobs - num. of workers for indexing corpus
+        shard_dir - sequential shards of splits (see util/write_shards.py), read as stream instead of corpus
+        seed      - seed of shard shuffling (shared by all processes)'''
+    if shard_dir is not None:
+        return _create_shard_dataset(tokenizer, ascending, name, shard_dir, batch_size, train_split, dev_split,
+                                     test_split, seed, n_jobs)
 
     # Recognize corpus
     if name.lower() == 'librispeech':
         from corpus.preprocess_librispeech import LibriDataset as Dataset
     elif name.lower() == 'dlhlp':
         from corpus.preprocess_dlhlp import DLHLPDataset as Dataset
+    elif name.lower() == 'segments':
+        from corpus.preprocess_segments import SegmentDataset as Dataset
     else:
         raise NotImplementedError
 
@@ -26,11 +35,11 @@ def create_dataset(tokenizer, ascending, name, path, bucketing, batch_size,
     if train_split is not None:
         # Training mode
         mode = 'train'
-        tr_loader_bs = 1 if bucketing and (not ascending) else batch_size
-        bucket_size = batch_size if bucketing and (not ascending) else 1 # Ascending without bucketing
+        tr_loader_bs = batch_size
+        bucket_size = 1 # Buckets are drawn by BucketBatchSampler (see load_dataset)
         
         if type(dev_split[0]) is not list:
-            dv_set = Dataset(path,dev_split,tokenizer, 1, read_audio=read_audio) # Do not use bucketing for dev set
+            dv_set = Dataset(path,dev_split,tokenizer, 1, read_audio=read_audio, n_jobs=n_jobs) # Do not use bucketing for dev set
             dv_len = len(dv_set)
         else:
             dv_set = []
@@ -41,17 +50,15 @@ def create_dataset(tokenizer, ascending, name, path, bucketing, batch_size,
                     from corpus.preprocess_librispeech import LibriDataset as DevDataset
                 else:
                     raise NotImplementedError(ds[0])
-                dv_set.append(DevDataset(dev_dir,ds,tokenizer, 1))
+                dv_set.append(DevDataset(dev_dir,ds,tokenizer, 1, n_jobs=n_jobs))
             dv_len = sum([len(s) for s in dv_set])
         
-        if path[-4:].lower() != name[-4:].lower():
-            tr_dir = join(path, name)
-        else:
-            tr_dir = path
+        tr_dir = _corpus_dir(name, path)
         
         tr_set = Dataset(tr_dir,train_split,tokenizer, bucket_size, 
                     ascending=ascending, 
-                    read_audio=read_audio)
+                    read_audio=read_audio,
+                    n_jobs=n_jobs)
         # Messages to show
         msg_list = _data_msg(name,path,train_split.__str__(),len(tr_set),
                              dev_split.__str__(),dv_len,batch_size,bucketing)
@@ -60,24 +67,47 @@ def create_dataset(tokenizer, ascending, name, path, bucketing, batch_size,
     else:
         # Testing model
         mode = 'test'
-        if path[-4:].lower() != name[-4:].lower():
-            tt_dir = join(path, name)
-        else:
-            tt_dir = path
+        tt_dir = _corpus_dir(name, path)
         
         bucket_size = 1
         if type(dev_split[0]) is list: dev_split = dev_split[0]
         
-        dv_set = Dataset(tt_dir,dev_split,tokenizer, bucket_size, read_audio=read_audio) # Do not use bucketing for dev set
-        tt_set = Dataset(tt_dir,test_split,tokenizer, bucket_size, read_audio=read_audio) # Do not use bucketing for test set
+        dv_set = Dataset(tt_dir,dev_split,tokenizer, bucket_size, read_audio=read_audio, n_jobs=n_jobs) # Do not use bucketing for dev set
+        tt_set = Dataset(tt_dir,test_split,tokenizer, bucket_size, read_audio=read_audio, n_jobs=n_jobs) # Do not use bucketing for test set
         # Messages to show
         msg_list = _data_msg(name,tt_dir,dev_split.__str__(),len(dv_set),
                              test_split.__str__(),len(tt_set),batch_size,False)
         msg_list = [m.replace('Dev','Test').replace('Train','Dev') for m in msg_list]
         return dv_set, tt_set, batch_size, batch_size, mode, msg_list
 
-def create_textset(tokenizer, train_split, dev_split, name, path, bucketing, batch_size):
-    ''' Interface for creating all kinds of text dataset'''
+def _corpus_dir(name, path):
+    ''' Directory of corpus splits, segment lists are read from path as is'''
+    if path[-4:].lower() != name[-4:].lower() and name.lower() != 'segments':
+        return join(path, name)
+    return path
+
+def _create_shard_dataset(tokenizer, ascending, name, shard_dir, batch_size, train_split, dev_split, test_split, seed,
+                          n_jobs):
+    ''' create_dataset w/ ShardDataset, shards of training set are shuffled'''
+    from src.shard import ShardDataset
+    if train_split is not None:
+        assert type(dev_split[0]) is not list, "Multiple dev sets are not available w/ shards"
+        tr_set = ShardDataset(shard_dir, train_split, tokenizer, shuffle=not ascending, seed=seed,
+                              num_workers=n_jobs)
+        dv_set = ShardDataset(shard_dir, dev_split, tokenizer)
+        msg_list = _data_msg(name,shard_dir,train_split.__str__(),len(tr_set),
+                             dev_split.__str__(),len(dv_set),batch_size,False)
+        return tr_set, dv_set, batch_size, batch_size, 'train', msg_list
+    if type(dev_split[0]) is list: dev_split = dev_split[0]
+    dv_set = ShardDataset(shard_dir, dev_split, tokenizer)
+    tt_set = ShardDataset(shard_dir, test_split, tokenizer)
+    msg_list = _data_msg(name,shard_dir,dev_split.__str__(),len(dv_set),
+                         test_split.__str__(),len(tt_set),batch_size,False)
+    msg_list = [m.replace('Dev','Test').replace('Train','Dev') for m in msg_list]
+    return dv_set, tt_set, batch_size, batch_size, 'test', msg_list
+
+def create_textset(tokenizer, train_split, dev_split, name, path, bucketing, batch_size, bucket_band=1, n_jobs=16):
+    ''' Interface for creating all kinds of text dataset, n_jobs - num. of workers for reading transcriptions'''
     msg_list = []
 
     # Recognize corpus
@@ -89,10 +119,9 @@ def create_textset(tokenizer, train_split, dev_split, name, path, bucketing, bat
         raise NotImplementedError
 
     # Create dataset
-    bucket_size = batch_size if bucketing else 1
-    tr_loader_bs = 1 if bucketing else batch_size
-    dv_set = Dataset(path,dev_split,tokenizer, 1) # Do not use bucketing for dev set
-    tr_set = Dataset(path,train_split,tokenizer, bucket_size)
+    tr_loader_bs = batch_size
+    dv_set = Dataset(path,dev_split,tokenizer, 1, n_jobs=n_jobs) # Do not use bucketing for dev set
+    tr_set = Dataset(path,train_split,tokenizer, 1, n_jobs=n_jobs) # Buckets are drawn by BucketBatchSampler (see load_textset)
     
     # Messages to show
     msg_list = _data_msg(name,path,train_split.__str__(),len(tr_set),
@@ -100,14 +129,22 @@ def create_textset(tokenizer, train_split, dev_split, name, path, bucketing, bat
 
     return tr_set, dv_set, tr_loader_bs, batch_size, msg_list
 
-def load_dataset(n_jobs, use_gpu, pin_memory, ascending, corpus, audio, text):
-    ''' Prepare dataloader for training/validation'''
+def load_dataset(n_jobs, use_gpu, pin_memory, ascending, corpus, audio, text, half_batch=True, rank=0, world_size=1,
+                 seed=0):
+    ''' Prepare dataloader for training/validation, data is split over processes if world_size > 1
+        seed - seed of batch/shard shuffling, must be the same for all processes'''
     """
     audio file preprocessing(create_transform) is in src/audio.py
     """
+    if corpus.get('shard_dir') is not None:
+        from src.shard import read_index
+        if read_index(corpus['shard_dir'])['kind'] == 'feature':
+            # Precomputed features are read from shards w/ transcriptions
+            audio = dict(audio, feat_dir=corpus['shard_dir'])
     # Audio feature extractor
     audio_transform_tr, feat_dim = create_transform(audio.copy())
-    audio_transform_dv, feat_dim = create_transform(audio.copy())
+    # Speed perturbation/gain/noise bank change the utterance, evaluated on original audio only
+    audio_transform_dv, feat_dim = create_transform(dict(audio, speed_perturb=None, gain_db=0., noise_bank=None))
     
     """
     DlhlpDataset/LibriDataset is first created, data is in form (wav path, converted txt label)
@@ -116,44 +153,84 @@ def load_dataset(n_jobs, use_gpu, pin_memory, ascending, corpus, audio, text):
     # Text tokenizer
     tokenizer = load_text_encoder(**text)
     # Dataset (in testing mode, tr_set=dv_set, dv_set=tt_set)
-    tr_set, dv_set, tr_loader_bs, dv_loader_bs, mode, data_msg = create_dataset(tokenizer,ascending,**corpus)
+    tr_set, dv_set, tr_loader_bs, dv_loader_bs, mode, data_msg = create_dataset(tokenizer,ascending,n_jobs=n_jobs,seed=seed,**corpus)
     
+    # Shards are read as stream, shuffled & split over processes/workers by dataset (no sampler)
+    streaming = isinstance(tr_set, IterableDataset)
+    # Frame-budget batching keeps memory per step nearly constant, batch of long utterances needs not be halved
+    dynamic = mode == 'train' and corpus.get('batch_frames') is not None and not streaming
     # Collect function
-    collect_tr = partial(collect_audio_batch, audio_transform=audio_transform_tr, mode=mode)
+    collect_tr = partial(collect_audio_batch, audio_transform=audio_transform_tr, mode=mode,
+                         half_batch=half_batch and not dynamic)
     collect_dv = partial(collect_audio_batch, audio_transform=audio_transform_dv, mode='test')
     
     # Shuffle/drop applied to training set only
     shuffle = (mode=='train' and not ascending)
     drop_last = shuffle
+    # Disjoint buckets of length-sorted data, each utterance is visited once per epoch
+    bucketing = shuffle and corpus['bucketing'] and not dynamic and not streaming
+    # Distributed training, processes take different part of data (call sampler.set_epoch to reshuffle)
+    tr_sampler, dv_sampler = None, lambda ds: None
+    if world_size > 1 and mode == 'train':
+        if not (dynamic or bucketing or streaming):
+            # Otherwise split by batch sampler
+            tr_sampler = DistributedSampler(tr_set, world_size, rank, shuffle=shuffle, seed=seed, drop_last=True)
+        dv_sampler = lambda ds: None if isinstance(ds, IterableDataset) else DistributedEvalSampler(ds, world_size, rank)
+        shuffle = False
     # Create data loader
-    tr_set = DataLoader(tr_set, batch_size=tr_loader_bs, shuffle=shuffle, drop_last=drop_last, collate_fn=collect_tr,
-                        num_workers=n_jobs, pin_memory=use_gpu)
+    if streaming:
+        tr_set = DataLoader(tr_set, batch_size=tr_loader_bs, drop_last=drop_last, collate_fn=collect_tr,
+                            num_workers=n_jobs, pin_memory=use_gpu)
+    elif dynamic:
+        # Feature frames of each utterance estimated from duration
+        lengths = [int(d * 1000 / audio['frame_shift']) for d in tr_set.duration]
+        batch_sampler = FrameBudgetBatchSampler(lengths, corpus['batch_frames'], shuffle=shuffle, seed=seed,
+                                                num_replicas=world_size, rank=rank)
+        tr_set = DataLoader(tr_set, batch_sampler=batch_sampler, collate_fn=collect_tr,
+                            num_workers=n_jobs, pin_memory=use_gpu)
+        stats = batch_sampler.stats()
+        data_msg.append('Batching   | Frames/batch = {}\t| Batches = {}\t| Avg. batch size = {:.1f}\t| Padding = {:.1f}%'\
+                        .format(corpus['batch_frames'], stats['batches'], stats['batch_size'], 100 * stats['padding']))
+    elif bucketing:
+        batch_sampler = BucketBatchSampler(len(tr_set), tr_loader_bs, band=corpus.get('bucket_band', 1), seed=seed,
+                                           num_replicas=world_size, rank=rank)
+        tr_set = DataLoader(tr_set, batch_sampler=batch_sampler, collate_fn=collect_tr,
+                            num_workers=n_jobs, pin_memory=use_gpu)
+    else:
+        tr_set = DataLoader(tr_set, batch_size=tr_loader_bs, shuffle=shuffle, drop_last=drop_last, collate_fn=collect_tr,
+                            num_workers=n_jobs, pin_memory=use_gpu, sampler=tr_sampler)
     
     if type(dv_set) is list:
         _tmp_set = []
         for ds in dv_set:
             _tmp_set.append(DataLoader(ds, batch_size=dv_loader_bs, shuffle=False, drop_last=False, collate_fn=collect_dv,
-                        num_workers=n_jobs, pin_memory=pin_memory))
+                        num_workers=n_jobs, pin_memory=pin_memory, sampler=dv_sampler(ds)))
         dv_set = _tmp_set
     else:
         dv_set = DataLoader(dv_set, batch_size=dv_loader_bs, shuffle=False, drop_last=False, collate_fn=collect_dv,
-                        num_workers=n_jobs, pin_memory=pin_memory)
+                        num_workers=n_jobs, pin_memory=pin_memory, sampler=dv_sampler(dv_set))
     
     # Messages to show
     data_msg.append('I/O spec.  | Audio Feature = {}\t| Feature Dim = {}\t| Token Type = {}\t| Vocab Size = {}'\
                     .format(audio['feat_type'],feat_dim,tokenizer.token_type,tokenizer.vocab_size))
     return tr_set, dv_set, feat_dim, tokenizer.vocab_size, tokenizer, data_msg
 
-def load_textset(n_jobs, use_gpu, pin_memory, corpus, text):
+def load_textset(n_jobs, use_gpu, pin_memory, corpus, text, seed=0):
     # Text tokenizer
     tokenizer = load_text_encoder(**text)
     # Dataset
-    tr_set, dv_set, tr_loader_bs, dv_loader_bs, data_msg = create_textset(tokenizer,**corpus)
+    tr_set, dv_set, tr_loader_bs, dv_loader_bs, data_msg = create_textset(tokenizer,n_jobs=n_jobs,**corpus)
     collect_tr = partial(collect_text_batch,mode='train')
     collect_dv = partial(collect_text_batch,mode='dev')
     # Dataloader (Text data stored in RAM, no need num_workers)
-    tr_set = DataLoader(tr_set, batch_size=tr_loader_bs, shuffle=True, drop_last=True, collate_fn=collect_tr,
-                        num_workers=0, pin_memory=use_gpu)
+    if corpus['bucketing']:
+        # Disjoint buckets of length-sorted text
+        batch_sampler = BucketBatchSampler(len(tr_set), tr_loader_bs, band=corpus.get('bucket_band', 1), seed=seed)
+        tr_set = DataLoader(tr_set, batch_sampler=batch_sampler, collate_fn=collect_tr,
+                            num_workers=0, pin_memory=use_gpu)
+    else:
+        tr_set = DataLoader(tr_set, batch_size=tr_loader_bs, shuffle=True, drop_last=True, collate_fn=collect_tr,
+                            num_workers=0, pin_memory=use_gpu)
     dv_set = DataLoader(dv_set, batch_size=dv_loader_bs, shuffle=False, drop_last=False, collate_fn=collect_dv,
                         num_workers=0, pin_memory=pin_memory)
 
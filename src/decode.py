@@ -63,13 +63,24 @@ class BeamDecoder(nn.Module):
         return msg
 
     def forward(self, audio_feature, feature_len):
-        # Init.
         assert audio_feature.shape[0] == 1, "Batchsize == 1 is required for beam search"
-        batch_size = audio_feature.shape[0]
-        device = audio_feature.device
+        # Encode
+        encode_feature, encode_len = self.asr.encoder(
+            audio_feature, feature_len)
+        return self.search(encode_feature, encode_len, feature_len)
+
+    def search(self, encode_feature, encode_len, feature_len):
+        ''' Beam search over encoder output (for callers that run encoder by themselves)'''
+        # Init.
+        assert encode_feature.shape[0] == 1, "Batchsize == 1 is required for beam search"
+        batch_size = encode_feature.shape[0]
+        device = encode_feature.device
         dec_state = self.asr.decoder.init_state(
             batch_size)                           # Init zero states
-        self.asr.attention.reset_mem()            # Flush attention mem
+        if self.asr.transformer_dec:
+            self.asr.decoder.set_memory(encode_feature, encode_len)
+        else:
+            self.asr.attention.reset_mem()        # Flush attention mem
         # Max output len set w/ hyper param.
         max_output_len = int(
             np.ceil(feature_len.cpu().item()*self.max_len_ratio))
@@ -77,7 +88,7 @@ class BeamDecoder(nn.Module):
         min_output_len = int(
             np.ceil(feature_len.cpu().item()*self.min_len_ratio))
         # Store attention map if location-aware
-        store_att = self.asr.attention.mode == 'loc'
+        store_att = not self.asr.transformer_dec and self.asr.attention.mode == 'loc'
         prev_token = torch.zeros(
             (batch_size, 1), dtype=torch.long, device=device)     # Start w/ <sos>
         # Cache of beam search
@@ -85,14 +96,10 @@ class BeamDecoder(nn.Module):
         # Incase ctc is disabled
         ctc_state, ctc_prob, candidates, lm_state = None, None, None, None
 
-        # Encode
-        encode_feature, encode_len = self.asr.encoder(
-            audio_feature, feature_len)
-
         # CTC decoding
         if self.apply_ctc:
             ctc_output = F.log_softmax(
-                self.asr.ctc_layer(encode_feature), dim=-1)
+                self.asr.ctc_layer(encode_feature).float(), dim=-1)
             ctc_prefix = CTCPrefixScore(ctc_output)
             ctc_state = ctc_prefix.init_state()
 
@@ -109,17 +116,21 @@ class BeamDecoder(nn.Module):
                 self.asr.set_state(prev_dec_state, prev_attn)
 
                 # Normal asr forward
-                attn, context = self.asr.attention(
-                    self.asr.decoder.get_query(), encode_feature, encode_len)
                 asr_prev_token = self.asr.pre_embed(prev_token)
-                decoder_input = torch.cat([asr_prev_token, context], dim=-1)
-                cur_prob, d_state = self.asr.decoder(decoder_input)
+                if self.asr.transformer_dec:
+                    cur_prob, d_state, attn = self.asr.decoder.step(asr_prev_token)
+                else:
+                    attn, context = self.asr.attention(
+                        self.asr.decoder.get_query(), encode_feature, encode_len)
+                    decoder_input = torch.cat([asr_prev_token, context], dim=-1)
+                    cur_prob, d_state = self.asr.decoder(decoder_input)
 
                 # Embedding fusion (output shape 1xV)
                 if self.apply_emb:
                     _, cur_prob = self.emb_decoder( d_state, cur_prob, return_loss=False)
                 else:
-                    cur_prob = F.log_softmax(cur_prob, dim=-1)
+                    # Scores are accumulated in fp32 (logits may be half precision under autocast)
+                    cur_prob = F.log_softmax(cur_prob.float(), dim=-1)
 
                 # Perform CTC prefix scoring on limited candidates (else OOM easily)
                 if self.apply_ctc:
@@ -146,7 +157,7 @@ class BeamDecoder(nn.Module):
                         lm_input, torch.ones([batch_size]), hidden=prev_lm_state)
                     # assuming batch size always 1,  resulting 1xV
                     lm_output = lm_output.squeeze(0)
-                    cur_prob += self.lm_w*lm_output.log_softmax(dim=-1)
+                    cur_prob += self.lm_w*lm_output.float().log_softmax(dim=-1)
 
                 # Beam search
                 # Note: Ignored batch dim.
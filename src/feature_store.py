@@ -0,0 +1,143 @@
+import json
+import random
+import numpy as np
+import torch
+import torch.nn as nn
+from os.path import join
+
+from src.audio import parse_segment
+
+STORE_VERSION = 1
+INDEX_FILE = 'index.json'
+# Hyper-parameters of ExtractAudioFeature, stored features must be extracted w/ the same setting
+EXTRACT_KEYS = ['feat_type', 'feat_dim', 'frame_length', 'frame_shift', 'ref_level_db', 'min_level_db',
+                'preemphasis_coeff', 'n_fft']
+# Normalized features are in [0, 1] (see ExtractAudioFeature._normalize), quantized w/ a fixed scale
+STORE_DTYPES = {'fp16': np.float16, 'int8': np.uint8}
+INT8_SCALE = 255.0
+
+
+def utt_id(filepath):
+    ''' Utterance id used as key of feature store (as in collect_audio_batch),
+        <recording id>_<start>_<end> for segment of long recording (see src/audio.py)'''
+    filepath, start, end = parse_segment(str(filepath))
+    name = filepath.split('/')[-1].split('.')[0]
+    return name if start is None else '{}_{}_{}'.format(name, start, end)
+
+
+def speed_id(utt, speed):
+    ''' Key of speed perturbed variant (Kaldi style), original utterance keeps its id'''
+    return utt if speed == 1.0 else 'sp{}-{}'.format(speed, utt)
+
+
+def extract_config(audio_config):
+    return {k: audio_config[k] for k in EXTRACT_KEYS if k in audio_config}
+
+
+def quantize(feat, dtype):
+    ''' T x D float feature -> array to store'''
+    feat = np.asarray(feat, dtype=np.float32)
+    if dtype == 'int8':
+        return np.round(np.clip(feat, 0, 1) * INT8_SCALE).astype(np.uint8)
+    return feat.astype(STORE_DTYPES[dtype])
+
+
+def dequantize(feat, dtype):
+    ''' Stored array -> T x D float tensor'''
+    feat = torch.from_numpy(feat.astype(np.float32))
+    if dtype == 'int8':
+        feat.div_(INT8_SCALE)
+    return feat
+
+
+def write_shard(feat_dir, shard_id, feats, dtype):
+    ''' Concatenate features (list of T x D arrays) into one shard, returns shard file name'''
+    shard = 'shard-{:05d}.npy'.format(shard_id)
+    np.save(join(feat_dir, shard), np.concatenate([quantize(f, dtype) for f in feats], axis=0))
+    return shard
+
+
+def write_index(feat_dir, shards, utts, dtype, audio_config, speeds=[1.0]):
+    ''' shards - list of shard file names
+        utts   - {utterance id (or speed_id): (shard index, frame offset, num. of frames)}
+        speeds - speed perturbation factors of stored variants'''
+    index = {'version': STORE_VERSION, 'dtype': dtype, 'audio': extract_config(audio_config),
+             'speeds': sorted(speeds), 'shards': shards, 'utts': utts}
+    with open(join(feat_dir, INDEX_FILE), 'w') as fp:
+        json.dump(index, fp)
+
+
+class FeatureStore(object):
+    ''' Read-only precomputed features, shards are memory-mapped on first access (per process,
+        so that it works with forked dataloader workers) and features are returned as views'''
+    def __init__(self, feat_dir):
+        with open(join(feat_dir, INDEX_FILE), 'r') as fp:
+            index = json.load(fp)
+        assert index['version'] == STORE_VERSION, "Feature store @ {} is outdated".format(feat_dir)
+        self.feat_dir = feat_dir
+        self.dtype = index['dtype']
+        self.audio_config = index['audio']
+        self.speeds = index.get('speeds', [1.0])
+        self.shard_files = index['shards']
+        self.utts = index['utts']
+        self.shards = {}
+
+    def __contains__(self, utt):
+        return utt in self.utts
+
+    def __len__(self):
+        return len(self.utts)
+
+    def __getitem__(self, utt):
+        ''' Zero-copy view (T x D) of stored feature'''
+        shard, offset, length = self.utts[utt]
+        if shard not in self.shards:
+            self.shards[shard] = np.load(join(self.feat_dir, self.shard_files[shard]), mmap_mode='r')
+        return self.shards[shard][offset:offset+length]
+
+    def load(self, utt):
+        ''' Stored feature as float tensor (T x D)'''
+        return dequantize(self[utt], self.dtype)
+
+    def check(self, audio_config):
+        stored, current = self.audio_config, extract_config(audio_config)
+        if stored != current:
+            raise ValueError('Features @ {} were extracted w/ {}, but audio config is {}, please re-extract.'
+                             .format(self.feat_dir, stored, current))
+
+
+class LoadFeature(nn.Module):
+    ''' Replacement of ReadAudio + ExtractAudioFeature, load precomputed feature of audio file from store
+        speeds - speed perturbation factors, a stored variant is drawn per utterance (None for original only)'''
+    def __init__(self, feat_dir, audio_config, speeds=None):
+        super(LoadFeature, self).__init__()
+        self.feat_dir = feat_dir
+        self.speeds = speeds
+        with open(join(feat_dir, INDEX_FILE), 'r') as fp:
+            index = json.load(fp)
+        if 'kind' in index:
+            # Shards (see src/shard.py), features are read by ShardDataset and passed through
+            assert index['kind'] == 'feature', "Shards @ {} are not features".format(feat_dir)
+            self.store, self.dtype, stored, stored_speeds = None, index['dtype'], index['audio'], [1.0]
+        else:
+            self.store = FeatureStore(feat_dir)
+            self.dtype, stored, stored_speeds = self.store.dtype, self.store.audio_config, self.store.speeds
+        if stored != extract_config(audio_config):
+            raise ValueError('Features @ {} were extracted w/ {}, but audio config is {}, please re-extract.'
+                             .format(feat_dir, stored, extract_config(audio_config)))
+        if speeds is not None and not set(speeds) <= set(stored_speeds):
+            raise ValueError('Features @ {} are extracted w/ speed {}, but {} is required, please extract with --speed.'
+                             .format(feat_dir, stored_speeds, speeds))
+
+    def forward(self, filepath):
+        if torch.is_tensor(filepath):
+            # Feature read by dataset (1 x MEL x T)
+            return filepath
+        utt = utt_id(filepath)
+        if self.speeds:
+            utt = speed_id(utt, random.choice(self.speeds))
+        # Same layout as ExtractAudioFeature output
+        return self.store.load(utt).t().unsqueeze(0) # 1 x MEL x T
+
+    def extra_repr(self):
+        return "feat_dir={}, dtype={}, speeds={}".format(self.feat_dir, self.dtype, self.speeds)
@@ -0,0 +1,85 @@
+import os
+import json
+from os.path import join, exists, getmtime, relpath, dirname
+from joblib import Parallel, delayed
+
+from src.audio import audio_info
+
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = '.manifest.jsonl'
+
+
+def load_manifest(split_dir, tokenizer, scan_fn, n_jobs=16):
+    ''' Load manifest of a corpus split (<split_dir>.manifest.jsonl), (re)build if missing or stale.
+        scan_fn(split_dir) -> list of audio files, list of transcripts, list of transcript files
+        Manifest is a JSONL file, first line is the header, followed by one utterance per line
+            {"path": <relative to split_dir>, "samples": <int>, "sample_rate": <int>, "text": <str>, "tokens": [<int>]}
+        and is invalidated if any directory (file added/removed) or transcript file is modified.
+        Token ids are re-encoded only if the tokenizer changes (different fingerprint).
+        Returns list of entries w/ absolute path.'''
+    manifest_file = split_dir.rstrip('/') + MANIFEST_SUFFIX
+    header, entries = _read_manifest(manifest_file, split_dir)
+    if entries is None:
+        entries = _build_entries(split_dir, scan_fn, n_jobs)
+        header = {'version': MANIFEST_VERSION, 'tokenizer': None, 'sources': _sources(split_dir, entries)}
+    if header['tokenizer'] != tokenizer.fingerprint:
+        for e in entries:
+            e['tokens'] = tokenizer.encode(e['text'])
+        header['tokenizer'] = tokenizer.fingerprint
+        _write_manifest(manifest_file, header, entries)
+    for e in entries:
+        e['path'] = join(split_dir, e['path'])
+    return entries
+
+
+def _read_manifest(manifest_file, split_dir):
+    ''' Header and entries of manifest, None if missing or stale'''
+    if not exists(manifest_file):
+        return None, None
+    with open(manifest_file, 'r', encoding='UTF-8') as fp:
+        header = json.loads(fp.readline())
+        if header.get('version') != MANIFEST_VERSION:
+            return None, None
+        for src, mtime in header['sources'].items():
+            src = join(split_dir, src)
+            if not exists(src) or getmtime(src) != mtime:
+                return None, None
+        return header, [json.loads(line) for line in fp]
+
+
+def _build_entries(split_dir, scan_fn, n_jobs):
+    file_list, text, trans_files = scan_fn(split_dir)
+    assert len(file_list) > 0, "No data found @ {}".format(split_dir)
+    # Number of samples from audio header (I/O bound)
+    info = Parallel(n_jobs=max(1, n_jobs), prefer='threads')(delayed(audio_info)(f) for f in file_list)
+    entries = [{'path': relpath(str(f), split_dir), 'samples': n, 'sample_rate': sr, 'text': txt}
+               for f, (n, sr), txt in zip(file_list, info, text)]
+    # Keep transcript files to detect modification
+    for e, f in zip(entries, trans_files):
+        e['trans'] = relpath(str(f), split_dir)
+    return entries
+
+
+def _sources(split_dir, entries):
+    ''' mtime of all directories (from split_dir to audio files) and transcript files'''
+    sources = set(['.'])
+    for e in entries:
+        path = dirname(e['path'])
+        while path not in sources and path != '':
+            sources.add(path)
+            path = dirname(path)
+        sources.add(e.pop('trans'))
+    return {src: getmtime(join(split_dir, src)) for src in sorted(sources)}
+
+
+def _write_manifest(manifest_file, header, entries):
+    ''' Write to temp. file then rename, corpus directory may be read-only (manifest is rebuilt next time)'''
+    tmp_file = '{}.{}.tmp'.format(manifest_file, os.getpid())
+    try:
+        with open(tmp_file, 'w', encoding='UTF-8') as fp:
+            fp.write(json.dumps(header) + '\n')
+            for e in entries:
+                fp.write(json.dumps(e, ensure_ascii=False) + '\n')
+        os.replace(tmp_file, manifest_file)
+    except OSError as err:
+        print('[WARNING] Failed to write manifest {} ({})'.format(manifest_file, err))
@@ -1,3 +1,4 @@
+import math
 import torch
 import numpy as np
 import torch.nn as nn
@@ -326,7 +327,8 @@ class FreqVGGExtractor2(nn.Module):
 
 class RNNLayer(nn.Module):
     ''' RNN wrapper, includes time-downsampling'''
-    def __init__(self, input_dim, module, dim, bidirection, dropout, layer_norm, sample_rate, sample_style, proj):
+    def __init__(self, input_dim, module, dim, bidirection, dropout, layer_norm, sample_rate, sample_style, proj,
+                 pack=False):
         super(RNNLayer, self).__init__()
         # Setup
         rnn_out_dim = 2*dim if bidirection else dim
@@ -336,6 +338,7 @@ class RNNLayer(nn.Module):
         self.sample_rate = sample_rate
         self.sample_style = sample_style
         self.proj = proj
+        self.pack = pack
 
         if self.sample_style not in ['drop','concat']:
             raise ValueError('Unsupported Sample Style: '+self.sample_style)
@@ -357,10 +360,15 @@ class RNNLayer(nn.Module):
         # Forward RNN
         if not self.training:
             self.layer.flatten_parameters()
-        # ToDo: check time efficiency of pack/pad
-        #input_x = pack_padded_sequence(input_x, x_len, batch_first=True, enforce_sorted=False)
-        output,_ = self.layer(input_x)
-        #output,x_len = pad_packed_sequence(output,batch_first=True)
+        if self.pack:
+            # Skip padded frames (backward direction also starts from the last valid frame)
+            total_length = input_x.shape[1]
+            # Packed sequence requires at least 1 frame (empty utterance, downsampled or not)
+            input_x = pack_padded_sequence(input_x, x_len.clamp(min=1).cpu(), batch_first=True, enforce_sorted=False)
+            output,_ = self.layer(input_x)
+            output,_ = pad_packed_sequence(output, batch_first=True, total_length=total_length)
+        else:
+            output,_ = self.layer(input_x)
 
         # Normalizations
         if self.layer_norm:
@@ -370,17 +378,10 @@ class RNNLayer(nn.Module):
 
         # Perform Downsampling
         if self.sample_rate > 1:
-            batch_size,timestep,feature_dim = output.shape
-            x_len = x_len//self.sample_rate
-
-            if self.sample_style =='drop':
-                # Drop the unselected timesteps
-                output = output[:,::self.sample_rate,:].contiguous()
-            else:
-                # Drop the redundant frames and concat the rest according to sample rate
-                if timestep%self.sample_rate != 0:
-                    output = output[:,:-(timestep%self.sample_rate),:]
-                output = output.contiguous().view(batch_size,int(timestep/self.sample_rate),feature_dim*self.sample_rate)
+            output,x_len = time_downsample(output, x_len, self.sample_rate, self.sample_style)
+            if self.pack:
+                # Packed sequence requires at least 1 frame for the next layer
+                x_len = x_len.clamp(min=1)
 
         if self.proj:
             output = torch.tanh(self.pj(output)) 
@@ -388,6 +389,270 @@ class RNNLayer(nn.Module):
         return output,x_len
 
 
+def time_downsample(x, x_len, sample_rate, sample_style):
+    ''' Downsample BxTxD sequence on time axis by dropping or concatenating frames'''
+    batch_size,timestep,feature_dim = x.shape
+    x_len = x_len//sample_rate
+    if sample_style =='drop':
+        # Drop the unselected timesteps
+        x = x[:,::sample_rate,:].contiguous()
+    else:
+        # Drop the redundant frames and concat the rest according to sample rate
+        if timestep%sample_rate != 0:
+            x = x[:,:-(timestep%sample_rate),:]
+        x = x.contiguous().view(batch_size,int(timestep/sample_rate),feature_dim*sample_rate)
+    return x,x_len
+
+
+def make_pad_mask(x_len, max_len):
+    ''' BxT mask, True for padded frames'''
+    return torch.arange(max_len, device=x_len.device).unsqueeze(0) >= x_len.unsqueeze(1)
+
+
+def sinusoid_table(position, dim):
+    ''' Sinusoidal encoding (https://arxiv.org/abs/1706.03762) of given positions, returns len(position) x dim'''
+    div_term = torch.exp(torch.arange(0, dim, 2, device=position.device, dtype=torch.float) * (-math.log(10000.0)/dim))
+    angle = position.float().unsqueeze(1) * div_term
+    table = torch.zeros(len(position), dim, device=position.device)
+    table[:,0::2] = torch.sin(angle)
+    table[:,1::2] = torch.cos(angle[:,:dim//2])
+    return table
+
+
+class TransformerInput(nn.Module):
+    ''' Input layer of Transformer encoder, linear projection (+ absolute sinusoidal positional encoding)'''
+    def __init__(self, input_dim, dim, dropout, pos_enc):
+        super(TransformerInput, self).__init__()
+        self.out_dim = dim
+        self.pos_enc = pos_enc
+        self.proj = nn.Linear(input_dim, dim)
+        self.dropout = nn.Dropout(dropout)
+
+    def forward(self, x, x_len):
+        x = self.proj(x)
+        if self.pos_enc == 'sinusoidal':
+            position = torch.arange(x.shape[1], device=x.device)
+            x = x*math.sqrt(self.out_dim) + sinusoid_table(position, self.out_dim).to(x.dtype)
+        return self.dropout(x), x_len
+
+
+class SelfAttention(nn.Module):
+    ''' Multi-head self-attention, optionally w/ relative sinusoidal positions (https://arxiv.org/abs/1901.02860)'''
+    def __init__(self, dim, num_head, dropout, relative):
+        super(SelfAttention, self).__init__()
+        assert dim % num_head == 0, 'Transformer dim should be divisible by num_head'
+        self.dim = dim
+        self.num_head = num_head
+        self.d_k = dim // num_head
+        self.relative = relative
+        self.dropout = dropout
+        self.qkv = nn.Linear(dim, 3*dim)
+        self.out_proj = nn.Linear(dim, dim)
+        if relative:
+            self.pos_proj = nn.Linear(dim, dim, bias=False)
+            self.pos_bias_u = nn.Parameter(torch.zeros(num_head, self.d_k))
+            self.pos_bias_v = nn.Parameter(torch.zeros(num_head, self.d_k))
+
+    def forward(self, x, pad_mask):
+        bs,ts,_ = x.shape
+        q,k,v = self.qkv(x).view(bs,ts,3,self.num_head,self.d_k).permute(2,0,3,1,4) # BxNxTxD each
+        mask = pad_mask.view(bs,1,1,ts)
+        if self.relative:
+            # Score of relative distance i-j, table ordered from T-1 to -(T-1)
+            position = torch.arange(ts-1, -ts, -1, device=x.device)
+            pos = self.pos_proj(sinusoid_table(position, self.dim).to(x.dtype))
+            pos = pos.view(-1,self.num_head,self.d_k).transpose(0,1) # Nx(2T-1)xD
+            bias = torch.matmul(q + self.pos_bias_v.unsqueeze(1), pos.transpose(1,2)) # BxNxTx(2T-1)
+            index = ts - 1 - torch.arange(ts, device=x.device).unsqueeze(1) + torch.arange(ts, device=x.device)
+            bias = bias.gather(-1, index.expand(bs,self.num_head,ts,ts)) / math.sqrt(self.d_k)
+            q = q + self.pos_bias_u.unsqueeze(1)
+            mask = bias.masked_fill(mask, float('-inf'))
+        else:
+            mask = torch.zeros_like(mask, dtype=x.dtype).masked_fill(mask, float('-inf'))
+        dropout = self.dropout if self.training else 0.0
+        if hasattr(F, 'scaled_dot_product_attention'):
+            context = F.scaled_dot_product_attention(q, k, v, attn_mask=mask, dropout_p=dropout)
+        else:
+            attn = torch.matmul(q, k.transpose(2,3)) / math.sqrt(self.d_k) + mask
+            attn = F.dropout(attn.softmax(dim=-1), dropout, self.training)
+            context = torch.matmul(attn, v)
+        context = context.transpose(1,2).reshape(bs,ts,self.dim)
+        return self.out_proj(context)
+
+
+class FeedForward(nn.Module):
+    ''' Pre-LN position-wise feed forward network'''
+    def __init__(self, dim, ffn_dim, dropout, activation):
+        super(FeedForward, self).__init__()
+        self.net = nn.Sequential(
+                            nn.LayerNorm(dim),
+                            nn.Linear(dim, ffn_dim),
+                            activation(),
+                            nn.Dropout(dropout),
+                            nn.Linear(ffn_dim, dim),
+                            nn.Dropout(dropout)
+                        )
+
+    def forward(self, x):
+        return self.net(x)
+
+
+class ConvModule(nn.Module):
+    ''' Convolution module of Conformer (https://arxiv.org/abs/2005.08100)
+        LayerNorm is used in place of BatchNorm so that padded frames do not affect statistics'''
+    def __init__(self, dim, kernel_size, dropout):
+        super(ConvModule, self).__init__()
+        assert kernel_size % 2 == 1, 'Kernel size of conv. module should be odd'
+        self.pre_norm = nn.LayerNorm(dim)
+        self.pointwise_in = nn.Conv1d(dim, 2*dim, 1)
+        self.depthwise = nn.Conv1d(dim, dim, kernel_size, padding=kernel_size//2, groups=dim)
+        self.norm = nn.LayerNorm(dim)
+        self.pointwise_out = nn.Conv1d(dim, dim, 1)
+        self.dropout = nn.Dropout(dropout)
+
+    def forward(self, x, pad_mask):
+        x = F.glu(self.pointwise_in(self.pre_norm(x).transpose(1,2)), dim=1)
+        # Zero padded frames so they do not leak into valid ones through depthwise conv.
+        x = x.masked_fill(pad_mask.unsqueeze(1), 0.0)
+        x = self.depthwise(x).transpose(1,2)
+        x = F.silu(self.norm(x)).transpose(1,2)
+        x = self.pointwise_out(x).transpose(1,2)
+        return self.dropout(x)
+
+
+class TransformerLayer(nn.Module):
+    ''' Pre-LN Transformer/Conformer block, includes time-downsampling
+        Conformer = macaron feed forward + self-attention + conv. module'''
+    def __init__(self, input_dim, module, dim, num_head, ffn_dim, dropout, conv_kernel, pos_enc,
+                 sample_rate, sample_style, proj):
+        super(TransformerLayer, self).__init__()
+        # Setup
+        self.out_dim = sample_rate*dim if sample_rate>1 and sample_style=='concat' else dim
+        self.macaron = module == 'Conformer'
+        self.sample_rate = sample_rate
+        self.sample_style = sample_style
+        self.proj = proj
+
+        if self.sample_style not in ['drop','concat']:
+            raise ValueError('Unsupported Sample Style: '+self.sample_style)
+        if pos_enc not in ['sinusoidal','relative']:
+            raise ValueError('Unsupported Positional Encoding: '+pos_enc)
+
+        # Modules
+        activation = nn.SiLU if self.macaron else nn.ReLU
+        if input_dim != dim:
+            self.in_proj = nn.Linear(input_dim, dim)
+        if self.macaron:
+            self.ffn_in = FeedForward(dim, ffn_dim, dropout, activation)
+        self.att_norm = nn.LayerNorm(dim)
+        self.att = SelfAttention(dim, num_head, dropout, pos_enc=='relative')
+        self.att_drop = nn.Dropout(dropout)
+        if conv_kernel > 0:
+            self.conv = ConvModule(dim, conv_kernel, dropout)
+        self.ffn_out = FeedForward(dim, ffn_dim, dropout, activation)
+        self.out_norm = nn.LayerNorm(dim)
+        if self.proj:
+            self.pj = nn.Linear(self.out_dim, self.out_dim)
+
+    def forward(self, x, x_len):
+        if hasattr(self, 'in_proj'):
+            x = self.in_proj(x)
+        pad_mask = make_pad_mask(x_len.to(x.device), x.shape[1])
+        ffn_scale = 0.5 if self.macaron else 1.0
+        if self.macaron:
+            x = x + ffn_scale*self.ffn_in(x)
+        x = x + self.att_drop(self.att(self.att_norm(x), pad_mask))
+        if hasattr(self, 'conv'):
+            x = x + self.conv(x, pad_mask)
+        x = x + ffn_scale*self.ffn_out(x)
+        x = self.out_norm(x)
+
+        # Perform Downsampling
+        if self.sample_rate > 1:
+            x,x_len = time_downsample(x, x_len, self.sample_rate, self.sample_style)
+            # Keep at least 1 frame to attend to
+            x_len = x_len.clamp(min=1)
+
+        if self.proj:
+            x = torch.tanh(self.pj(x))
+
+        return x,x_len
+
+
+def causal_mask(length, device, dtype=torch.float):
+    ''' LxL additive mask, future positions are set to -inf'''
+    return torch.full((length,length), float('-inf'), device=device, dtype=dtype).triu(1)
+
+
+class MultiHeadAttention(nn.Module):
+    ''' Multi-head attention w/ separated query and key/value inputs, used by Transformer decoder
+        Keys/values are projected by project_kv() so that they can be cached'''
+    def __init__(self, dim, num_head, dropout, kv_dim=None):
+        super(MultiHeadAttention, self).__init__()
+        assert dim % num_head == 0, 'Transformer dim should be divisible by num_head'
+        self.dim = dim
+        self.num_head = num_head
+        self.d_k = dim // num_head
+        self.dropout = dropout
+        self.proj_q = nn.Linear(dim, dim)
+        self.proj_kv = nn.Linear(kv_dim or dim, 2*dim)
+        self.out_proj = nn.Linear(dim, dim)
+
+    def project_kv(self, x):
+        ''' BxTxD -> key, value with shape BxNxTxD'''
+        bs,ts,_ = x.shape
+        k,v = self.proj_kv(x).view(bs,ts,2,self.num_head,self.d_k).permute(2,0,3,1,4)
+        return k,v
+
+    def forward(self, x, k, v, mask=None, need_weights=False):
+        ''' x: BxLxD query, mask: additive mask broadcastable to BxNxLxT
+            Returns output BxLxD and attention weights BxNxLxT (None if need_weights is False)'''
+        bs,ls,_ = x.shape
+        q = self.proj_q(x).view(bs,ls,self.num_head,self.d_k).transpose(1,2) # BxNxLxD
+        dropout = self.dropout if self.training else 0.0
+        attn = None
+        if need_weights or not hasattr(F, 'scaled_dot_product_attention'):
+            attn = torch.matmul(q, k.transpose(2,3)) / math.sqrt(self.d_k)
+            if mask is not None:
+                attn = attn + mask
+            attn = attn.softmax(dim=-1)
+            context = torch.matmul(F.dropout(attn, dropout, self.training), v)
+        else:
+            context = F.scaled_dot_product_attention(q, k, v, attn_mask=mask, dropout_p=dropout)
+        context = context.transpose(1,2).reshape(bs,ls,self.dim)
+        return self.out_proj(context), attn
+
+
+class TransformerDecoderLayer(nn.Module):
+    ''' Pre-LN Transformer decoder block (masked self-attention + cross-attention + feed forward)'''
+    def __init__(self, dim, enc_dim, num_head, ffn_dim, dropout):
+        super(TransformerDecoderLayer, self).__init__()
+        self.self_norm = nn.LayerNorm(dim)
+        self.self_att = MultiHeadAttention(dim, num_head, dropout)
+        self.cross_norm = nn.LayerNorm(dim)
+        self.cross_att = MultiHeadAttention(dim, num_head, dropout, kv_dim=enc_dim)
+        self.ffn = FeedForward(dim, ffn_dim, dropout, nn.ReLU)
+        self.dropout = nn.Dropout(dropout)
+
+    def forward(self, x, memory, memory_mask, cache=None, need_weights=False):
+        ''' x: BxLxD, memory: cross-attention key/value of encoder feature
+            cache: self-attention key/value of previous steps, causal mask is applied if not given
+            Returns output BxLxD, key/value of all steps (for caching) and cross-attention weights'''
+        h = self.self_norm(x)
+        k,v = self.self_att.project_kv(h)
+        if cache is None:
+            mask = causal_mask(x.shape[1], x.device, x.dtype)
+        else:
+            # Incremental decoding, all cached steps are visible
+            k,v = torch.cat([cache[0],k],dim=2), torch.cat([cache[1],v],dim=2)
+            mask = None
+        x = x + self.dropout(self.self_att(h, k, v, mask)[0])
+        context, attn = self.cross_att(self.cross_norm(x), memory[0], memory[1], memory_mask, need_weights)
+        x = x + self.dropout(context)
+        x = x + self.ffn(x)
+        return x, (k,v), attn
+
+
 class BaseAttention(nn.Module):
     ''' Base module for attentions '''
     def __init__(self, temperature, num_head):
@@ -0,0 +1,57 @@
+import numpy as np
+from itertools import chain
+
+
+class PackedSequences(object):
+    ''' Variable-length sequences (e.g. token ids) in one flat array w/ offsets, items are views.
+        There is no Python object per item, so data loader workers (forked) read the arrays w/o touching
+        reference counts, i.e. pages stay shared instead of being copied on write.
+        Slicing returns PackedSequences viewing the same flat array.'''
+    def __init__(self, sequences, dtype=np.int32):
+        self.offsets = self._offsets(sequences)
+        self.data = np.fromiter(chain.from_iterable(sequences), dtype=dtype, count=int(self.offsets[-1]))
+
+    def _offsets(self, sequences):
+        offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+        offsets[1:] = np.fromiter((len(s) for s in sequences), dtype=np.int64, count=len(sequences))
+        return np.cumsum(offsets, out=offsets)
+
+    @classmethod
+    def _view(cls, data, offsets):
+        packed = cls.__new__(cls)
+        packed.data, packed.offsets = data, offsets
+        return packed
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            assert step == 1, "Only contiguous slices are views"
+            return self._view(self.data, self.offsets[start:max(start, stop) + 1])
+        if index < 0:
+            index += len(self)
+        return self.data[self.offsets[index]:self.offsets[index + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes
+
+
+class PackedStrings(PackedSequences):
+    ''' Strings (e.g. audio paths) packed as UTF-8 bytes w/ offsets, items are decoded on access'''
+    def __init__(self, strings):
+        encoded = [str(s).encode('UTF-8') for s in strings]
+        self.offsets = self._offsets(encoded)
+        self.data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+    def __getitem__(self, index):
+        item = super(PackedStrings, self).__getitem__(index)
+        return item if isinstance(index, slice) else item.tobytes().decode('UTF-8')
@@ -0,0 +1,107 @@
+import os
+import json
+import numpy as np
+import torch
+from os.path import join, exists, getsize
+from joblib import Parallel, delayed
+
+from src.feature_store import utt_id
+
+PCM_VERSION = 1
+INDEX_FILE = 'index.json'
+BLOB_FILE = 'pcm.bin'
+PCM_SCALE = 32768.0
+
+
+def to_pcm(waveform):
+    ''' 1 x L float waveform (first channel) -> int16 array'''
+    return np.clip(np.round(waveform[0].numpy() * PCM_SCALE), -PCM_SCALE, PCM_SCALE - 1).astype(np.int16)
+
+
+def append_pcm(pcm_dir, waveforms):
+    ''' Append int16 waveforms to the blob, returns (sample offset, num. of samples) of each'''
+    blob = join(pcm_dir, BLOB_FILE)
+    offset = getsize(blob) // 2 if exists(blob) else 0
+    index = []
+    with open(blob, 'ab') as fp:
+        for w in waveforms:
+            fp.write(w.astype('<i2', copy=False).tobytes())
+            index.append((offset, len(w)))
+            offset += len(w)
+    return index
+
+
+def write_index(pcm_dir, utts, sample_rate):
+    ''' utts - {utterance id: (sample offset, num. of samples)}'''
+    index = {'version': PCM_VERSION, 'sample_rate': sample_rate, 'utts': utts}
+    tmp_file = join(pcm_dir, INDEX_FILE + '.tmp')
+    with open(tmp_file, 'w') as fp:
+        json.dump(index, fp)
+    os.replace(tmp_file, join(pcm_dir, INDEX_FILE))
+
+
+class PCMCache(object):
+    ''' Read-only decoded audio, a single int16 blob (resampled to the target rate) memory-mapped on first
+        access (per process, so that it works with forked dataloader workers) w/ offset index'''
+    def __init__(self, pcm_dir, sample_rate=None):
+        with open(join(pcm_dir, INDEX_FILE), 'r') as fp:
+            index = json.load(fp)
+        assert index['version'] == PCM_VERSION, "PCM cache @ {} is outdated".format(pcm_dir)
+        if sample_rate is not None and index['sample_rate'] != sample_rate:
+            raise ValueError('Audio @ {} is cached at {} Hz, but {} Hz is required, please re-create.'
+                             .format(pcm_dir, index['sample_rate'], sample_rate))
+        self.pcm_dir = pcm_dir
+        self.sample_rate = index['sample_rate']
+        self.utts = index['utts']
+        self.blob = None
+
+    def __contains__(self, utt):
+        return utt in self.utts
+
+    def __len__(self):
+        return len(self.utts)
+
+    def __getitem__(self, utt):
+        ''' Zero-copy view (int16) of cached waveform'''
+        offset, length = self.utts[utt]
+        if self.blob is None:
+            self.blob = np.memmap(join(self.pcm_dir, BLOB_FILE), dtype='<i2', mode='r')
+        return self.blob[offset:offset+length]
+
+    def load(self, filepath):
+        ''' Cached waveform of audio file as float tensor (1 x L)'''
+        return torch.from_numpy(self[utt_id(filepath)].astype(np.float32)).div_(PCM_SCALE).unsqueeze(0)
+
+    def __getstate__(self):
+        # Memory map is not pickled to data loader workers
+        state = self.__dict__.copy()
+        state['blob'] = None
+        return state
+
+
+def load_audio(file_list, n_jobs=16):
+    ''' Waveforms of dataset (`read_audio: True`) at SAMPLE_RATE, features are extracted at the same rate'''
+    from src.audio import ReadAudio, SAMPLE_RATE
+    return SharedPCM([str(f) for f in file_list], ReadAudio(SAMPLE_RATE), n_jobs)
+
+
+class SharedPCM(object):
+    ''' Waveforms of audio files (int16) in one contiguous shared-memory buffer w/ offsets array, data loader
+        workers view slices w/o copying (no per-utterance objects to touch, so no copy-on-write after fork).
+        read_audio - ReadAudio of target sample rate, files are decoded in parallel (threads)'''
+    def __init__(self, file_list, read_audio, n_jobs=16):
+        waveforms = Parallel(n_jobs=max(1, n_jobs), prefer='threads')(
+            delayed(lambda f: to_pcm(read_audio(f)))(f) for f in file_list)
+        self.offsets = np.cumsum([0] + [len(w) for w in waveforms])
+        self.buffer = torch.empty(int(self.offsets[-1]), dtype=torch.int16).share_memory_()
+        for i in range(len(waveforms)):
+            self.buffer[self.offsets[i]:self.offsets[i+1]] = torch.from_numpy(waveforms[i])
+            waveforms[i] = None
+        self.sample_rate = read_audio.desired_sr
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        ''' Zero-copy view (1 x L, int16) of waveform'''
+        return self.buffer[self.offsets[index]:self.offsets[index+1]].unsqueeze(0)
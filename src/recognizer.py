@@ -0,0 +1,116 @@
+import time
+import yaml
+import torch
+import torch.nn as nn
+from torch.nn.utils.rnn import pad_sequence
+
+from src.asr import ASR
+from src.decode import BeamDecoder
+from src.text import load_text_encoder
+from src.audio import create_transform, read_audio_bytes, SAMPLE_RATE
+from src.util import autocast
+
+
+class Recognizer():
+    ''' Feature extraction + Encoder + greedy/CTC/beam decoding for online inference.
+        config should be identical to the one used for testing (see config/dlhlp_test.yaml)
+        amp enables mixed precision inference (bf16 on CPU, fp16 on GPU)'''
+    def __init__(self, config, decode_mode=None, device='cpu', amp=False):
+        src_config = yaml.load(open(config['src']['config'], 'r'), Loader=yaml.FullLoader)
+        self.device = torch.device(device)
+        self.amp = amp
+        self.decode_config = config['decode']
+        self.max_len_ratio = self.decode_config['max_len_ratio']
+
+        # Text & audio, augmentation is never applied at inference
+        self.tokenizer = load_text_encoder(**src_config['data']['text'])
+        audio_config = src_config['data']['audio'].copy()
+        self.hop_length = int(audio_config['frame_shift'] / 1000 * SAMPLE_RATE)
+        audio_config['apply_audio_augment'] = [False, False, False, False]
+        audio_config['apply_spec_augment'] = False
+        audio_config.pop('feat_dir', None) # Precomputed features are not available for unseen audio
+        audio_config.pop('batch_feature', None)
+        for key in ['speed_perturb', 'gain_db', 'noise_bank', 'pcm_dir']:
+            audio_config.pop(key, None)
+        audio_transform, self.feat_dim = create_transform(audio_config)
+        self.audio_transform = nn.Sequential(*list(audio_transform)[1:]) # Waveform is given, skip ReadAudio
+
+        # Model
+        self.model = ASR(self.feat_dim, self.tokenizer.vocab_size, **src_config['model'])
+        ckpt = torch.load(config['src']['ckpt'], map_location='cpu')
+        self.model.load_state_dict(ckpt['model'])
+        self.model = self.model.to(self.device).eval()
+
+        # Decoding
+        if decode_mode is None:
+            if self.decode_config['beam_size'] > 1:
+                decode_mode = 'beam'
+            else:
+                decode_mode = 'greedy' if self.model.enable_att else 'ctc'
+        self.decode_mode = decode_mode
+        if decode_mode == 'beam':
+            self.beam_decoder = BeamDecoder(self.model, None, **self.decode_config).to(self.device)
+            self.beam_decoder.eval()
+        elif decode_mode == 'ctc':
+            assert self.model.enable_ctc, 'ASR was not trained with CTC decoder'
+        elif decode_mode == 'greedy':
+            assert self.model.enable_att, 'ASR was not trained with attention decoder'
+        else:
+            raise NotImplementedError(decode_mode)
+
+    def create_msg(self):
+        return ['Server spec| Decode mode = {}\t| Device = {}\t| Feature Dim = {}\t| AMP = {}'.format(
+            self.decode_mode, self.device, self.feat_dim, self.amp)]
+
+    def featurize(self, data):
+        ''' Audio bytes -> T x D feature '''
+        return self.extract(read_audio_bytes(data))
+
+    def extract(self, waveform):
+        ''' 1 x T waveform -> T x D feature '''
+        with torch.no_grad():
+            return self.audio_transform(waveform)
+
+    def recognize(self, feats):
+        ''' Decode a batch of features, returns list of transcripts and timing of each stage '''
+        feat_len = torch.LongTensor([len(f) for f in feats])
+        feat = pad_sequence(feats, batch_first=True).to(self.device)
+        with torch.no_grad(), autocast(self.device, self.amp):
+            start = time.perf_counter()
+            encode_feature, encode_len = self.model.encoder(feat, feat_len.to(self.device))
+            if self.device.type == 'cuda':
+                torch.cuda.synchronize(self.device)
+            encode_time = time.perf_counter()
+
+            if self.decode_mode == 'ctc':
+                hyps = self.model.ctc_layer(encode_feature).argmax(dim=-1).cpu()
+                hyps = [h[:l].tolist() for h, l in zip(hyps, encode_len.cpu())]
+            elif self.decode_mode == 'greedy':
+                decode_step = int(float(feat_len.max()) * self.max_len_ratio)
+                att_output, _, _ = self.model.decode(encode_feature, encode_len, decode_step)
+                hyps = att_output.argmax(dim=-1).cpu().tolist()
+            else:
+                hyps = []
+                for j in range(len(feats)):
+                    l = int(encode_len[j])
+                    hyp = self.beam_decoder.search(encode_feature[j:j+1, :l], encode_len[j:j+1], feat_len[j:j+1])
+                    hyps.append(hyp[0].outIndex)
+            decode_time = time.perf_counter()
+
+        texts = [self.tokenizer.decode(h, ignore_repeat=self.decode_mode == 'ctc') for h in hyps]
+        return texts, {'encoder': encode_time - start, 'decoder': decode_time - encode_time}
+
+    def blank_prob(self, feats):
+        ''' Posterior of CTC blank for each encoder frame, returns list of 1-D arrays'''
+        assert self.model.enable_ctc, 'ASR was not trained with CTC decoder'
+        feat_len = torch.LongTensor([len(f) for f in feats])
+        feat = pad_sequence(feats, batch_first=True).to(self.device)
+        with torch.no_grad(), autocast(self.device, self.amp):
+            encode_feature, encode_len = self.model.encoder(feat, feat_len.to(self.device))
+            prob = self.model.ctc_layer(encode_feature).float().softmax(dim=-1)[:, :, 0].cpu().numpy()
+        return [p[:l] for p, l in zip(prob, encode_len.cpu().tolist())]
+
+    @property
+    def encoder_hop(self):
+        ''' Number of samples per encoder frame '''
+        return self.hop_length * self.model.encoder.sample_rate
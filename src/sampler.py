@@ -0,0 +1,109 @@
+import torch
+from torch.utils.data import Sampler
+
+
+class BucketBatchSampler(Sampler):
+    ''' Partition length-sorted dataset into disjoint buckets of batch_size and shuffle bucket order every epoch,
+        so each utterance is visited once per epoch (last bucket may be smaller). With band > 1, utterances are
+        shuffled within bands of band x batch_size (similar length) before partitioning, buckets vary between epochs.
+        Each bucket is returned in dataset order (the longest first).
+        For distributed training, processes take adjacent buckets at each step, so every process gets utterances
+        of similar length (and similar step time).'''
+    def __init__(self, n, batch_size, band=1, seed=0, num_replicas=1, rank=0):
+        self.n = n
+        self.batch_size = batch_size
+        self.band = max(1, band)
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+
+    def __iter__(self):
+        # Same permutation on all processes
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        index = torch.arange(self.n)
+        if self.band > 1:
+            width = self.band * self.batch_size
+            index = torch.cat([b[torch.randperm(len(b), generator=g)] for b in index.split(width)])
+        buckets = [b.sort()[0].tolist() for b in index.split(self.batch_size)]
+        # Step i takes buckets [i x num_replicas, (i+1) x num_replicas)
+        order = torch.randperm(len(self), generator=g).tolist()
+        return iter([buckets[i * self.num_replicas + self.rank] for i in order])
+
+    def __len__(self):
+        return (self.n + self.batch_size - 1) // self.batch_size // self.num_replicas
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+
+class DistributedEvalSampler(Sampler):
+    ''' Split dataset over processes w/o padding (unlike DistributedSampler), for validation only
+        since processes may have different number of batches'''
+    def __init__(self, dataset, num_replicas, rank):
+        self.indices = list(range(rank, len(dataset), num_replicas))
+
+    def __iter__(self):
+        return iter(self.indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+
+class FrameBudgetBatchSampler(Sampler):
+    ''' Dynamic batching, pack length-sorted utterances into batches w/ padded frames (max len. x batch size)
+        <= max_frames so that memory per step is nearly constant (short utterances form large batches).
+        Utterance longer than max_frames forms a batch alone. Batches are packed once and their order is
+        shuffled every epoch (ascending length if shuffle=False, e.g. curriculum learning).
+        For distributed training, each process takes an equal number of batches from the same shuffled order.'''
+    def __init__(self, lengths, max_frames, shuffle=True, seed=0, num_replicas=1, rank=0):
+        self.lengths = lengths
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self.batches = pack_by_length(lengths, max_frames)
+
+    def __iter__(self):
+        if self.shuffle:
+            g = torch.Generator()
+            g.manual_seed(self.seed + self.epoch)
+            order = torch.randperm(len(self.batches), generator=g).tolist()
+        else:
+            order = list(range(len(self.batches)))[::-1]
+        order = order[:len(self) * self.num_replicas]
+        return iter([self.batches[i] for i in order[self.rank::self.num_replicas]])
+
+    def __len__(self):
+        return len(self.batches) // self.num_replicas
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def stats(self):
+        return padding_stats(self.batches, self.lengths)
+
+
+def pack_by_length(lengths, max_frames):
+    ''' Sort index by length (descending) and pack into batches w/ max len. x batch size <= max_frames'''
+    batches, batch, batch_max = [], [], 0
+    for idx in sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True):
+        if len(batch) > 0 and max(batch_max, lengths[idx]) * (len(batch) + 1) > max_frames:
+            batches.append(batch)
+            batch, batch_max = [], 0
+        batch.append(idx)
+        batch_max = max(batch_max, lengths[idx])
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+
+def padding_stats(batches, lengths):
+    ''' Number of batches, average batch size and ratio of padded frames'''
+    real = sum(lengths[i] for b in batches for i in b)
+    padded = sum(max(lengths[i] for i in b) * len(b) for b in batches)
+    return {'batches': len(batches),
+            'batch_size': sum(len(b) for b in batches) / max(1, len(batches)),
+            'padding': 1 - real / max(1, padded)}
@@ -0,0 +1,148 @@
+import numpy as np
+import torch
+
+from src.audio import SAMPLE_RATE
+
+VAD_FRAME_MS = 10           # Frame shift of energy based VAD
+ENERGY_FLOOR_DB = -100.0    # Floor of frame energy (digital silence)
+MIN_CHUNK_SAMPLES = 1600    # Shortest audio (0.1 sec) sent to the model by CTC based VAD
+
+
+def frame_energy(waveform, frame_samples):
+    ''' Log energy (dB) of non-overlapping frames, waveform: 1 x T or T '''
+    waveform = waveform.reshape(-1)
+    n_frame = waveform.shape[0] // frame_samples
+    frames = waveform[:n_frame * frame_samples].view(n_frame, frame_samples)
+    energy = frames.pow(2).mean(dim=-1).clamp(min=10 ** (ENERGY_FLOOR_DB / 10))
+    return (10 * torch.log10(energy)).numpy()
+
+
+def find_segments(score, threshold, max_frames, min_silence_frames=30, min_speech_frames=10, pad_frames=5):
+    '''
+    Group frames with score >= threshold into speech segments
+        score              - [T] activity of each frame (higher means more likely to be speech)
+        max_frames         - segments longer than this are split at the least active frame
+        min_silence_frames - pauses shorter than this do not end a segment
+        min_speech_frames  - segments shorter than this are dropped
+        pad_frames         - frames added to both ends of each segment
+    Returns list of (start, end) frame index, end exclusive
+    '''
+    if max_frames < 1:
+        raise ValueError("max_frames must be positive, got {}".format(max_frames))
+    active = np.concatenate([[False], score >= threshold, [False]])
+    edges = np.flatnonzero(active[1:] != active[:-1])
+    regions = [[int(s), int(e)] for s, e in zip(edges[::2], edges[1::2])]
+
+    # Merge regions separated by short pauses
+    merged = []
+    for s, e in regions:
+        if len(merged) > 0 and s - merged[-1][1] < min_silence_frames:
+            merged[-1][1] = e
+        else:
+            merged.append([s, e])
+
+    segments = []
+    for s, e in merged:
+        if e - s < min_speech_frames:
+            continue
+        s, e = max(0, s - pad_frames), min(len(score), e + pad_frames)
+        # Split long segments at the least active frame of the later half
+        while e - s > max_frames:
+            lo = s + max_frames // 2
+            # At least one frame per split (lo == s for max_frames of 1)
+            cut = max(s + 1, lo + int(np.argmin(score[lo:s + max_frames])))
+            segments.append((s, cut))
+            s = cut
+        if len(segments) > 0 and segments[-1][1] == s and e - s < min_speech_frames:
+            # Short remainder of a split segment, split evenly w/ the previous one (merged one exceeds max_frames)
+            s = segments.pop()[0]
+            segments.append((s, (s + e) // 2))
+            s = (s + e) // 2
+        segments.append((s, e))
+    return segments
+
+
+def energy_vad(waveform, max_segment=20.0, threshold_db=-40.0, min_silence=0.3, min_speech=0.1,
+               pad=0.05, sample_rate=SAMPLE_RATE):
+    ''' Energy based VAD, threshold is relative to the loudest frame. Returns list of (start, end) in samples'''
+    frame_samples = int(VAD_FRAME_MS / 1000 * sample_rate)
+    energy = frame_energy(waveform, frame_samples)
+    if len(energy) == 0:
+        return []
+    to_frame = lambda sec: int(sec * 1000 / VAD_FRAME_MS)
+    segments = find_segments(energy, energy.max() + threshold_db, to_frame(max_segment),
+                             to_frame(min_silence), to_frame(min_speech), to_frame(pad))
+    total = waveform.shape[-1]
+    return [(s * frame_samples, min(e * frame_samples, total)) for s, e in segments]
+
+
+def ctc_vad(recognizer, waveform, max_segment=20.0, threshold=0.5, min_silence=0.3, min_speech=0.1,
+            pad=0.05, window=None, max_frames=20000):
+    ''' CTC blank based VAD, frames w/ blank posterior < threshold are considered speech.
+        The recording is encoded in non-overlapping windows (default = max_segment) to bound memory'''
+    window = int((window or max_segment) * SAMPLE_RATE)
+    hop = recognizer.encoder_hop
+    # Keep window aligned w/ encoder frames
+    window = max(hop, window // hop * hop)
+    total = waveform.shape[-1]
+    chunks = [(s, min(s + window, total)) for s in range(0, total, window)]
+    # Chunk too short for feature extraction is considered silence
+    blank = [(s, np.ones((e - s) // hop)) for s, e in chunks if e - s < MIN_CHUNK_SAMPLES]
+    chunks = [(s, e) for s, e in chunks if e - s >= MIN_CHUNK_SAMPLES]
+    for batch in pack_segments(chunks, max_frames * recognizer.hop_length):
+        feats = [recognizer.extract(waveform[:, s:e]) for s, e in batch]
+        probs = recognizer.blank_prob(feats)
+        for (s, e), p in zip(batch, probs):
+            # Pad w/ blank to full length of the chunk (encoder may drop trailing frames)
+            n_frame = (e - s) // hop
+            blank.append((s, np.pad(p[:n_frame], (0, max(0, n_frame - len(p))), constant_values=1.0)))
+    blank = np.concatenate([p for _, p in sorted(blank, key=lambda x: x[0])])
+    if len(blank) == 0:
+        return []
+    to_frame = lambda sec: int(sec * SAMPLE_RATE / hop)
+    segments = find_segments(1 - blank, 1 - threshold, max(1, to_frame(max_segment)),
+                             to_frame(min_silence), to_frame(min_speech), to_frame(pad))
+    return [(s * hop, min(e * hop, total)) for s, e in segments]
+
+
+def pack_segments(segments, max_samples):
+    ''' Sort segments by length and pack into batches w/ padded length (max len. x batch size) <= max_samples'''
+    batches, batch, batch_max = [], [], 0
+    for seg in sorted(segments, key=lambda x: x[1] - x[0], reverse=True):
+        seg_len = seg[1] - seg[0]
+        if len(batch) > 0 and max(batch_max, seg_len) * (len(batch) + 1) > max_samples:
+            batches.append(batch)
+            batch, batch_max = [], 0
+        batch.append(seg)
+        batch_max = max(batch_max, seg_len)
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+
+def transcribe_long(recognizer, waveform, vad='energy', max_segment=20.0, max_frames=20000, **vad_args):
+    '''
+    Segment a long recording, decode segments in batches and stitch results in time order
+        recognizer - src.recognizer.Recognizer
+        waveform   - 1 x T waveform at SAMPLE_RATE
+        max_frames - max. padded feature frames (max len. x batch size) per batch
+    Returns list of {'start': sec, 'end': sec, 'text': str} and the full transcript
+    '''
+    if vad == 'energy':
+        segments = energy_vad(waveform, max_segment=max_segment, **vad_args)
+    elif vad == 'ctc':
+        segments = ctc_vad(recognizer, waveform, max_segment=max_segment, max_frames=max_frames, **vad_args)
+    else:
+        raise NotImplementedError(vad)
+    segments = [(s, e) for s, e in segments if e - s >= MIN_CHUNK_SAMPLES]
+
+    results = []
+    # Features are extracted per batch so memory is bounded by max_frames
+    for batch in pack_segments(segments, max_frames * recognizer.hop_length):
+        feats = [recognizer.extract(waveform[:, s:e]) for s, e in batch]
+        texts, _ = recognizer.recognize(feats)
+        for (s, e), text in zip(batch, texts):
+            results.append({'start': s / SAMPLE_RATE, 'end': e / SAMPLE_RATE, 'text': text})
+    results.sort(key=lambda x: x['start'])
+    transcript = ' '.join(r['text'] for r in results if len(r['text']) > 0)
+    return results, transcript
@@ -0,0 +1,179 @@
+import time
+import json
+import asyncio
+import numpy as np
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+STAGES = ['feature', 'queue', 'encoder', 'decoder', 'total']
+STATS_WINDOW = 10000    # Number of recent requests kept for latency percentiles
+MAX_BODY_SIZE = 64 << 20 # 64MB
+HTTP_STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class LatencyStats():
+    ''' Latency of each stage (recent requests), batch size histogram and queue depth'''
+    def __init__(self, window=STATS_WINDOW):
+        self.latency = {s: deque(maxlen=window) for s in STAGES}
+        self.batch_size = Counter()
+        self.n_request = 0
+        self.n_error = 0
+        self.max_queue_depth = 0
+
+    def add_request(self, timing):
+        self.n_request += 1
+        for s, t in timing.items():
+            self.latency[s].append(t)
+
+    def add_batch(self, batch_size, queue_depth):
+        self.batch_size[batch_size] += 1
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+    def summary(self, queue_depth=0):
+        latency = {}
+        for s, v in self.latency.items():
+            if len(v) == 0:
+                continue
+            v = np.array(v) * 1000
+            latency[s] = {'p50': float(np.percentile(v, 50)), 'p95': float(np.percentile(v, 95)),
+                          'p99': float(np.percentile(v, 99)), 'mean': float(v.mean())}
+        return {'requests': self.n_request,
+                'errors': self.n_error,
+                'queue_depth': queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'batch_size_histogram': {str(k): v for k, v in sorted(self.batch_size.items())},
+                'latency_ms': latency}
+
+
+class BatchScheduler():
+    ''' Collect queued requests into dynamic batches.
+        A batch is closed when padded frames (max len. x batch size) would exceed max_frames,
+        when max_batch is reached or when the first request has waited for max_wait seconds.'''
+    def __init__(self, recognizer, stats, max_frames=20000, max_batch=32, max_wait=0.05):
+        self.recognizer = recognizer
+        self.stats = stats
+        self.max_frames = max_frames
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        # Model is not thread-safe (decoder states are stored in modules), run batches one at a time
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+
+    async def submit(self, feat):
+        ''' Enqueue a T x D feature and wait for (transcript, timing)'''
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((feat, future, time.perf_counter()))
+        return await future
+
+    async def next_batch(self):
+        first = self.pending if self.pending is not None else await self.queue.get()
+        self.pending = None
+        batch, max_len = [first], len(first[0])
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                if timeout > 0:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                else:
+                    # Deadline passed, only take requests that are already waiting
+                    item = self.queue.get_nowait()
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                break
+            if max(max_len, len(item[0])) * (len(batch) + 1) > self.max_frames:
+                self.pending = item
+                break
+            batch.append(item)
+            max_len = max(max_len, len(item[0]))
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = await self.next_batch()
+            start = time.perf_counter()
+            self.stats.add_batch(len(batch), self.queue.qsize() + len(batch))
+            try:
+                texts, timing = await loop.run_in_executor(
+                    self.executor, self.recognizer.recognize, [b[0] for b in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for text, (_, future, enqueue_time) in zip(texts, batch):
+                if not future.done():
+                    future.set_result((text, dict(timing, queue=start - enqueue_time)))
+
+
+class ASRServer():
+    ''' Minimal HTTP/1.1 server on asyncio
+        POST /recognize  (body = audio file) -> {"text": ..., "latency_ms": {...}}
+        GET  /metrics                        -> queue depth, batch size histogram, latency percentiles
+        GET  /health                         -> {"status": "ok"}'''
+    def __init__(self, recognizer, max_frames=20000, max_batch=32, max_wait=0.05, n_jobs=4):
+        self.recognizer = recognizer
+        self.stats = LatencyStats()
+        self.scheduler = BatchScheduler(recognizer, self.stats, max_frames, max_batch, max_wait)
+        self.feat_executor = ThreadPoolExecutor(max_workers=n_jobs)
+
+    async def recognize(self, body):
+        loop = asyncio.get_event_loop()
+        start = time.perf_counter()
+        feat = await loop.run_in_executor(self.feat_executor, self.recognizer.featurize, body)
+        feat_time = time.perf_counter() - start
+        text, timing = await self.scheduler.submit(feat)
+        timing['feature'] = feat_time
+        timing['total'] = time.perf_counter() - start
+        self.stats.add_request(timing)
+        return {'text': text, 'latency_ms': {k: v * 1000 for k, v in timing.items()}}
+
+    async def route(self, method, path, body):
+        if method == 'POST' and path == '/recognize':
+            if len(body) == 0:
+                return 400, {'error': 'Empty audio.'}
+            return 200, await self.recognize(body)
+        elif method == 'GET' and path == '/metrics':
+            return 200, self.stats.summary(self.scheduler.queue.qsize())
+        elif method == 'GET' and path == '/health':
+            return 200, {'status': 'ok'}
+        return 404, {'error': 'Not found.'}
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            method, path, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, value = line.decode('latin-1').split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY_SIZE:
+                status, payload = 413, {'error': 'Request body too large.'}
+            else:
+                body = await reader.readexactly(length) if length > 0 else b''
+                status, payload = await self.route(method, path.split('?')[0], body)
+        except (ValueError, RuntimeError, asyncio.IncompleteReadError) as e:
+            self.stats.n_error += 1
+            status, payload = 400, {'error': str(e)}
+        except Exception as e:
+            self.stats.n_error += 1
+            status, payload = 500, {'error': str(e)}
+
+        data = json.dumps(payload).encode('utf-8')
+        writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: close\r\n\r\n'
+                     .format(status, HTTP_STATUS.get(status, ''), len(data)).encode('latin-1') + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        asyncio.ensure_future(self.scheduler.run())
+        async with server:
+            await server.serve_forever()
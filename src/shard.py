@@ -0,0 +1,215 @@
+import io
+import os
+import json
+import random
+import tarfile
+import wave
+import numpy as np
+import torch.distributed as dist
+from os.path import join
+from torch.utils.data import IterableDataset, get_worker_info
+
+from src.audio import read_audio_bytes, read_segment, SEGMENT_SEP
+from src.pcm_cache import to_pcm
+from src.feature_store import quantize, dequantize, extract_config, utt_id
+
+SHARD_VERSION = 1
+INDEX_FILE = 'index.json'
+SHARD_KINDS = ['audio', 'feature']
+
+
+def split_name(split):
+    ''' Directory of shards of a list of corpus splits'''
+    return '+'.join(split)
+
+
+class ShardWriter(object):
+    ''' Pack utterances into sequential tar shards of `shard_size` utterances,
+            <shard_dir>/<split>/shard-%05d.tar, members <utt>.<audio ext. or npy> & <utt>.json (token ids)
+        kind  - 'audio' (encoded audio file as is) or 'feature' (T x D feature, quantized to dtype)'''
+    def __init__(self, shard_dir, split, kind, shard_size=1000, dtype='fp16'):
+        assert kind in SHARD_KINDS
+        self.shard_dir = shard_dir
+        self.split = split_name(split)
+        self.kind = kind
+        self.shard_size = shard_size
+        self.dtype = dtype
+        self.shards, self.utts = [], []
+        self.tar = None
+        os.makedirs(join(shard_dir, self.split), exist_ok=True)
+
+    def write(self, filepath, tokens, feat=None):
+        if self.tar is None or self.utts[-1] == self.shard_size:
+            self._next()
+        name = utt_id(filepath)
+        if self.kind == 'audio' and SEGMENT_SEP in str(filepath):
+            # Only the segment of long recording is archived (16-bit PCM wav)
+            self._add(name + '.wav', _wav_bytes(*read_segment(str(filepath))))
+        elif self.kind == 'audio':
+            self.tar.add(str(filepath), arcname=name + '.' + str(filepath).split('.')[-1])
+        else:
+            buffer = io.BytesIO()
+            np.save(buffer, quantize(feat, self.dtype))
+            self._add(name + '.npy', buffer.getvalue())
+        self._add(name + '.json', json.dumps({'tokens': tokens}).encode())
+        self.utts[-1] += 1
+
+    def close(self):
+        if self.tar is not None:
+            self.tar.close()
+            self.tar = None
+        return {'shards': self.shards, 'utts': self.utts}
+
+    def _next(self):
+        self.close()
+        self.shards.append(join(self.split, 'shard-{:05d}.tar'.format(len(self.shards))))
+        self.utts.append(0)
+        self.tar = tarfile.open(join(self.shard_dir, self.shards[-1]), 'w')
+
+    def _add(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self.tar.addfile(info, io.BytesIO(data))
+
+
+def _wav_bytes(waveform, sample_rate):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as fp:
+        fp.setnchannels(1)
+        fp.setsampwidth(2)
+        fp.setframerate(sample_rate)
+        fp.writeframes(to_pcm(waveform).astype('<i2').tobytes())
+    return buffer.getvalue()
+
+
+def write_index(shard_dir, kind, splits, tokenizer, audio_config=None, dtype='fp16'):
+    ''' splits - {split name: ShardWriter.close()}, merged w/ splits of existing index'''
+    index = read_index(shard_dir) if os.path.exists(join(shard_dir, INDEX_FILE)) else \
+            {'version': SHARD_VERSION, 'kind': kind, 'tokenizer': tokenizer.fingerprint, 'splits': {}}
+    assert index['kind'] == kind and index['tokenizer'] == tokenizer.fingerprint, \
+        "Existing shards @ {} are {} w/ different tokenizer".format(shard_dir, index['kind'])
+    if kind == 'feature':
+        index.update(dtype=dtype, audio=extract_config(audio_config))
+    index['splits'].update(splits)
+    with open(join(shard_dir, INDEX_FILE), 'w') as fp:
+        json.dump(index, fp)
+
+
+def read_index(shard_dir):
+    with open(join(shard_dir, INDEX_FILE), 'r') as fp:
+        index = json.load(fp)
+    assert index['version'] == SHARD_VERSION, "Shards @ {} are outdated".format(shard_dir)
+    return index
+
+
+class ShardDataset(IterableDataset):
+    ''' Streaming reader of shards (see ShardWriter), each shard is read sequentially.
+        Yields (waveform (1 x L) or feature (1 x MEL x T), token ids), same as items of corpus datasets
+        w/ audio already read.
+        Shards are split over processes (torch.distributed) and data loader workers, w/ shuffle
+            - shard order is shuffled every epoch (set_epoch, same order for all processes)
+            - utterances are shuffled w/ a buffer of `buffer_size`
+            - each process yields the same number of utterances (same number of steps for DDP)
+        num_workers - data loader workers reading the dataset (for the length of shuffled shards over processes)'''
+    def __init__(self, shard_dir, split, tokenizer, shuffle=False, buffer_size=1000, seed=0, num_workers=1):
+        index = read_index(shard_dir)
+        if index['tokenizer'] != tokenizer.fingerprint:
+            raise ValueError('Shards @ {} were created w/ another tokenizer, please re-create.'.format(shard_dir))
+        self.shard_dir = shard_dir
+        self.kind = index['kind']
+        self.dtype = index.get('dtype')
+        if split_name(split) not in index['splits']:
+            raise ValueError('Split {} is not found in shards @ {}, available: {}'
+                             .format(split, shard_dir, list(index['splits'])))
+        self.split = split_name(split)
+        self.shards = index['splits'][self.split]['shards']
+        self.utts = index['splits'][self.split]['utts']
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.num_workers = max(1, num_workers)
+        self.epoch = 0
+        self._check(self._replicas()[0], self.num_workers)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        # Utterances of this process in current epoch
+        num_replicas, rank = self._replicas()
+        order = self._order()
+        if self.shuffle and num_replicas > 1:
+            return sum(self._quota(order, num_replicas, w, self.num_workers) for w in range(self.num_workers))
+        return sum(self.utts[i] for i in order[rank::num_replicas])
+
+    def __iter__(self):
+        num_replicas, rank = self._replicas()
+        worker = get_worker_info()
+        num_workers, worker_id = (1, 0) if worker is None else (worker.num_workers, worker.id)
+        self._check(num_replicas, num_workers)
+        order = self._order()
+        quota = self._quota(order, num_replicas, worker_id, num_workers) \
+                if self.shuffle and num_replicas > 1 else None
+        items = self._read([self.shards[i] for i in order[rank::num_replicas][worker_id::num_workers]])
+        if self.shuffle:
+            rng = random.Random('{}-{}-{}-{}'.format(self.seed, self.epoch, rank, worker_id))
+            items = self._buffer_shuffle(items, rng)
+        for n, item in enumerate(items):
+            if quota is not None and n == quota:
+                break
+            yield item
+
+    def _check(self, num_replicas, num_workers):
+        # Shuffled shards over processes are limited to the min. over processes, an idle worker drops its slot
+        if self.shuffle and num_replicas * num_workers > len(self.shards):
+            raise ValueError('Split {} has {} shards, fewer than processes x data loader workers ({} x {}), '
+                             'please re-create shards w/ smaller --shard_size.'
+                             .format(self.split, len(self.shards), num_replicas, num_workers))
+
+    def _order(self):
+        order = list(range(len(self.shards)))
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(order)
+        return order
+
+    def _quota(self, order, num_replicas, worker_id, num_workers):
+        # Utterances of a worker slot, the min. over processes (same number of steps for DDP)
+        return min(sum(self.utts[i] for i in order[r::num_replicas][worker_id::num_workers]) for r in range(num_replicas))
+
+    def _replicas(self):
+        if dist.is_available() and dist.is_initialized():
+            return dist.get_world_size(), dist.get_rank()
+        return 1, 0
+
+    def _read(self, shards):
+        for shard in shards:
+            data, tokens = None, None
+            # Stream mode (sequential read), members of an utterance are adjacent
+            with tarfile.open(join(self.shard_dir, shard), 'r|') as tar:
+                for member in tar:
+                    content = tar.extractfile(member).read()
+                    if member.name.endswith('.json'):
+                        tokens = json.loads(content)['tokens']
+                    else:
+                        data = self._decode(content)
+                    if data is not None and tokens is not None:
+                        yield data, tokens
+                        data, tokens = None, None
+
+    def _decode(self, content):
+        if self.kind == 'audio':
+            return read_audio_bytes(content)
+        feat = dequantize(np.load(io.BytesIO(content)), self.dtype)
+        return feat.t().unsqueeze(0) # 1 x MEL x T
+
+    def _buffer_shuffle(self, items, rng):
+        buffer = []
+        for item in items:
+            if len(buffer) < self.buffer_size:
+                buffer.append(item)
+                continue
+            i = rng.randrange(self.buffer_size)
+            yield buffer[i]
+            buffer[i] = item
+        rng.shuffle(buffer)
+        yield from buffer
@@ -2,12 +2,14 @@ import os
 import sys
 import abc
 import math
+import contextlib
 import yaml
 import torch
+import torch.distributed as dist
 from torch.utils.tensorboard import SummaryWriter
 
 from src.option import default_hparas
-from src.util import human_format, Timer
+from src.util import human_format, Timer, amp_dtype, autocast
 
 class BaseSolver():
     ''' 
@@ -23,8 +25,30 @@ class BaseSolver():
         self.mode = mode
         for k,v in default_hparas.items():
             setattr(self,k,v)
+
+        # Distributed training, launched by torchrun (one process per device/group of cores)
+        self.rank = int(os.environ.get('RANK', 0))
+        self.world_size = int(os.environ.get('WORLD_SIZE', 1))
+        self.distributed = self.world_size > 1 and mode == 'train'
+        if self.distributed:
+            dist.init_process_group(paras.dist_backend)
+            local_rank = int(os.environ.get('LOCAL_RANK', 0))
+            # Only rank 0 shows messages
+            self.paras.verbose = self.paras.verbose and self.rank == 0
+            if self.paras.gpu and torch.cuda.is_available():
+                self.paras.cuda = local_rank
+                torch.cuda.set_device(local_rank)
+            else:
+                # Split cores of each node over its processes
+                n_local = int(os.environ.get('LOCAL_WORLD_SIZE', 1))
+                torch.set_num_threads(max(1, os.cpu_count() // n_local))
+        else:
+            self.rank, self.world_size = 0, 1
+        self.ddp_modules = []
         self.device = torch.device('cuda:' + str(paras.cuda)) if self.paras.gpu and torch.cuda.is_available() else torch.device('cpu')
         self.amp = paras.amp
+        self.amp_dtype = paras.amp_dtype
+        self.scaler = None
 
         # Name experiment
         self.exp_name = paras.name
@@ -59,9 +83,9 @@ class BaseSolver():
             self.ckpdir = os.path.join(paras.ckpdir,self.exp_name)
             os.makedirs(self.ckpdir, exist_ok=True)
 
-            # Logger settings
+            # Logger settings (rank 0 only)
             self.logdir = os.path.join(paras.logdir,self.exp_name + (log_name if self.transfer_learning else ''))
-            self.log = SummaryWriter(self.logdir, flush_secs = self.TB_FLUSH_FREQ)
+            self.log = SummaryWriter(self.logdir, flush_secs = self.TB_FLUSH_FREQ) if self.rank == 0 else None
             self.timer = Timer()
 
             # Hyperparameters
@@ -89,17 +113,31 @@ class BaseSolver():
         '''
         Standard backward step with self.timer and debugger
         Arguments
-            loss - the loss to perform loss.backward()
+            loss     - the loss to perform loss.backward()
+            optimize - update model, otherwise gradients are accumulated to the next call (grad. norm is None)
+        For distributed training, gradients are averaged over processes during loss.backward() (see wrap_ddp),
+        so grad. norm, NaN check and clipping are identical on all processes.
         '''
         if time_cnt:
             self.timer.set()
-        loss.backward()
-        grad_norm = torch.nn.utils.clip_grad_norm_(self.model.parameters(), self.GRAD_CLIP)
-
-        if math.isnan(grad_norm):
-            self.verbose('Error : grad norm is NaN @ step '+str(self.step))
+        if self.scaler is not None:
+            self.scaler.scale(loss).backward()
         else:
-            if optimize:
+            loss.backward()
+
+        grad_norm = None
+        if optimize:
+            if self.scaler is not None:
+                # Gradients are unscaled before clipping
+                self.scaler.unscale_(self.optimizer.opt)
+            grad_norm = torch.nn.utils.clip_grad_norm_(self.model.parameters(), self.GRAD_CLIP)
+            if self.scaler is not None:
+                # Steps w/ inf/NaN grad. are skipped by scaler and loss scale is reduced
+                self.scaler.step(self.optimizer.opt)
+                self.scaler.update()
+            elif math.isnan(grad_norm):
+                self.verbose('Error : grad norm is NaN @ step '+str(self.step))
+            else:
                 self.optimizer.step()
         if time_cnt:
             self.timer.cnt('bw')
@@ -113,8 +151,8 @@ class BaseSolver():
             self.model.load_state_dict(ckpt['model'])
             if self.emb_decoder is not None:
                 self.emb_decoder.load_state_dict(ckpt['emb_decoder'])
-            #if self.amp:
-            #    amp.load_state_dict(ckpt['amp'])
+            if self.scaler is not None and 'scaler' in ckpt:
+                self.scaler.load_state_dict(ckpt['scaler'])
             # Load task-dependent items
             if self.mode == 'train':
                 self.step = ckpt['global_step']
@@ -151,6 +189,8 @@ class BaseSolver():
             log_name  - <str> Name of tensorboard variable 
             log_value - <dict>/<array> Value of variable (e.g. dict of losses), passed if value = None
         '''
+        if self.log is None:
+            return
         if type(log_dict) is dict:
             log_dict = {key:val for key, val in log_dict.items() if (val is not None and not math.isnan(val))}
         if log_dict is None:
@@ -176,6 +216,8 @@ class BaseSolver():
             f_name - <str> the name phnof ckpt file (w/o prefix) to store, overwrite if existed
             score  - <float> The value of metric used to evaluate model
         '''
+        if self.rank != 0:
+            return
         ckpt_path = os.path.join(self.ckpdir, f_name)
         full_dict = {
             "model": self.model.state_dict(),
@@ -184,8 +226,8 @@ class BaseSolver():
             metric: score
         }
         # Additional modules to save
-        #if self.amp:
-        #    full_dict['amp'] = self.amp_lib.state_dict()
+        if self.scaler is not None:
+            full_dict['scaler'] = self.scaler.state_dict()
         if self.emb_decoder is not None:
             full_dict['emb_decoder'] = self.emb_decoder.state_dict()
 
@@ -196,13 +238,50 @@ class BaseSolver():
         self.verbose("Saved ckpt (step = {}, {} = {:.2f}) @ {}{}".\
                                        format(human_format(self.step),metric,score,ckpt_path,name))
 
-    def enable_apex(self):
+    def enable_amp(self):
+        ''' Enable native mixed precision, loss scaling is only required for fp16'''
         if self.amp:
-            # Enable mixed precision computation (ToDo: Save/Load amp)
-            from apex import amp
-            self.amp_lib = amp
-            self.verbose("AMP enabled (check https://github.com/NVIDIA/apex for more details).")
-            self.model, self.optimizer.opt = self.amp_lib.initialize(self.model, self.optimizer.opt, opt_level='O1')
+            dtype = amp_dtype(self.device, self.amp_dtype)
+            if dtype == torch.float16:
+                if hasattr(torch.amp, 'GradScaler'):
+                    self.scaler = torch.amp.GradScaler(self.device.type)
+                else:
+                    self.scaler = torch.cuda.amp.GradScaler()
+            self.verbose('AMP enabled (autocast to {} on {}, loss scaling = {}).'.format(
+                str(dtype).replace('torch.',''), self.device.type, self.scaler is not None))
+
+    def autocast(self):
+        ''' Context for forward pass, mixed precision if AMP is enabled'''
+        return autocast(self.device, self.amp, self.amp_dtype)
+
+    def wrap_ddp(self, module, find_unused_parameters=False):
+        '''
+        Wrap module w/ DistributedDataParallel for forward pass in training (returns module itself if not distributed).
+        Parameters requiring grad. must receive grad. in each step (call after fixing layers), unless
+        find_unused_parameters is set (only for modules w/ all grads. coming from the output of its forward pass)
+        '''
+        if not self.distributed:
+            return module
+        device_ids = [self.device.index] if self.device.type == 'cuda' else None
+        module = torch.nn.parallel.DistributedDataParallel(module, device_ids=device_ids,
+                                                           find_unused_parameters=find_unused_parameters)
+        self.ddp_modules.append(module)
+        return module
+
+    def no_sync(self, skip_sync=True):
+        ''' Context to accumulate gradients locally w/o averaging over processes (forward pass must be inside)'''
+        context = contextlib.ExitStack()
+        if skip_sync:
+            for module in self.ddp_modules:
+                context.enter_context(module.no_sync())
+        return context
+
+    def average(self, values):
+        ''' Average list of values (e.g. error rate of each batch) collected by all processes'''
+        total = torch.tensor([float(sum(values)), float(len(values))], dtype=torch.float64, device=self.device)
+        if self.distributed:
+            dist.all_reduce(total)
+        return (total[0] / total[1]).item()
 
 
     # ----------------------------------- Abtract Methods ------------------------------------------ #
@@ -3,6 +3,7 @@
 Reference: https://www.tensorflow.org/datasets/api_docs/python/tfds/features/text_lib
 """
 import abc
+import hashlib
 
 BERT_FIRST_IDX = 997  # Replacing the 2 tokens right before english starts as <eos> & <unk>
 BERT_LAST_IDX = 29635 # Drop rest of tokens
@@ -43,6 +44,15 @@ class _BaseTextEncoder(abc.ABC):
     def __repr__(self):
         return "<{} vocab_size={}>".format(type(self).__name__, self.vocab_size)
 
+    @property
+    def fingerprint(self):
+        # Hash of encoder type and vocabulary, changes whenever encoded ids may change
+        return hashlib.md5(type(self).__name__.encode() + self._vocab_bytes()).hexdigest()
+
+    @abc.abstractmethod
+    def _vocab_bytes(self):
+        raise NotImplementedError
+
 
 class CharacterTextEncoder(_BaseTextEncoder):
     def __init__(self, vocab_list):
@@ -84,6 +94,9 @@ class CharacterTextEncoder(_BaseTextEncoder):
     def token_type(self):
         return 'character'
 
+    def _vocab_bytes(self):
+        return '\n'.join(self._vocab_list).encode()
+
     def vocab_to_idx(self, vocab):
         return self._vocab2idx.get(vocab, self.unk_idx)
 
@@ -129,6 +142,9 @@ class SubwordTextEncoder(_BaseTextEncoder):
     def token_type(self):
         return 'subword'
 
+    def _vocab_bytes(self):
+        return self.spm.serialized_model_proto()
+
 
 class WordTextEncoder(CharacterTextEncoder):
     def encode(self, s):
@@ -200,6 +216,9 @@ class BertTextEncoder(_BaseTextEncoder):
     def token_type(self):
         return "bert"
 
+    def _vocab_bytes(self):
+        return '\n'.join(self._tokenizer.vocab).encode()
+
     @classmethod
     def load_from_file(cls, vocab_file):
         from pytorch_transformers import BertTokenizer
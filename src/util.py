@@ -1,6 +1,7 @@
 import math
 import time
 import torch
+import contextlib
 import numpy as np
 from torch import nn
 
@@ -71,7 +72,7 @@ def init_gate(bias):
 # Convert Tensor to Figure on tensorboard
 def feat_to_fig(feat, spec=False):
     # feat TxD tensor
-    data = _save_canvas(feat.numpy(), spec=spec)
+    data = _save_canvas(feat.float().numpy(), spec=spec)
     return torch.FloatTensor(data),"HWC"
 
 def _save_canvas(data, meta=None, spec=False):
@@ -152,5 +153,18 @@ def load_embedding(text_encoder, embedding_filepath):
 
         return embeddings
 
+def amp_dtype(device, dtype=None):
+    ''' Precision of mixed precision computation, fp16 on GPU and bf16 on CPU by default'''
+    if dtype is None:
+        dtype = 'fp16' if torch.device(device).type == 'cuda' else 'bf16'
+    return {'fp16': torch.float16, 'bf16': torch.bfloat16}[dtype]
+
+def autocast(device, enabled=True, dtype=None):
+    ''' Context of native mixed precision (torch.autocast), does nothing if disabled'''
+    if not enabled:
+        return contextlib.nullcontext()
+    assert hasattr(torch, 'autocast'), 'Mixed precision requires torch>=1.10'
+    return torch.autocast(torch.device(device).type, dtype=amp_dtype(device, dtype))
+
 def count_parameters(model):
     return sum(p.numel() for p in model.parameters() if p.requires_grad)
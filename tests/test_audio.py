@@ -1,3 +1,5 @@
+import os
+import tempfile
 import unittest
 import numpy as np
 import torch
@@ -101,3 +103,162 @@ class TestAudio(unittest.TestCase):
         y = transform(self.filepath)
 
         self.assertEqual(list(y.shape), [392, d])
+
+    def test_streaming(self):
+        audio_config = {
+            "feat_type": "fbank",
+            "feat_dim": 40,
+            "apply_cmvn": False,
+            "frame_length": 25,
+            "frame_shift": 10,
+            "ref_level_db": 20,
+            "min_level_db": -100,
+            "preemphasis_coeff": 0.97,
+            "delta_order": 2,
+            "delta_window_size": 2,
+        }
+        waveform = _load_wav(self.filepath)
+
+        transform, d = audio.create_transform(audio_config.copy())
+        # Skip ReadAudio
+        y = torch.nn.Sequential(*list(transform)[1:])(waveform)
+
+        streaming, d_stream = audio.create_streaming_transform(audio_config.copy())
+        self.assertEqual(d, d_stream)
+        for chunk_size in [100, 160, 1600]:
+            chunks = [streaming(waveform[:, i:i+chunk_size])
+                      for i in range(0, waveform.shape[-1], chunk_size)]
+            y_stream = torch.cat(chunks + [streaming.flush()])
+            self.assertTrue(torch.equal(y, y_stream))
+
+    def test_mel_feature(self):
+        waveform = _load_wav(self.filepath)
+        for n_fft in [1025, 512]:
+            extractor = audio.ExtractAudioFeature("fbank", 40, 25, 10, 20, -100, 0.97, n_fft=n_fft)
+            # Reference: full spectrogram w/ torchaudio, dB & normalization as separated steps
+            specgram = extractor.to_specgram(extractor._preemphasis(waveform)).sqrt()
+            ref = extractor._normalize(extractor._amp_to_db(extractor.to_melspecgram(specgram)) - 20)
+            y = extractor(waveform)
+            self.assertEqual(y.shape, ref.shape)
+            self.assertTrue(torch.allclose(y, ref, atol=1e-5))
+        # Scripted
+        self.assertIsInstance(extractor.feature, torch.jit.ScriptModule)
+        with self.assertRaises(AssertionError):
+            audio.ExtractAudioFeature("fbank", 40, 25, 10, 20, -100, 0.97, n_fft=256)
+
+    def test_speed_augment(self):
+        # 1 sec. of 400 Hz sine wave
+        waveform = torch.sin(2 * np.pi * 400 * torch.arange(16000) / 16000).unsqueeze(0)
+        speed_augment = audio.SpeedAugment([0.9, 1.0, 1.1])
+        self.assertTrue(torch.equal(speed_augment(waveform, 1.0), waveform))
+        for factor in [0.9, 1.1]:
+            # Duration / factor, frequency * factor
+            y = speed_augment(waveform, factor)
+            self.assertEqual(y.shape[-1], int(np.ceil(16000 / factor)))
+            peak = torch.fft.rfft(y[0]).abs().argmax().item() * 16000 / y.shape[-1]
+            self.assertAlmostEqual(peak, 400 * factor, delta=1)
+        self.assertIn(speed_augment(waveform).shape[-1], [14546, 16000, 17778])
+
+    def test_wave_augment(self):
+        waveforms = torch.randn(3, 8000)
+        wave_len = torch.LongTensor([8000, 6000, 3000])
+        waveforms[1, 6000:] = 0
+        waveforms[2, 3000:] = 0
+        # Shift & gain, drawn per utterance
+        y = audio.WaveAugment(shift=1000, gain_db=6.)(waveforms.clone(), wave_len, torch.Generator().manual_seed(0))
+        for x, x_aug, n in zip(waveforms, y, wave_len.tolist()):
+            self.assertTrue(torch.all(x_aug[n:] == 0))
+            shift = int((x_aug[:n] == 0).float().cumprod(0).sum())
+            self.assertLessEqual(shift, 1000)
+            gain = x_aug[shift] / x[0]
+            self.assertTrue(10 ** (-6 / 20) - 1e-4 <= gain <= 10 ** (6 / 20) + 1e-4)
+            self.assertTrue(torch.allclose(x_aug[shift:n], x[:n-shift] * gain, atol=1e-5))
+        # Noise from memory-mapped bank w/ given SNR
+        with tempfile.TemporaryDirectory() as path:
+            np.save(os.path.join(path, 'noise.npy'), 3 * np.random.randn(100000).astype(np.float32))
+            y = audio.WaveAugment(noise_bank=os.path.join(path, 'noise.npy'), snr=(10., 10.))(waveforms.clone(), wave_len)
+        for x, x_aug, n in zip(waveforms, y, wave_len.tolist()):
+            self.assertTrue(torch.all(x_aug[n:] == 0))
+            snr = 10 * torch.log10(x[:n].pow(2).sum() / (x_aug[:n] - x[:n]).pow(2).sum())
+            self.assertAlmostEqual(snr.item(), 10., places=3)
+
+    def test_spec_augment(self):
+        msp = torch.rand(3, 40, 200) + 0.1
+        msp_len = torch.LongTensor([200, 150, 60])
+        msp[1, :, 150:] = 0
+        msp[2, :, 60:] = 0
+        for w in [0, 5]:
+            spec_augment = audio.SpecAugment(2, 2, w=w)
+            y = spec_augment(msp.clone(), msp_len, torch.Generator().manual_seed(0))
+            self.assertTrue(torch.equal(y, spec_augment(msp.clone(), msp_len, torch.Generator().manual_seed(0))))
+            for x, n in zip(y, msp_len.tolist()):
+                # Masks only within valid frames, widths are bounded
+                self.assertTrue(torch.all(x[:, n:] == 0))
+                masked_freq = (x[:, :n] == 0).all(1)
+                masked_time = (x[:, :n] == 0).all(0)
+                self.assertLessEqual(int(masked_freq.sum()), 2 * 25)
+                self.assertLessEqual(int(masked_time.sum()), 2 * int(n * 0.1))
+                self.assertTrue(torch.all((x[:, :n] == 0) == (masked_freq.unsqueeze(1) | masked_time)))
+        # Time warping keeps end points of valid frames
+        spec_augment = audio.SpecAugment(0, 0, w=5)
+        y = spec_augment(msp.clone(), msp_len)
+        for x, x_warp, n in zip(msp, y, msp_len.tolist()):
+            self.assertTrue(torch.allclose(x_warp[:, [0, n - 1]], x[:, [0, n - 1]]))
+        self.assertTrue(torch.equal(audio.SpecAugment(0, 0)(msp.clone(), msp_len), msp))
+
+    def test_batch_feature(self):
+        audio_config = {
+            "feat_type": "fbank",
+            "feat_dim": 40,
+            "frame_length": 25,
+            "frame_shift": 10,
+            "ref_level_db": 20,
+            "min_level_db": -100,
+            "preemphasis_coeff": 0.97,
+            "delta_order": 2,
+            "delta_window_size": 2,
+        }
+        waveform = _load_wav(self.filepath)
+        # Lengths w/ and w/o remainder of frame shift
+        waveforms = [waveform, waveform[:, :16000], waveform[:, 3000:11001]]
+        for apply_cmvn in [False, True]:
+            config = dict(audio_config, apply_cmvn=apply_cmvn)
+            transform, d = audio.create_transform(config.copy())
+            transform = torch.nn.Sequential(*list(transform)[1:])
+            batch_transform, d_batch = audio.create_transform(dict(config, batch_feature=True))
+            self.assertEqual(d, d_batch)
+            feat, feat_len = batch_transform(waveforms)
+            self.assertEqual(list(feat.shape), [3, feat_len.max(), d])
+            for x, f, n in zip(waveforms, feat, feat_len):
+                y = transform(x)
+                self.assertEqual(len(y), n)
+                self.assertTrue(torch.allclose(f[:n], y, atol=1e-4))
+                self.assertEqual(f[n:].abs().sum(), 0)
+
+    def test_batch_feature_device(self):
+        audio_config = {
+            "feat_type": "fbank",
+            "feat_dim": 40,
+            "frame_length": 25,
+            "frame_shift": 10,
+            "ref_level_db": 20,
+            "min_level_db": -100,
+            "preemphasis_coeff": 0.97,
+        }
+        waveform = _load_wav(self.filepath)
+        augmented, _ = audio.create_transform(dict(audio_config, batch_feature='device', gain_db=6.,
+                                                   apply_audio_augment=[True, True, False, False],
+                                                   apply_spec_augment=True, mf=2, mt=2))
+        clean, _ = audio.create_transform(dict(audio_config, batch_feature='device'))
+        waveforms, wave_len = augmented.pad([waveform, waveform[:, :16000]])
+        # Validation features (augment=False) are deterministic and not augmented
+        feat, feat_len = augmented.extract(waveforms.clone(), wave_len, augment=False)
+        self.assertTrue(torch.equal(feat, augmented.extract(waveforms.clone(), wave_len, augment=False)[0]))
+        self.assertTrue(torch.equal(feat, clean.extract(waveforms.clone(), wave_len)[0]))
+        self.assertFalse(torch.equal(feat, augmented.extract(waveforms.clone(), wave_len)[0]))
+
+
+def _load_wav(filepath):
+    from scipy.io import wavfile
+    _, data = wavfile.read(filepath)
+    return torch.from_numpy(data.astype(np.float32) / 32768).unsqueeze(0)
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import soundfile
+import torch
+
+from src.audio import create_transform, ExtractAudioFeature
+from src.feature_store import FeatureStore, write_shard, write_index
+
+AUDIO_CONFIG = {
+    "feat_type": "fbank",
+    "feat_dim": 40,
+    "frame_length": 25,
+    "frame_shift": 10,
+    "ref_level_db": 20,
+    "min_level_db": -100,
+    "preemphasis_coeff": 0.97,
+}
+
+
+class TestFeatureStore(unittest.TestCase):
+    def setUp(self):
+        self.feat_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.feats = {'19-198-{:04d}'.format(i): rng.rand(rng.randint(50, 200), 40).astype(np.float32)
+                      for i in range(5)}
+
+    def tearDown(self):
+        shutil.rmtree(self.feat_dir)
+
+    def write(self, dtype):
+        # 2 shards
+        names = sorted(self.feats)
+        shards, utts = [], {}
+        for i, chunk in enumerate([names[:3], names[3:]]):
+            offset = 0
+            for name in chunk:
+                utts[name] = (i, offset, len(self.feats[name]))
+                offset += len(self.feats[name])
+            shards.append(write_shard(self.feat_dir, i, [self.feats[n] for n in chunk], dtype))
+        write_index(self.feat_dir, shards, utts, dtype, AUDIO_CONFIG)
+
+    def test_store(self):
+        for dtype, tol in [('fp16', 1e-3), ('int8', 0.5 / 255 + 1e-6)]:
+            self.write(dtype)
+            store = FeatureStore(self.feat_dir)
+            self.assertEqual(len(store), 5)
+            for name, feat in self.feats.items():
+                # Memory-mapped view w/o copy
+                self.assertIsInstance(store[name].base, np.memmap)
+                self.assertLessEqual((store.load(name).numpy() - feat).__abs__().max(), tol)
+            with self.assertRaises(ValueError):
+                store.check(dict(AUDIO_CONFIG, frame_shift=20))
+
+    def test_transform(self):
+        self.write('fp16')
+        config = dict(AUDIO_CONFIG, delta_order=1, feat_dir=self.feat_dir)
+        transform, feat_dim = create_transform(config)
+        self.assertEqual(feat_dim, 80)
+        feat = transform('/corpus/train-clean-100/19/198/19-198-0003.flac')
+        stored = torch.from_numpy(self.feats['19-198-0003'].astype(np.float16).astype(np.float32))
+        self.assertTrue(torch.allclose(feat[:, :40], stored, atol=1e-6))
+        self.assertEqual(list(feat.shape), [len(stored), 80])
+        # Speed perturbed variants must be extracted in advance
+        with self.assertRaises(ValueError):
+            create_transform(dict(AUDIO_CONFIG, feat_dir=self.feat_dir, speed_perturb=[0.9, 1.0, 1.1]))
+
+    def test_extract(self):
+        from util.extract_feature import extract_shard
+        # Augmentation options of training config are ignored, features are clean
+        filepath = 'tests/sample_data/3830-12529-0005.wav#0-16000'
+        config = dict(AUDIO_CONFIG, gain_db=6., noise_snr=[5., 20.], batch_feature=True)
+        shard, lengths = extract_shard(config, self.feat_dir, 0, [(filepath, 1.0)], 'fp16')
+        waveform, _ = soundfile.read('tests/sample_data/3830-12529-0005.wav', stop=16000, dtype='float32')
+        extractor = ExtractAudioFeature(mode='fbank', num_mel_bins=40, sample_rate=16000,
+                                        **{k: v for k, v in AUDIO_CONFIG.items() if k not in ['feat_type', 'feat_dim']})
+        ref = extractor(torch.from_numpy(waveform)[None])[0].t().numpy()
+        stored = np.load(os.path.join(self.feat_dir, shard)).astype(np.float32)
+        self.assertEqual(lengths, [len(ref)])
+        self.assertLessEqual(np.abs(stored - ref).max(), 1e-3)
+
+
+if __name__ == '__main__':
+    unittest.main()
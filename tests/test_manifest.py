@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import unittest
+from os.path import join, exists
+
+import json
+import numpy as np
+import soundfile
+import torch
+
+from corpus.preprocess_librispeech import LibriDataset, read_text, scan_split
+from corpus.preprocess_segments import SegmentDataset
+from src.audio import ReadAudio
+from src.feature_store import utt_id
+from src.manifest import load_manifest
+from src.text import load_text_encoder
+
+TRANSCRIPTS = ['HELLO WORLD', 'GOOD MORNING', 'A']
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        # LibriSpeech-like tree, <split>/<speaker>/<chapter>/<speaker>-<chapter>-<utt>.flac
+        self.path = tempfile.mkdtemp()
+        self.chapter = join(self.path, 'train-clean-100', '19', '198')
+        os.makedirs(self.chapter)
+        with open(join(self.chapter, '19-198.trans.txt'), 'w') as fp:
+            for i, txt in enumerate(TRANSCRIPTS):
+                soundfile.write(join(self.chapter, '19-198-{:04d}.flac'.format(i)),
+                                np.zeros(1600 * (i + 1), dtype=np.int16), 16000)
+                fp.write('19-198-{:04d} {}\n'.format(i, txt))
+        self.tokenizer = load_text_encoder('character', 'tests/sample_data/character.vocab')
+        self.n_scan = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def scan(self, split_dir):
+        self.n_scan += 1
+        return scan_split(split_dir)
+
+    def test_dataset(self):
+        dataset = LibriDataset(self.path, ['train-clean-100'], self.tokenizer, n_jobs=2)
+        self.assertTrue(exists(join(self.path, 'train-clean-100.manifest.jsonl')))
+        # Sorted by true duration (descending)
+        self.assertEqual(list(dataset.duration), [0.3, 0.2, 0.1])
+        self.assertEqual([self.tokenizer.decode(t) for t in dataset.text], TRANSCRIPTS[::-1])
+        self.assertTrue(dataset.file_list[0].endswith('19-198-0002.flac'))
+
+    def test_read_text(self):
+        file_list = [join(self.chapter, '19-198-{:04d}.flac'.format(i)) for i in [2, 0, 1]]
+        for n_jobs in [0, 2]:
+            self.assertEqual(read_text(file_list, n_jobs), [TRANSCRIPTS[i] for i in [2, 0, 1]])
+
+    def test_cache(self):
+        split_dir = join(self.path, 'train-clean-100')
+        entries = load_manifest(split_dir, self.tokenizer, self.scan)
+        self.assertEqual(load_manifest(split_dir, self.tokenizer, self.scan), entries)
+        self.assertEqual(self.n_scan, 1)
+        # Re-encode only if vocabulary changes
+        word = load_text_encoder('word', 'tests/sample_data/word.vocab')
+        reloaded = load_manifest(split_dir, word, self.scan)
+        self.assertEqual([e['tokens'] for e in reloaded], [word.encode(e['text']) for e in entries])
+        self.assertEqual(self.n_scan, 1)
+        # Rebuild if transcription is modified or file is removed
+        os.utime(join(self.chapter, '19-198.trans.txt'), (0, 0))
+        load_manifest(split_dir, self.tokenizer, self.scan)
+        self.assertEqual(self.n_scan, 2)
+        os.utime(self.chapter, (0, 0))
+        load_manifest(split_dir, self.tokenizer, self.scan)
+        os.remove(join(self.chapter, '19-198-0000.flac'))
+        self.assertEqual(len(load_manifest(split_dir, self.tokenizer, self.scan)), 2)
+        self.assertEqual(self.n_scan, 4)
+
+
+class TestSegments(unittest.TestCase):
+    def setUp(self):
+        # Long recording at 8kHz w/ 3 segments
+        self.path = tempfile.mkdtemp()
+        os.makedirs(join(self.path, 'train', 'rec'))
+        self.audio = (np.random.RandomState(0).randn(80000) * 3000).astype(np.int16)
+        soundfile.write(join(self.path, 'train', 'rec', 'long.flac'), self.audio, 8000)
+        self.segments = [(0, 8000), (20000, 36000), (40000, 44000)]
+        with open(join(self.path, 'train', 'segments.jsonl'), 'w') as fp:
+            for (start, end), txt in zip(self.segments, TRANSCRIPTS):
+                fp.write(json.dumps({'path': 'rec/long.flac', 'start': start, 'end': end, 'text': txt}) + '\n')
+        self.tokenizer = load_text_encoder('character', 'tests/sample_data/character.vocab')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_dataset(self):
+        dataset = SegmentDataset(self.path, ['train'], self.tokenizer, n_jobs=2)
+        self.assertEqual(list(dataset.duration), [2.0, 1.0, 0.5])
+        self.assertEqual([self.tokenizer.decode(t) for t in dataset.text], [TRANSCRIPTS[i] for i in [1, 0, 2]])
+        self.assertEqual(utt_id(dataset.file_list[0]), 'long_20000_36000')
+        # Only the range is read
+        read_audio = ReadAudio(8000)
+        for f, (start, end) in zip(dataset.file_list, [self.segments[i] for i in [1, 0, 2]]):
+            self.assertTrue(torch.equal(read_audio(f)[0], torch.from_numpy(self.audio[start:end] / 32768.).float()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import unittest
+import torch
+
+from src.asr import ASR, Encoder
+from src.module import RNNLayer
+from src.util import autocast
+
+
+class TestModule(unittest.TestCase):
+    def test_packed_rnn(self):
+        torch.manual_seed(0)
+        for style in ['drop', 'concat']:
+            layer = RNNLayer(8, 'LSTM', 16, True, 0.0, False, 2, style, False, pack=True).eval()
+            x_len = torch.LongTensor([13, 7, 4])
+            x = torch.randn(3, 13, 8)
+            output, out_len = layer(x, x_len)
+            self.assertEqual(out_len.tolist(), [6, 3, 2])
+            # Padded sequence gives the same result as the sequence alone
+            for i, l in enumerate(x_len.tolist()):
+                ref, _ = layer(x[i:i+1, :l], x_len[i:i+1])
+                torch.testing.assert_close(output[i, :out_len[i]], ref[0, :out_len[i]])
+        # Empty utterance w/o downsampling
+        layer = RNNLayer(8, 'LSTM', 16, True, 0.0, False, 1, 'drop', False, pack=True).eval()
+        output, out_len = layer(torch.randn(2, 5, 8), torch.LongTensor([5, 0]))
+        self.assertEqual(list(output.shape), [2, 5, 32])
+
+    def test_transformer_encoder(self):
+        torch.manual_seed(0)
+        for module in ['Transformer', 'Conformer']:
+            for pos_enc in ['sinusoidal', 'relative']:
+                encoder = Encoder(40, 0, -1, -1, module, True, [32, 32], [0.1, 0.1], [False, False], [False, False],
+                                  [2, 1], 'concat', num_head=4, pos_enc=pos_enc).eval()
+                self.assertEqual(encoder.sample_rate, 2)
+                self.assertEqual(encoder.out_dim, 32)
+                x_len = torch.LongTensor([21, 10])
+                x = torch.randn(2, 21, 40)
+                output, out_len = encoder(x, x_len)
+                self.assertEqual(out_len.tolist(), [10, 5])
+                # Padded frames do not affect valid ones
+                ref, _ = encoder(x[1:, :10], x_len[1:])
+                torch.testing.assert_close(output[1, :5], ref[0], atol=1e-5, rtol=1e-4)
+
+    def test_transformer_decoder(self):
+        torch.manual_seed(0)
+        encoder = dict(vgg=0, vgg_freq=-1, vgg_low_filt=-1, module='LSTM', bidirection=True, dim=[16],
+                       dropout=[0], layer_norm=[False], proj=[False], sample_rate=[1], sample_style='drop')
+        attention = dict(mode='dot', dim=16, num_head=1, temperature=1.0, v_proj=False,
+                         loc_kernel_size=1, loc_kernel_num=1)
+        decoder = dict(module='Transformer', dim=32, layer=2, dropout=0.1, num_head=4)
+        model = ASR(40, 10, 0.0, encoder, attention, decoder).eval()
+        feat, feat_len = torch.randn(2, 30, 40), torch.LongTensor([30, 17])
+        txt = torch.randint(2, 10, (2, 6))
+        with torch.no_grad():
+            _, _, output, att_seq, _ = model(feat, feat_len, 6, tf_rate=1.0, teacher=txt)
+            self.assertEqual(att_seq.shape, (2, 4, 6, 30))
+            # Incremental decoding w/ cached keys/values matches parallel teacher forcing
+            encode_feature, encode_len = model.encoder(feat, feat_len)
+            model.decoder.init_state(2)
+            model.decoder.set_memory(encode_feature, encode_len)
+            last_char = torch.zeros(2, dtype=torch.long)
+            for t in range(6):
+                char, _, _ = model.decoder.step(model.pre_embed(last_char))
+                torch.testing.assert_close(char, output[:, t], atol=1e-5, rtol=1e-4)
+                last_char = txt[:, t]
+
+    def test_checkpoint(self):
+        def run(checkpoint):
+            torch.manual_seed(0)
+            encoder = dict(vgg=0, vgg_freq=-1, vgg_low_filt=-1, module='LSTM', bidirection=True, dim=[16, 16],
+                           dropout=[0.1, 0.1], layer_norm=[False, False], proj=[True, True], sample_rate=[1, 2],
+                           sample_style='drop', checkpoint=checkpoint > 0)
+            attention = dict(mode='loc', dim=16, num_head=1, temperature=1.0, v_proj=False,
+                             loc_kernel_size=2, loc_kernel_num=4)
+            decoder = dict(module='LSTM', dim=16, layer=1, dropout=0, checkpoint=checkpoint)
+            model = ASR(40, 10, 0.5, encoder, attention, decoder, emb_drop=0.1)
+            feat, feat_len = torch.randn(2, 30, 40), torch.LongTensor([30, 17])
+            txt = torch.randint(2, 10, (2, 7))
+            ctc_output, _, output, _, _ = model(feat, feat_len, 7, tf_rate=0.5, teacher=txt)
+            (ctc_output.sum() + output.pow(2).sum()).backward()
+            return output, [p.grad for p in model.parameters()]
+        # Recomputed activations (incl. dropout and scheduled sampling) give identical gradients
+        ref, ref_grad = run(0)
+        output, grad = run(3)
+        torch.testing.assert_close(output, ref)
+        for g, r in zip(grad, ref_grad):
+            torch.testing.assert_close(g, r)
+
+    def test_att_loss(self):
+        torch.manual_seed(0)
+        encoder = dict(vgg=0, vgg_freq=-1, vgg_low_filt=-1, module='LSTM', bidirection=True, dim=[16],
+                       dropout=[0], layer_norm=[False], proj=[False], sample_rate=[1], sample_style='drop')
+        attention = dict(mode='dot', dim=16, num_head=1, temperature=1.0, v_proj=False,
+                         loc_kernel_size=1, loc_kernel_num=1)
+        decoder = dict(module='LSTM', dim=16, layer=1, dropout=0)
+        model = ASR(40, 10, 0.0, encoder, attention, decoder)
+        feat, feat_len = torch.randn(2, 30, 40), torch.LongTensor([30, 17])
+        txt = torch.randint(1, 10, (2, 7))
+        txt[1, 4:] = 0
+        _, _, output, _, _ = model(feat, feat_len, 7, tf_rate=1.0, teacher=txt)
+        ref = torch.nn.CrossEntropyLoss(ignore_index=0)(output.view(-1, 10), txt.view(-1))
+        # Lean forward w/o attention maps and logits, loss computed in chunks
+        _, _, output, att_seq, dec_state = model(feat, feat_len, 7, tf_rate=1.0, teacher=txt,
+                                                 get_att_seq=False, get_att_output=False)
+        self.assertIsNone(output)
+        self.assertIsNone(att_seq)
+        loss, pred = model.att_loss(dec_state, txt, chunk_size=3)
+        torch.testing.assert_close(loss, ref)
+        self.assertEqual(pred.shape, txt.shape)
+
+    def test_autocast(self):
+        torch.manual_seed(0)
+        encoder = dict(vgg=0, vgg_freq=-1, vgg_low_filt=-1, module='LSTM', bidirection=True, dim=[16],
+                       dropout=[0], layer_norm=[False], proj=[False], sample_rate=[1], sample_style='drop')
+        attention = dict(mode='loc', dim=16, num_head=1, temperature=1.0, v_proj=False,
+                         loc_kernel_size=3, loc_kernel_num=2)
+        decoder = dict(module='LSTM', dim=16, layer=1, dropout=0)
+        model = ASR(40, 10, 0.5, encoder, attention, decoder)
+        feat, feat_len = torch.randn(2, 30, 40), torch.LongTensor([30, 17])
+        txt = torch.randint(1, 10, (2, 7))
+        with autocast('cpu', dtype='bf16'):
+            ctc_output, encode_len, att_output, _, _ = model(feat, feat_len, 7, tf_rate=1.0, teacher=txt)
+            loss = torch.nn.CrossEntropyLoss(ignore_index=0)(att_output.view(-1, 10), txt.view(-1))
+            loss = loss + torch.nn.functional.ctc_loss(ctc_output.transpose(0, 1), txt, encode_len,
+                                                       torch.LongTensor([7, 7]))
+        self.assertEqual(att_output.dtype, torch.bfloat16)
+        # CTC output is kept in fp32 for loss/prefix scoring
+        self.assertEqual(ctc_output.dtype, torch.float32)
+        self.assertEqual(loss.dtype, torch.float32)
+        loss.backward()
+        for p in model.parameters():
+            self.assertEqual(p.grad.dtype, torch.float32)
+            self.assertTrue(torch.isfinite(p.grad).all())
+        # Disabled autocast does not change precision
+        with autocast('cpu', False):
+            self.assertEqual(model(feat, feat_len, 7, tf_rate=1.0, teacher=txt)[2].dtype, torch.float32)
+
+
+if __name__ == '__main__':
+    unittest.main()
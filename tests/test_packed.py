@@ -0,0 +1,37 @@
+import unittest
+import numpy as np
+import torch
+
+from src.packed import PackedSequences, PackedStrings
+from src.collect_batch import collect_text_batch
+
+
+class TestPacked(unittest.TestCase):
+    def test_sequences(self):
+        seqs = [[5, 6, 7], [], [8], [9, 10]]
+        packed = PackedSequences(seqs)
+        self.assertEqual(len(packed), 4)
+        self.assertEqual([s.tolist() for s in packed], seqs)
+        self.assertEqual(packed[-1].tolist(), [9, 10])
+        self.assertEqual(packed.lengths().tolist(), [3, 0, 1, 2])
+        # Bucket is a view of the flat array
+        bucket = packed[1:3]
+        self.assertIsInstance(bucket, PackedSequences)
+        self.assertIs(bucket.data, packed.data)
+        self.assertEqual([s.tolist() for s in bucket], seqs[1:3])
+        self.assertTrue(np.shares_memory(bucket[1], packed.data))
+        # Collected as lists of token ids
+        text = collect_text_batch([list(packed[0:2])], 'dev')
+        self.assertTrue(torch.equal(text, torch.LongTensor([[5, 6, 7], [0, 0, 0]])))
+
+    def test_strings(self):
+        paths = ['/corpus/19/198/19-198-0001.flac', '/corpus/é/long.flac#0-16000', '']
+        packed = PackedStrings(paths)
+        self.assertEqual(list(packed), paths)
+        self.assertEqual(packed[1], paths[1])
+        self.assertEqual(list(packed[:2]), paths[:2])
+        self.assertEqual(packed.data.dtype, np.uint8)
+
+
+if __name__ == '__main__':
+    unittest.main()
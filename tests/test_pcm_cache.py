@@ -0,0 +1,76 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import torch
+
+from src.audio import ReadAudio, resampler, create_transform
+from src.pcm_cache import PCMCache, SharedPCM, append_pcm, write_index, to_pcm
+
+AUDIO_CONFIG = {
+    "feat_type": "fbank",
+    "feat_dim": 40,
+    "frame_length": 25,
+    "frame_shift": 10,
+    "ref_level_db": 20,
+    "min_level_db": -100,
+    "preemphasis_coeff": 0.97,
+}
+
+
+class TestPCMCache(unittest.TestCase):
+    def setUp(self):
+        self.pcm_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.waveforms = {'19-198-{:04d}'.format(i): torch.from_numpy(0.1 * rng.randn(1, rng.randint(8000, 16000)))
+                          .float() for i in range(5)}
+        # Appended in 2 chunks
+        names = sorted(self.waveforms)
+        utts = {}
+        for chunk in [names[:3], names[3:]]:
+            index = append_pcm(self.pcm_dir, [to_pcm(self.waveforms[n]) for n in chunk])
+            utts.update(zip(chunk, index))
+        write_index(self.pcm_dir, utts, 16000)
+
+    def tearDown(self):
+        shutil.rmtree(self.pcm_dir)
+
+    def test_cache(self):
+        cache = PCMCache(self.pcm_dir)
+        self.assertEqual(len(cache), 5)
+        read_audio = ReadAudio(16000, self.pcm_dir)
+        for name, waveform in self.waveforms.items():
+            # Memory-mapped view w/o copy, int16 quantization
+            self.assertIsInstance(cache[name].base, np.memmap)
+            y = read_audio('/corpus/train-clean-100/19/198/{}.flac'.format(name))
+            self.assertEqual(y.shape, waveform.shape)
+            self.assertLessEqual((y - waveform).abs().max(), 0.5 / 32768 + 1e-7)
+        with self.assertRaises(ValueError):
+            ReadAudio(8000, self.pcm_dir)
+
+    def test_transform(self):
+        transform, _ = create_transform(dict(AUDIO_CONFIG, pcm_dir=self.pcm_dir))
+        filepath = '/corpus/train-clean-100/19/198/19-198-0003.flac'
+        waveform = self.waveforms['19-198-0003']
+        ref = torch.nn.Sequential(*list(transform)[1:])(torch.from_numpy(to_pcm(waveform) / 32768.).float()[None])
+        self.assertTrue(torch.equal(transform(filepath), ref))
+
+    def test_shared(self):
+        files = ['/corpus/train-clean-100/19/198/{}.flac'.format(name) for name in sorted(self.waveforms)]
+        read_audio = ReadAudio(16000, self.pcm_dir)
+        shared = SharedPCM(files, read_audio, n_jobs=2)
+        self.assertEqual(len(shared), 5)
+        self.assertTrue(shared.buffer.is_shared())
+        for i, f in enumerate(files):
+            # View of shared buffer, converted to float by ReadAudio
+            self.assertEqual(shared[i].untyped_storage().data_ptr(), shared.buffer.untyped_storage().data_ptr())
+            self.assertTrue(torch.equal(read_audio(shared[i]), read_audio(f)))
+
+    def test_resampler(self):
+        # Kernel is computed once per rate pair
+        self.assertIs(resampler(8000, 16000), resampler(8000, 16000))
+        self.assertEqual(resampler(8000, 16000)(torch.randn(1, 800)).shape[-1], 1600)
+
+
+if __name__ == '__main__':
+    unittest.main()
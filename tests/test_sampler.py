@@ -0,0 +1,57 @@
+import random
+import unittest
+
+from src.sampler import BucketBatchSampler, DistributedEvalSampler, FrameBudgetBatchSampler, padding_stats
+
+
+class TestSampler(unittest.TestCase):
+    def test_bucket_batch_sampler(self):
+        n, batch_size = 103, 4
+        sampler = BucketBatchSampler(n, batch_size, band=3, seed=1)
+        batches = list(sampler)
+        self.assertEqual(len(batches), len(sampler))
+        self.assertEqual(len(batches), 26)
+        # Each utterance once, buckets of similar length (within a band) in dataset order
+        self.assertEqual(sorted(sum(batches, [])), list(range(n)))
+        for b in batches:
+            self.assertEqual(b, sorted(b))
+            self.assertEqual(b[0] // (3 * batch_size), b[-1] // (3 * batch_size))
+        # Reshuffle every epoch
+        sampler.set_epoch(1)
+        self.assertNotEqual(list(sampler), batches)
+        # Processes take adjacent buckets at each step
+        split = [list(BucketBatchSampler(n, batch_size, seed=1, num_replicas=3, rank=r)) for r in range(3)]
+        for step in zip(*split):
+            self.assertEqual([b[0] for b in step], [step[0][0] + r * batch_size for r in range(3)])
+        self.assertEqual(len(split[0]), 8)
+
+    def test_distributed_eval_sampler(self):
+        data = list(range(11))
+        index = [list(DistributedEvalSampler(data, 4, r)) for r in range(4)]
+        self.assertEqual(sorted(sum(index, [])), data)
+
+    def test_frame_budget_batch_sampler(self):
+        rng = random.Random(0)
+        lengths = [rng.randint(100, 1500) for _ in range(500)] + [3000]
+        sampler = FrameBudgetBatchSampler(lengths, 4000, seed=1)
+        batches = list(sampler)
+        self.assertEqual(len(batches), len(sampler))
+        # Each utterance once, padded frames within budget (unless utterance alone exceeds it)
+        self.assertEqual(sorted(sum(batches, [])), list(range(len(lengths))))
+        for b in batches:
+            self.assertTrue(len(b) == 1 or max(lengths[i] for i in b) * len(b) <= 4000)
+        self.assertIn([500], batches)
+        # Batch order is shuffled every epoch
+        sampler.set_epoch(1)
+        self.assertNotEqual(list(sampler), batches)
+        # Less padding than fixed size batches of random utterances
+        fixed = [list(range(i, min(i + 8, len(lengths)))) for i in range(0, len(lengths), 8)]
+        self.assertLess(sampler.stats()['padding'], padding_stats(fixed, lengths)['padding'])
+        # Processes take equal number of disjoint batches
+        split = [list(FrameBudgetBatchSampler(lengths, 4000, num_replicas=2, rank=r)) for r in range(2)]
+        self.assertEqual(len(split[0]), len(split[1]))
+        self.assertFalse(set(sum(split[0], [])) & set(sum(split[1], [])))
+
+
+if __name__ == '__main__':
+    unittest.main()
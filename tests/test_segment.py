@@ -0,0 +1,38 @@
+import unittest
+import numpy as np
+import torch
+
+from src import segment
+
+
+class TestSegment(unittest.TestCase):
+    def test_find_segments(self):
+        score = np.zeros(200)
+        score[10:50] = 1.0
+        score[55:60] = 1.0    # Short pause, merged with previous one
+        score[100:102] = 1.0  # Too short, dropped
+        score[120:190] = 1.0
+        score[150] = 0.5      # Least active frame, used to split long segment
+        segments = segment.find_segments(score, 0.5, max_frames=60, min_silence_frames=10,
+                                         min_speech_frames=5, pad_frames=0)
+        self.assertEqual(segments, [(10, 60), (120, 150), (150, 190)])
+        # Short remainder after split (at frame 59), split evenly w/ previous segment within max_frames
+        score = np.ones(63)
+        score[59] = 0.5
+        segments = segment.find_segments(score, 0.5, max_frames=60, min_silence_frames=10,
+                                         min_speech_frames=5, pad_frames=0)
+        self.assertEqual(segments, [(0, 31), (31, 63)])
+        self.assertTrue(all(e - s <= 60 for s, e in segments))
+        # Tiny max_frames still terminates
+        self.assertEqual(segment.find_segments(np.ones(10), .5, 1, 1, 1, 0), [(i, i + 1) for i in range(10)])
+        with self.assertRaises(ValueError):
+            segment.find_segments(np.ones(10), .5, 0)
+
+    def test_energy_vad(self):
+        torch.manual_seed(0)
+        waveform = 1e-4 * torch.randn(1, 48000)
+        waveform[:, 16000:32000] += 0.5 * torch.randn(1, 16000)
+        segments = segment.energy_vad(waveform, max_segment=0.6, pad=0.0)
+        self.assertEqual(segments[0][0], 16000)
+        self.assertEqual(segments[-1][1], 32000)
+        self.assertTrue(all(e - s <= 0.6 * 16000 for s, e in segments))
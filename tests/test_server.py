@@ -0,0 +1,43 @@
+import asyncio
+import unittest
+import torch
+
+from src.server import BatchScheduler, LatencyStats
+
+
+class DummyRecognizer():
+    def __init__(self):
+        self.batches = []
+
+    def recognize(self, feats):
+        self.batches.append([len(f) for f in feats])
+        return [str(len(f)) for f in feats], {'encoder': 0.0, 'decoder': 0.0}
+
+
+class TestBatchScheduler(unittest.TestCase):
+    def _run(self, lengths, **kwargs):
+        recognizer = DummyRecognizer()
+        stats = LatencyStats()
+
+        async def main():
+            scheduler = BatchScheduler(recognizer, stats, **kwargs)
+            runner = asyncio.ensure_future(scheduler.run())
+            results = await asyncio.gather(*[scheduler.submit(torch.zeros(l, 4)) for l in lengths])
+            runner.cancel()
+            return results
+
+        return asyncio.run(main()), recognizer.batches, stats
+
+    def test_frame_budget(self):
+        lengths = [100, 100, 100, 300, 300, 50]
+        results, batches, stats = self._run(lengths, max_frames=600, max_batch=32, max_wait=0.05)
+        self.assertEqual([r[0] for r in results], [str(l) for l in lengths])
+        self.assertEqual(sum(len(b) for b in batches), len(lengths))
+        for b in batches:
+            self.assertTrue(len(b) == 1 or max(b) * len(b) <= 600)
+        self.assertEqual(sum(stats.batch_size.values()), len(batches))
+
+    def test_max_batch(self):
+        results, batches, _ = self._run([10] * 10, max_frames=10000, max_batch=4, max_wait=0.05)
+        self.assertEqual([len(b) for b in batches], [4, 4, 2])
+        self.assertTrue(all('queue' in r[1] for r in results))
@@ -0,0 +1,120 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import torch
+from os.path import join
+from scipy.io import wavfile
+from torch.utils.data import DataLoader
+
+from src.audio import create_transform
+from src.text import load_text_encoder
+from src.shard import ShardWriter, ShardDataset, write_index
+
+AUDIO_CONFIG = {
+    "feat_type": "fbank",
+    "feat_dim": 40,
+    "frame_length": 25,
+    "frame_shift": 10,
+    "ref_level_db": 20,
+    "min_level_db": -100,
+    "preemphasis_coeff": 0.97,
+}
+
+
+class TestShard(unittest.TestCase):
+    def setUp(self):
+        self.shard_dir = tempfile.mkdtemp()
+        self.tokenizer = load_text_encoder('character', 'tests/sample_data/character.vocab')
+        rng = np.random.RandomState(0)
+        self.names = ['19-198-{:04d}'.format(i) for i in range(10)]
+        self.tokens = {n: rng.randint(3, 30, rng.randint(5, 20)).tolist() for n in self.names}
+        self.audio = {n: (rng.randn(rng.randint(1600, 3200)) * 3000).astype(np.int16) for n in self.names}
+        self.feats = {n: rng.rand(rng.randint(50, 100), 40).astype(np.float32) for n in self.names}
+
+    def tearDown(self):
+        shutil.rmtree(self.shard_dir)
+
+    def write(self, kind, dtype='fp16'):
+        # 4 shards of train-clean-100
+        writer = ShardWriter(self.shard_dir, ['train-clean-100'], kind, shard_size=3, dtype=dtype)
+        for n in self.names:
+            filepath = join(self.shard_dir, n + '.wav')
+            wavfile.write(filepath, 16000, self.audio[n])
+            writer.write(filepath, self.tokens[n], self.feats[n] if kind == 'feature' else None)
+        write_index(self.shard_dir, kind, {writer.split: writer.close()}, self.tokenizer, AUDIO_CONFIG, dtype)
+
+    def test_audio(self):
+        self.write('audio')
+        ds = ShardDataset(self.shard_dir, ['train-clean-100'], self.tokenizer)
+        self.assertEqual(len(ds.shards), 4)
+        self.assertEqual(len(ds), 10)
+        # Sequential order w/o shuffle
+        for n, (waveform, tokens) in zip(self.names, ds):
+            self.assertEqual(tokens, self.tokens[n])
+            self.assertTrue(torch.equal(waveform[0], torch.from_numpy(self.audio[n] / 32768.).float()))
+        with self.assertRaises(ValueError):
+            ShardDataset(self.shard_dir, ['train-clean-100'], load_text_encoder('word', 'tests/sample_data/word.vocab'))
+
+    def test_shuffle(self):
+        self.write('audio')
+        ds = ShardDataset(self.shard_dir, ['train-clean-100'], self.tokenizer, shuffle=True, buffer_size=4)
+        ids = lambda items: [tuple(tokens) for _, tokens in items]
+        first = ids(ds)
+        self.assertEqual(sorted(first), sorted(tuple(self.tokens[n]) for n in self.names))
+        self.assertEqual(ids(ds), first)
+        ds.set_epoch(1)
+        self.assertNotEqual(ids(ds), first)
+        # Shards split over workers, each utterance is read once
+        loader = DataLoader(ds, batch_size=None, num_workers=2, multiprocessing_context='fork')
+        self.assertEqual(sorted(ids(loader)), sorted(first))
+
+    def test_replicas(self):
+        self.write('audio')
+        # Shards (3, 3, 3, 1 utterances) over 2 processes, each yields the min. over processes of its worker slot
+        for num_workers in [1, 2]:
+            counts = []
+            for rank in range(2):
+                ds = ShardDataset(self.shard_dir, ['train-clean-100'], self.tokenizer, shuffle=True,
+                                  num_workers=num_workers)
+                ds._replicas = lambda: (2, rank)
+                loader = DataLoader(ds, batch_size=None, num_workers=num_workers, multiprocessing_context='fork')
+                counts.append(len(list(loader)))
+                self.assertEqual(counts[-1], len(ds))
+            self.assertEqual(counts[0], counts[1])
+        # More processes x workers than shards
+        with self.assertRaises(ValueError):
+            list(DataLoader(ds, batch_size=None, num_workers=3, multiprocessing_context='fork'))
+        with self.assertRaises(ValueError):
+            ShardDataset(self.shard_dir, ['train-clean-100'], self.tokenizer, shuffle=True, num_workers=5)
+
+    def test_feature(self):
+        self.write('feature', 'int8')
+        ds = ShardDataset(self.shard_dir, ['train-clean-100'], self.tokenizer)
+        transform, _ = create_transform(dict(AUDIO_CONFIG, feat_dir=self.shard_dir))
+        for n, (feat, tokens) in zip(self.names, ds):
+            # Passed through LoadFeature (1 x MEL x T -> T x MEL)
+            feat = transform(feat)
+            self.assertEqual(feat.shape, self.feats[n].shape)
+            self.assertLessEqual((feat - torch.from_numpy(self.feats[n])).abs().max(), 0.5 / 255 + 1e-6)
+        with self.assertRaises(ValueError):
+            create_transform(dict(AUDIO_CONFIG, feat_dir=self.shard_dir, frame_shift=20))
+
+    def test_load_dataset(self):
+        from src.data import load_dataset
+        self.write('audio')
+        corpus = dict(name='Librispeech', path=self.shard_dir, train_split=['train-clean-100'],
+                      dev_split=['train-clean-100'], bucketing=False, batch_size=3, shard_dir=self.shard_dir)
+        text = dict(mode='character', vocab_file='tests/sample_data/character.vocab')
+        order = {}
+        for seed in [0, 1]:
+            tr_set, dv_set = load_dataset(0, False, False, False, corpus, dict(AUDIO_CONFIG), text, seed=seed)[:2]
+            # Training shards are shuffled w/ given seed, dev set is read in order
+            self.assertEqual(tr_set.dataset.seed, seed)
+            order[seed] = [tuple(t.tolist()) for _, _, _, txt in tr_set for t in txt]
+            self.assertEqual(sum(len(txt) for _, _, _, txt in dv_set), 10)
+        self.assertNotEqual(order[0], order[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# coding: utf-8
+import json
+import yaml
+import torch
+import argparse
+
+from src.audio import ReadAudio, SAMPLE_RATE
+from src.recognizer import Recognizer
+from src.segment import transcribe_long
+
+# Arguments
+parser = argparse.ArgumentParser(description='Transcribe long recordings with VAD segmentation.')
+parser.add_argument('--config', type=str, help='Path to decode config (same format as testing config).')
+parser.add_argument('--file', type=str, nargs='+', help='Audio file(s) to transcribe.')
+parser.add_argument('--output', default=None, type=str, help='Output json file, print to stdout if not given.')
+parser.add_argument('--decode', default=None, choices=['greedy', 'ctc', 'beam'],
+                    help='Decoding method, inferred from decode.beam_size if not given.')
+parser.add_argument('--vad', default='energy', choices=['energy', 'ctc'], help='Segmentation method.')
+parser.add_argument('--max_segment', default=20.0, type=float, help='Max. length (sec) of each segment.')
+parser.add_argument('--max_frames', default=20000, type=int, help='Max. padded frames (max len. x batch size) per batch.')
+parser.add_argument('--cpu', action='store_true', help='Disable GPU inference.')
+parser.add_argument('--cuda', default=0, type=int, help='Choose which gpu to use.')
+parser.add_argument('--amp', action='store_true', help='Mixed precision inference (bf16 on CPU, fp16 on GPU).')
+paras = parser.parse_args()
+config = yaml.load(open(paras.config, 'r'), Loader=yaml.FullLoader)
+
+device = 'cuda:' + str(paras.cuda) if (not paras.cpu) and torch.cuda.is_available() else 'cpu'
+recognizer = Recognizer(config, paras.decode, device, paras.amp)
+audio_reader = ReadAudio(SAMPLE_RATE)
+
+outputs = {}
+for f in paras.file:
+    waveform = audio_reader(f)[:1]
+    segments, transcript = transcribe_long(recognizer, waveform, paras.vad, paras.max_segment, paras.max_frames)
+    outputs[f] = {'duration': waveform.shape[-1] / SAMPLE_RATE, 'segments': segments, 'text': transcript}
+    print('[INFO] {} : {:.1f} sec, {} segments'.format(f, outputs[f]['duration'], len(segments)))
+
+if paras.output is None:
+    print(json.dumps(outputs, indent=2, ensure_ascii=False))
+else:
+    with open(paras.output, 'w', encoding='UTF-8') as fp:
+        json.dump(outputs, fp, indent=2, ensure_ascii=False)
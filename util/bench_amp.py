@@ -0,0 +1,104 @@
+import time
+import yaml
+import resource
+import argparse
+import multiprocessing as mp
+import torch
+
+from src.asr import ASR
+from src.util import autocast, amp_dtype
+
+SETTINGS = ['fp32', 'amp']
+
+
+def run(config, amp, args, queue):
+    ''' Measure time per step and peak memory of training and greedy decoding (in a separated process for CPU peak RSS)'''
+    torch.manual_seed(0)
+    device = torch.device('cuda' if args.cuda and torch.cuda.is_available() else 'cpu')
+    audio = config['data']['audio']
+    feat_dim = audio['feat_dim'] * (audio.get('delta_order', 0) + 1)
+    model = ASR(feat_dim, args.vocab_size, **config['model']).to(device)
+    optimizer = torch.optim.Adam(model.parameters())
+    scaler = None
+    if amp and amp_dtype(device, args.dtype) == torch.float16:
+        scaler = torch.amp.GradScaler(device.type)
+    feat = torch.randn(args.batch_size, args.frames, feat_dim, device=device)
+    feat_len = torch.full((args.batch_size,), args.frames, dtype=torch.long, device=device)
+    txt = torch.randint(2, args.vocab_size, (args.batch_size, args.tokens), device=device)
+
+    def train_step():
+        with autocast(device, amp, args.dtype):
+            ctc_output, encode_len, _, _, dec_state = model(feat, feat_len, args.tokens, tf_rate=1.0, teacher=txt,
+                                                            get_att_seq=False, get_att_output=False)
+            loss = torch.nn.functional.ctc_loss(ctc_output.transpose(0, 1), txt, encode_len,
+                                                torch.full_like(feat_len, args.tokens))
+            loss = loss + model.att_loss(dec_state, txt)[0]
+        optimizer.zero_grad()
+        if scaler is not None:
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+        else:
+            loss.backward()
+            optimizer.step()
+
+    def decode_step():
+        with torch.no_grad(), autocast(device, amp, args.dtype):
+            model(feat, feat_len, args.tokens)
+
+    result = []
+    for mode, step in [('train', train_step), ('decode', decode_step)]:
+        model.train(mode == 'train')
+        if device.type == 'cpu':
+            # Peak RSS can not be reset, measure from current RSS before first step (training goes first)
+            base = int(open('/proc/self/statm').read().split()[1]) * resource.getpagesize()
+        step()  # Warm up
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+            base = torch.cuda.memory_allocated()
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            step()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+            peak = torch.cuda.max_memory_allocated() - base
+        else:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - base if mode == 'train' else None
+        result.append((mode, (time.perf_counter() - start) / args.repeat, peak))
+    queue.put(result)
+
+
+def main(args):
+    config = yaml.load(open(args.config, 'r'), Loader=yaml.FullLoader)
+    device = 'cuda' if args.cuda and torch.cuda.is_available() else 'cpu'
+    ctx = mp.get_context('spawn')
+    print('Batch = {}, frames = {}, tokens = {}, AMP = {} on {}'.format(
+        args.batch_size, args.frames, args.tokens, str(amp_dtype(device, args.dtype)).replace('torch.', ''), device))
+    print('{:>8} {:>8} {:>14} {:>10} {:>16}'.format('setting', 'mode', 'time/step (s)', 'utt/sec', 'peak mem. (MB)'))
+    for setting in SETTINGS:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run, args=(config, setting == 'amp', args, queue))
+        proc.start()
+        proc.join()
+        if proc.exitcode != 0:
+            raise RuntimeError('Benchmark of setting "{}" failed.'.format(setting))
+        for mode, step_time, peak in queue.get():
+            # CPU peak RSS of decoding is hidden by training
+            peak = '-' if peak is None else '{:.1f}'.format(peak / 2**20)
+            print('{:>8} {:>8} {:>14.3f} {:>10.2f} {:>16}'.format(
+                setting, mode, step_time, args.batch_size / step_time, peak))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Report time per step and memory of native mixed precision against fp32.")
+    parser.add_argument("--config", default="config/librispeech_asr.yaml", type=str)
+    parser.add_argument("--batch_size", default=8, type=int)
+    parser.add_argument("--frames", default=800, type=int, help="Feature frames per utterance.")
+    parser.add_argument("--tokens", default=60, type=int, help="Decoder steps per utterance.")
+    parser.add_argument("--vocab_size", default=5000, type=int)
+    parser.add_argument("--dtype", default=None, choices=['fp16', 'bf16'],
+                        help="Precision of AMP, fp16 on GPU and bf16 on CPU by default.")
+    parser.add_argument("--repeat", default=2, type=int)
+    parser.add_argument("--cuda", action="store_true")
+    main(parser.parse_args())
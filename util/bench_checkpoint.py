@@ -0,0 +1,110 @@
+import time
+import yaml
+import resource
+import argparse
+import multiprocessing as mp
+import torch
+
+from src.asr import ASR
+
+SETTINGS = ['none', 'encoder', 'decoder', 'both', 'lean', 'lean+both']
+
+
+def build_model(config, setting, feat_dim, vocab_size, decode_block):
+    model_config = config['model']
+    model_config['encoder']['checkpoint'] = setting in ['encoder', 'both', 'lean+both']
+    model_config['decoder']['checkpoint'] = decode_block if setting in ['decoder', 'both', 'lean+both'] else 0
+    return ASR(feat_dim, vocab_size, **model_config)
+
+
+def run(config, setting, args, queue):
+    ''' Measure time per step and peak memory of one setting (in a separated process for CPU peak RSS)'''
+    torch.manual_seed(0)
+    device = torch.device('cuda' if args.cuda and torch.cuda.is_available() else 'cpu')
+    audio = config['data']['audio']
+    feat_dim = audio['feat_dim'] * (audio.get('delta_order', 0) + 1)
+    model = build_model(config, setting, feat_dim, args.vocab_size, args.decode_block).to(device).train()
+    feat = torch.randn(args.batch_size, args.frames, feat_dim, device=device)
+    feat_len = torch.full((args.batch_size,), args.frames, dtype=torch.long, device=device)
+    txt = torch.randint(2, args.vocab_size, (args.batch_size, args.tokens), device=device)
+
+    lean = setting.startswith('lean')
+
+    def forward():
+        # Lean forward skips attention maps and computes attention loss in chunks w/o full logits
+        ctc_output, encode_len, att_output, _, dec_state = model(feat, feat_len, args.tokens, tf_rate=1.0, teacher=txt,
+                                                                 get_att_seq=not lean, get_att_output=not lean)
+        loss = 0
+        if ctc_output is not None:
+            loss = loss + ctc_output.mean()
+        if att_output is not None:
+            loss = loss + torch.nn.functional.cross_entropy(att_output.reshape(-1, args.vocab_size), txt.reshape(-1))
+        elif dec_state is not None:
+            loss = loss + model.att_loss(dec_state, txt, args.loss_chunk)[0]
+        return loss
+
+    def step():
+        forward().backward()
+        model.zero_grad()
+
+    # Activations kept for backward pass (checkpointed regions only keep their inputs)
+    storage = {}
+    def pack(t):
+        storage[t.untyped_storage().data_ptr()] = t.untyped_storage().nbytes()
+        return t
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        loss = forward()
+    del loss
+    saved = sum(storage.values())
+
+    if device.type == 'cpu':
+        # Peak RSS can not be reset, measure from current RSS before first step
+        base = int(open('/proc/self/statm').read().split()[1]) * resource.getpagesize()
+    step()  # Warm up
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        step()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated() - base
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - base
+    queue.put(((time.perf_counter() - start) / args.repeat, saved, peak))
+
+
+def main(args):
+    config = yaml.load(open(args.config, 'r'), Loader=yaml.FullLoader)
+    ctx = mp.get_context('spawn')
+    print('Batch = {}, frames = {}, tokens = {}, decoder block = {} steps, loss chunk = {} steps'.format(
+        args.batch_size, args.frames, args.tokens, args.decode_block, args.loss_chunk))
+    print('{:>10} {:>14} {:>10} {:>16} {:>16}'.format(
+        'setting', 'time/step (s)', 'utt/sec', 'saved act. (MB)', 'peak mem. (MB)'))
+    for setting in SETTINGS:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run, args=(config, setting, args, queue))
+        proc.start()
+        proc.join()
+        if proc.exitcode != 0:
+            raise RuntimeError('Benchmark of setting "{}" failed.'.format(setting))
+        step_time, saved, peak = queue.get()
+        print('{:>10} {:>14.3f} {:>10.2f} {:>16.1f} {:>16.1f}'.format(
+            setting, step_time, args.batch_size / step_time, saved / 2**20, peak / 2**20))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Report memory and throughput of activation checkpointing and memory-lean forward.")
+    parser.add_argument("--config", default="config/librispeech_asr.yaml", type=str)
+    parser.add_argument("--batch_size", default=8, type=int)
+    parser.add_argument("--frames", default=1200, type=int, help="Feature frames per utterance (long utterance).")
+    parser.add_argument("--tokens", default=60, type=int, help="Decoder steps per utterance.")
+    parser.add_argument("--vocab_size", default=5000, type=int)
+    parser.add_argument("--decode_block", default=10, type=int, help="Decoder steps per checkpointed block.")
+    parser.add_argument("--loss_chunk", default=10, type=int, help="Decoder steps per chunk of attention loss (lean).")
+    parser.add_argument("--repeat", default=2, type=int)
+    parser.add_argument("--cuda", action="store_true")
+    main(parser.parse_args())
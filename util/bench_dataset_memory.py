@@ -0,0 +1,81 @@
+import os
+import gc
+import time
+import argparse
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader
+
+from src.packed import PackedSequences, PackedStrings
+
+
+def memory():
+    ''' RSS and private (copied-on-write or newly allocated, not shared w/ parent) memory of process in MB'''
+    stats = {}
+    with open('/proc/self/smaps_rollup', 'r') as fp:
+        for line in fp:
+            key, value = line.split(':', 1)
+            stats[key] = int(value.split()[0]) / 1024
+    return stats['Rss'], stats['Private_Clean'] + stats['Private_Dirty']
+
+
+class Index(Dataset):
+    ''' Dataset index as in corpus datasets, tuples of paths & token lists or packed arrays'''
+    def __init__(self, file_list, text, packed):
+        if packed:
+            self.file_list, self.text = PackedStrings(file_list), PackedSequences(text)
+        else:
+            self.file_list, self.text = tuple(file_list), tuple(text)
+
+    def __getitem__(self, index):
+        return self.file_list[index], self.text[index]
+
+    def __len__(self):
+        return len(self.file_list)
+
+
+def collect(batch):
+    # Read as in collect_batch, memory of worker after its batches (gc traverses all containers as in a long epoch)
+    [(str(f), torch.LongTensor(t)) for f, t in batch]
+    gc.collect()
+    return (os.getpid(),) + memory()
+
+
+def create_index(args, packed):
+    ''' Synthetic index of LibriSpeech-like paths and token ids, only the index is kept'''
+    rng = np.random.RandomState(0)
+    lengths = rng.randint(args.tokens // 2, args.tokens * 3 // 2, args.utts)
+    file_list = ['/corpus/LibriSpeech/train-960/{0}/{1}/{0}-{1}-{2:04d}.flac'.format(i // 10000, i // 100, i)
+                 for i in range(args.utts)]
+    text = [rng.randint(3, args.vocab, n).tolist() for n in lengths]
+    return Index(file_list, text, packed)
+
+
+def main(args):
+    for packed in [False, True]:
+        gc.collect()
+        base = memory()[0]
+        start = time.time()
+        ds = create_index(args, packed)
+        gc.collect()
+        print('{:<7}: index {:.0f} MB in main process, built in {:.1f} sec.'.format(
+            'packed' if packed else 'tuples', memory()[0] - base, time.time() - start))
+        loader = DataLoader(ds, batch_size=args.batch_size, num_workers=args.workers, collate_fn=collect,
+                            multiprocessing_context='fork')
+        workers = {}
+        for pid, rss, private in loader:
+            workers[pid] = (rss, private)
+        for pid, (rss, private) in sorted(workers.items()):
+            print('         worker {}: RSS {:.0f} MB, private {:.0f} MB'.format(pid, rss, private))
+        del ds, loader
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Measure memory of data loader workers over one epoch w/ dataset index as tuples vs. packed arrays.")
+    parser.add_argument("--utts", default=300000, type=int)
+    parser.add_argument("--tokens", default=100, type=int, help="Avg. tokens per utterance.")
+    parser.add_argument("--vocab", default=5000, type=int)
+    parser.add_argument("--batch_size", default=1000, type=int)
+    parser.add_argument("--workers", default=4, type=int)
+    main(parser.parse_args())
@@ -0,0 +1,59 @@
+import time
+import argparse
+import torch
+import torchaudio
+
+from src.audio import ExtractAudioFeature
+
+
+def reference(extractor, waveform):
+    ''' Feature extraction before MelFeature (full spectrogram, dB of linear spectrogram computed & dropped)'''
+    specgram = extractor.to_specgram(extractor._preemphasis(waveform)).sqrt()
+    melspecgram = extractor.to_melspecgram(specgram)
+    specgram = extractor._normalize(extractor._amp_to_db(specgram) - extractor.ref_level_db)
+    return extractor._normalize(extractor._amp_to_db(melspecgram) - extractor.ref_level_db)
+
+
+def timeit(fn, waveform, repeat):
+    ''' Best of repeat (sec.)'''
+    fn(waveform)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(waveform)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(args):
+    if args.file is not None:
+        waveform, _ = torchaudio.load(args.file)
+    else:
+        waveform = 0.1 * torch.randn(1, int(args.seconds * 16000))
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    print("Audio length : {:.2f} sec, {} mel bins, {} thread(s)".format(
+        waveform.shape[-1] / 16000, args.feat_dim, torch.get_num_threads()))
+    with torch.no_grad():
+        base = ExtractAudioFeature("fbank", args.feat_dim, 25, 10, 20, -100, 0.97)
+        n_frame = base(waveform).shape[-1]
+        elapsed = timeit(lambda x: reference(base, x), waveform, args.repeat)
+        print("{:<22}: {:>10.0f} frames/sec".format("reference (n_fft=1025)", n_frame / elapsed))
+        for n_fft in args.n_fft:
+            extractor = ExtractAudioFeature("fbank", args.feat_dim, 25, 10, 20, -100, 0.97, n_fft=n_fft)
+            elapsed = timeit(extractor, waveform, args.repeat)
+            print("{:<22}: {:>10.0f} frames/sec ({})".format(
+                "fused (n_fft={})".format(n_fft), n_frame / elapsed, extractor.feature.extra_repr()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Benchmark throughput (frames/sec.) of mel feature extraction.")
+    parser.add_argument("--file", default=None, type=str, help="Audio file, random noise is used if not given.")
+    parser.add_argument("--seconds", default=30.0, type=float)
+    parser.add_argument("--feat_dim", default=80, type=int)
+    parser.add_argument("--n_fft", default=[1025, 512], type=int, nargs='+')
+    parser.add_argument("--threads", default=0, type=int, help="Num. of intra-op threads, 0 for default.")
+    parser.add_argument("--repeat", default=10, type=int)
+    main(parser.parse_args())
@@ -0,0 +1,74 @@
+import time
+import argparse
+import numpy as np
+import torch
+
+from src.asr import Encoder
+
+
+def make_batches(lengths, batch_size, bucketing):
+    ''' Batches of utterance lengths, sorted by length if bucketing (as in src/data.py) '''
+    if bucketing:
+        lengths = np.sort(lengths)[::-1]
+    return [lengths[i:i+batch_size] for i in range(0, len(lengths), batch_size)]
+
+
+def run(encoder, batches, feat_dim, device, train):
+    encoder.train(train)
+    elapsed, n_frame, n_padded = 0.0, 0, 0
+    for lengths in batches:
+        x = torch.randn(len(lengths), int(lengths.max()), feat_dim, device=device)
+        x_len = torch.LongTensor(lengths.copy()).to(device)
+        start = time.perf_counter()
+        with torch.set_grad_enabled(train):
+            output, _ = encoder(x, x_len)
+            if train:
+                output.sum().backward()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        elapsed += time.perf_counter() - start
+        n_frame += int(lengths.sum())
+        n_padded += int(lengths.max()) * len(lengths)
+    return elapsed / len(batches), 1 - n_frame / n_padded
+
+
+def main(args):
+    device = torch.device('cuda' if args.cuda and torch.cuda.is_available() else 'cpu')
+    torch.manual_seed(0)
+    rng = np.random.RandomState(0)
+    # Utterance lengths (frames) drawn uniformly, e.g. 2 ~ 16 sec w/ 10ms shift
+    lengths = rng.randint(args.min_len, args.max_len + 1, size=args.n_utt)
+    config = dict(vgg=args.vgg, vgg_freq=-1, vgg_low_filt=-1, module='LSTM', bidirection=True,
+                  dim=[args.dim]*args.layers, dropout=[0.0]*args.layers, layer_norm=[False]*args.layers,
+                  proj=[False]*args.layers, sample_rate=[1]+[2]*(args.layers-1), sample_style='drop')
+
+    print('{:>6} {:>9} {:>8} {:>14} {:>14} {:>8}'.format(
+        'batch', 'bucketing', 'padding', 'padded (ms)', 'packed (ms)', 'speedup'))
+    for batch_size in args.batch_size:
+        for bucketing in [False, True]:
+            batches = make_batches(lengths, batch_size, bucketing)
+            result = []
+            for pack in [False, True]:
+                torch.manual_seed(0)
+                encoder = Encoder(args.feat_dim, pack=pack, **config).to(device)
+                run(encoder, batches[:1], args.feat_dim, device, args.train)  # Warm up
+                result.append(run(encoder, batches, args.feat_dim, device, args.train))
+            print('{:>6} {:>9} {:>7.1f}% {:>14.1f} {:>14.1f} {:>7.2f}x'.format(
+                batch_size, str(bucketing), result[0][1] * 100, result[0][0] * 1000, result[1][0] * 1000,
+                result[0][0] / result[1][0]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Benchmark encoder time per batch w/ and w/o packed sequences across batch sizes.")
+    parser.add_argument("--batch_size", default=[4, 8, 16], type=int, nargs='+')
+    parser.add_argument("--n_utt", default=64, type=int)
+    parser.add_argument("--min_len", default=200, type=int)
+    parser.add_argument("--max_len", default=1600, type=int)
+    parser.add_argument("--feat_dim", default=80, type=int)
+    parser.add_argument("--dim", default=256, type=int)
+    parser.add_argument("--layers", default=3, type=int)
+    parser.add_argument("--vgg", default=1, type=int)
+    parser.add_argument("--train", action="store_true", help="Include backward pass.")
+    parser.add_argument("--cuda", action="store_true")
+    main(parser.parse_args())
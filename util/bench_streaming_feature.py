@@ -0,0 +1,66 @@
+import time
+import argparse
+import numpy as np
+import torch
+import torchaudio
+
+from src.audio import create_transform, create_streaming_transform
+
+
+def main(args):
+    audio_config = {
+        "feat_type": "fbank",
+        "feat_dim": args.feat_dim,
+        "frame_length": 25,
+        "frame_shift": 10,
+        "ref_level_db": 20,
+        "min_level_db": -100,
+        "preemphasis_coeff": 0.97,
+        "apply_cmvn": False,
+        "delta_order": args.delta_order,
+        "delta_window_size": 2,
+    }
+    if args.file is not None:
+        waveform, _ = torchaudio.load(args.file)
+    else:
+        waveform = 0.1 * torch.randn(1, int(args.seconds * 16000))
+    chunk_size = int(args.chunk_ms / 1000 * 16000)
+
+    # Offline extraction (skip ReadAudio)
+    offline, _ = create_transform(audio_config.copy())
+    offline = torch.nn.Sequential(*list(offline)[1:])
+    start = time.perf_counter()
+    ref = offline(waveform)
+    offline_time = time.perf_counter() - start
+
+    # Streaming extraction
+    streaming, _ = create_streaming_transform(audio_config.copy())
+    latency, feats = [], []
+    for _ in range(args.repeat):
+        latency, feats = [], []
+        for i in range(0, waveform.shape[-1], chunk_size):
+            start = time.perf_counter()
+            feats.append(streaming(waveform[:, i:i+chunk_size]))
+            latency.append(time.perf_counter() - start)
+        feats.append(streaming.flush())
+    feats = torch.cat(feats)
+    latency = np.array(latency) * 1000
+
+    print("Audio length        : {:.2f} sec, chunk = {} ms".format(waveform.shape[-1] / 16000, args.chunk_ms))
+    print("Offline extraction  : {:.2f} ms".format(offline_time * 1000))
+    print("Per-chunk latency   : mean {:.3f} ms | p50 {:.3f} ms | p95 {:.3f} ms | max {:.3f} ms".format(
+        latency.mean(), np.percentile(latency, 50), np.percentile(latency, 95), latency.max()))
+    print("Real-time factor    : {:.4f}".format(latency.sum() / 1000 / (waveform.shape[-1] / 16000)))
+    print("Bit-identical       : {}".format(torch.equal(ref, feats)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Benchmark per-chunk latency of streaming feature extraction.")
+    parser.add_argument("--file", default=None, type=str, help="Audio file, random noise is used if not given.")
+    parser.add_argument("--seconds", default=30.0, type=float)
+    parser.add_argument("--chunk_ms", default=100, type=int)
+    parser.add_argument("--feat_dim", default=80, type=int)
+    parser.add_argument("--delta_order", default=1, type=int)
+    parser.add_argument("--repeat", default=3, type=int)
+    main(parser.parse_args())
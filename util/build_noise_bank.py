@@ -0,0 +1,30 @@
+import argparse
+import numpy as np
+from pathlib import Path
+from joblib import Parallel, delayed
+
+from src.audio import ReadAudio, SAMPLE_RATE
+
+
+def read_noise(file):
+    ''' Noise samples (first channel) resampled to SAMPLE_RATE'''
+    return ReadAudio(SAMPLE_RATE)(str(file))[0].numpy()
+
+
+def main(args):
+    files = sorted(f for ext in args.ext for f in Path(args.noise_dir).rglob('*.' + ext))
+    assert len(files) > 0, "No audio found @ {}".format(args.noise_dir)
+    noise = Parallel(n_jobs=args.njobs, prefer='threads')(delayed(read_noise)(f) for f in files)
+    bank = np.concatenate(noise).astype(np.float32)
+    np.save(args.out, bank)
+    print('{} files, {:.1f} hours of noise saved to {}. Set `noise_bank: {}` in audio config to use it.'
+          .format(len(files), len(bank) / SAMPLE_RATE / 3600, args.out, args.out))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Concatenate noise recordings (e.g. MUSAN noise) into a noise bank (.npy).")
+    parser.add_argument("--noise_dir", required=True, type=str)
+    parser.add_argument("--out", required=True, type=str, help="Output .npy file.")
+    parser.add_argument("--ext", default=['wav', 'flac'], type=str, nargs='+')
+    parser.add_argument("--njobs", default=8, type=int)
+    main(parser.parse_args())
@@ -0,0 +1,56 @@
+import os
+import time
+import yaml
+import argparse
+from os.path import join, exists
+from joblib import Parallel, delayed
+
+from src.audio import ReadAudio, SAMPLE_RATE
+from src.data import create_dataset
+from src.text import load_text_encoder
+from src.feature_store import utt_id
+from src.pcm_cache import PCMCache, append_pcm, write_index, to_pcm, INDEX_FILE
+
+
+def decode(file):
+    ''' Decoded & resampled waveform as int16 array'''
+    return to_pcm(ReadAudio(SAMPLE_RATE)(file))
+
+
+def main(args):
+    config = yaml.load(open(args.config, 'r'), Loader=yaml.FullLoader)
+    os.makedirs(args.out, exist_ok=True)
+
+    # Audio files of all splits in config (train/dev or dev/test)
+    tokenizer = load_text_encoder(**config['data']['text'])
+    corpus = dict(config['data']['corpus'], n_jobs=args.njobs)
+    sets = create_dataset(tokenizer, False, **corpus)[:2]
+    file_list = []
+    for ds in sets:
+        for d in (ds if type(ds) is list else [ds]):
+            file_list += [str(f) for f in d.file_list]
+
+    # Append to existing cache (e.g. caching test sets after training sets)
+    utts = PCMCache(args.out, SAMPLE_RATE).utts if exists(join(args.out, INDEX_FILE)) else {}
+    file_list = sorted(set(f for f in file_list if utt_id(f) not in utts))
+    print('Caching {} utterances @ {}'.format(len(file_list), args.out))
+
+    # Decoded in parallel, appended to the blob chunk by chunk (index is written after each chunk)
+    start = time.time()
+    for i in range(0, len(file_list), args.chunk_size):
+        chunk = file_list[i:i+args.chunk_size]
+        waveforms = Parallel(n_jobs=args.njobs)(delayed(decode)(f) for f in chunk)
+        for f, index in zip(chunk, append_pcm(args.out, waveforms)):
+            utts[utt_id(f)] = index
+        write_index(args.out, utts, SAMPLE_RATE)
+        print('{}/{} utterances, {:.1f} sec.'.format(i + len(chunk), len(file_list), time.time() - start))
+    print('Done, {} utterances in cache. Set `pcm_dir: {}` in audio config to use it.'.format(len(utts), args.out))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Decode audio of all splits in config into a memory-mapped int16 blob.")
+    parser.add_argument("--config", required=True, type=str)
+    parser.add_argument("--out", required=True, type=str, help="Directory of PCM cache.")
+    parser.add_argument("--chunk_size", default=2000, type=int, help="Utterances decoded before each write.")
+    parser.add_argument("--njobs", default=8, type=int)
+    main(parser.parse_args())
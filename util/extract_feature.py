@@ -0,0 +1,83 @@
+import os
+import time
+import yaml
+import argparse
+import torch
+from os.path import join, exists
+from joblib import Parallel, delayed
+
+from src.audio import create_transform, SpeedAugment
+from src.data import create_dataset
+from src.text import load_text_encoder
+from src.feature_store import FeatureStore, write_shard, write_index, utt_id, speed_id, STORE_DTYPES
+
+
+def extract_shard(audio_config, feat_dir, shard_id, file_list, dtype):
+    ''' Extract features (w/o augmentation/delta/CMVN, applied on the fly) of (file, speed) into a shard'''
+    torch.set_num_threads(1)
+    audio_config = dict(audio_config, delta_order=0, apply_cmvn=False, apply_spec_augment=False,
+                        apply_audio_augment=[False, False, False, False])
+    # Stored features are clean, augmentation/store/cache options do not apply
+    for key in ['feat_dir', 'speed_perturb', 'gain_db', 'noise_bank', 'noise_snr', 'batch_feature', 'pcm_dir']:
+        audio_config.pop(key, None)
+    transform, _ = create_transform(audio_config, post_process=False)
+    read_audio, extractor = transform[0], transform[-1]
+    speed_augment = SpeedAugment(sorted(set(s for _, s in file_list)))
+    with torch.no_grad():
+        feats = [extractor(speed_augment(read_audio(f), s))[0].t().numpy() for f, s in file_list] # T x MEL
+    return write_shard(feat_dir, shard_id, feats, dtype), [len(f) for f in feats]
+
+
+def main(args):
+    config = yaml.load(open(args.config, 'r'), Loader=yaml.FullLoader)
+    audio = config['data']['audio']
+    os.makedirs(args.out, exist_ok=True)
+
+    # Audio files of all splits in config (train/dev or dev/test)
+    tokenizer = load_text_encoder(**config['data']['text'])
+    corpus = dict(config['data']['corpus'], n_jobs=args.njobs)
+    sets = create_dataset(tokenizer, False, **corpus)[:2]
+    file_list = []
+    for ds in sets:
+        for d in (ds if type(ds) is list else [ds]):
+            file_list += [str(f) for f in d.file_list]
+
+    # Append to existing store (e.g. extracting test sets after training sets)
+    shards, utts, speeds = [], {}, set([1.0])
+    if exists(join(args.out, 'index.json')):
+        store = FeatureStore(args.out)
+        store.check(audio)
+        assert store.dtype == args.dtype, "Existing store is {}".format(store.dtype)
+        shards, utts, speeds = store.shard_files, store.utts, set(store.speeds)
+    # Speed perturbed variants are stored as extra utterances (sampled by LoadFeature w/ `speed_perturb`)
+    speeds |= set(args.speed)
+    file_list = sorted(set((f, s) for f in file_list for s in speeds if speed_id(utt_id(f), s) not in utts))
+    chunks = [file_list[i:i+args.shard_size] for i in range(0, len(file_list), args.shard_size)]
+    print('Extracting {} utterances (speed {}) into {} shards @ {}'.format(
+        len(file_list), sorted(speeds), len(chunks), args.out))
+
+    start = time.time()
+    results = Parallel(n_jobs=args.njobs, verbose=5)(
+        delayed(extract_shard)(audio, args.out, len(shards) + i, chunk, args.dtype) for i, chunk in enumerate(chunks))
+    for chunk, (shard, lengths) in zip(chunks, results):
+        offset = 0
+        for (f, s), length in zip(chunk, lengths):
+            utts[speed_id(utt_id(f), s)] = (len(shards), offset, length)
+            offset += length
+        shards.append(shard)
+    write_index(args.out, shards, utts, args.dtype, audio, speeds)
+    print('Done in {:.1f} sec., {} utterances in store. Set `feat_dir: {}` in audio config to use it.'
+          .format(time.time() - start, len(utts), args.out))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Extract features of all splits in config into sharded feature store.")
+    parser.add_argument("--config", required=True, type=str)
+    parser.add_argument("--out", required=True, type=str, help="Directory of feature store.")
+    parser.add_argument("--dtype", default='fp16', choices=list(STORE_DTYPES),
+                        help="Storage type, int8 quantizes normalized features ([0, 1]) w/ a fixed scale.")
+    parser.add_argument("--speed", default=[1.0], type=float, nargs='+',
+                        help="Speed perturbation factors to extract (e.g. 0.9 1.0 1.1), original (1.0) is always stored.")
+    parser.add_argument("--shard_size", default=2000, type=int, help="Utterances per shard.")
+    parser.add_argument("--njobs", default=8, type=int)
+    main(parser.parse_args())
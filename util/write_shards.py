@@ -0,0 +1,63 @@
+import time
+import yaml
+import random
+import argparse
+
+from src.data import create_dataset
+from src.text import load_text_encoder
+from src.feature_store import FeatureStore, utt_id
+from src.shard import ShardWriter, write_index
+
+
+def main(args):
+    config = yaml.load(open(args.config, 'r'), Loader=yaml.FullLoader)
+    audio = config['data']['audio']
+
+    # Splits in config (train/dev or dev/test) as indexed by corpus datasets
+    tokenizer = load_text_encoder(**config['data']['text'])
+    corpus = dict(config['data']['corpus'], n_jobs=args.njobs)
+    corpus.pop('shard_dir', None)
+    corpus.pop('read_audio', None)
+    assert type(corpus['dev_split'][0]) is not list, "Multiple dev sets are not available w/ shards"
+    sets = create_dataset(tokenizer, False, **corpus)
+    if sets[4] == 'train':
+        splits = [(corpus['train_split'], sets[0], True), (corpus['dev_split'], sets[1], False)]
+    else:
+        splits = [(corpus['dev_split'], sets[0], False), (corpus['test_split'], sets[1], False)]
+
+    # Features are packed from feature store (see util/extract_feature.py) instead of audio
+    store = None
+    if args.features:
+        store = FeatureStore(audio['feat_dir'])
+        store.check(audio)
+
+    start = time.time()
+    index = {}
+    for split, ds, shuffle in splits:
+        order = list(range(len(ds.file_list)))
+        if shuffle:
+            # Training set is stored in random order, so that shuffled shards mix utterances of all lengths
+            random.Random(args.seed).shuffle(order)
+        writer = ShardWriter(args.out, split, 'feature' if store else 'audio', args.shard_size,
+                             store.dtype if store else None)
+        for i in order:
+            f = ds.file_list[i]
+            writer.write(f, [int(t) for t in ds.text[i]], store.load(utt_id(f)) if store else None)
+        index[writer.split] = writer.close()
+        print('{}: {} utterances in {} shards, {:.1f} sec.'.format(
+            writer.split, len(order), len(index[writer.split]['shards']), time.time() - start))
+    write_index(args.out, 'feature' if store else 'audio', index, tokenizer, audio,
+                store.dtype if store else None)
+    print('Done. Set `shard_dir: {}` in corpus config to use it.'.format(args.out))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Pack all splits in config into sequential tar shards (audio/feature + tokens).")
+    parser.add_argument("--config", required=True, type=str)
+    parser.add_argument("--out", required=True, type=str, help="Directory of shards.")
+    parser.add_argument("--features", action='store_true',
+                        help="Pack precomputed features of `feat_dir` in audio config instead of audio files.")
+    parser.add_argument("--shard_size", default=1000, type=int, help="Utterances per shard.")
+    parser.add_argument("--seed", default=0, type=int, help="Seed of training set order.")
+    parser.add_argument("--njobs", default=8, type=int)
+    main(parser.parse_args())